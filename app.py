@@ -1,22 +1,49 @@
 import streamlit as st
 from PIL import Image
-import base64
 import time
 import streamlit.components.v1 as components
 import json
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 from streamlit_autorefresh import st_autorefresh
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import pandas as pd
-import re
+import numpy as np
+import altair as alt
 import streamlit_image_select as sis
-from fpdf import FPDF
 import io
-import markdown
-from utils.qwen_agent import call_qwen_agent
+from utils.qwen_agent import call_qwen_agent, call_qwen_agent_cached
+from utils.report_template import get_template
+from utils.agent_html import PLAN_AGENTS, render_agent_blocks
+from utils.build_artifacts import (LOGO_DATA_URI, PREDICTION_REPORT_PDF, STRUCTURED_REPORT_PDF, BuildArtifacts,
+                                   agent_artifact, load_artifacts)
+from utils.semantic_cache import SemanticCache
+from utils.static_assets import (STATIC_URL_PREFIX, icon, logo_src, sprite_tag, static_serving_enabled,
+                                 stylesheet_tag)
+from utils.bulk_export import EXPORT_TTL, export_cases_zip_parts, purge_exports
+from utils.case_search import CaseSearchIndex
+from utils.case_store import CASE_DB_FILE, CaseStore
+from utils.chat_extractor import ChatFeatureExtractor
+from utils.delta_stats import DeltaRecorder, install_delta_recorder
+from utils.structured_log import begin_rerun, setup_logging
+from utils.rerun_profiler import PROFILE_PARAM, ProfileResult, RerunProfile, profiling_requested
+from utils.session_store import SESSION_PARAM, SessionStore, attach_session, open_session_store
+from utils.patient_pipeline import PipelineGraph, build_patient_pipeline
+from utils.trajectory_model import FEATURE_RANGES, HORIZONS, OUTPUT_METRICS, TrajectoryModel
+from utils.model_registry import ModelRegistry
+from utils.visit_store import VISIT_DB_FILE, VisitStore, compare, trajectory_rows
+from utils.cohort_stats import AGE_BANDS, BMI_BANDS, KL_GRADES, CohortStats
+from utils.xray_analysis import (AnalysisCache, CannedAnalyzer, MAX_DICOM_UPLOAD_BYTES, MAX_UPLOAD_BYTES,
+                                 UPLOAD_DIR, XRAY_DB_FILE, hash_file, store_upload)
+from utils.dicom_ingest import DICOM_SUFFIXES, DicomImage, is_dicom
+from utils.xray_overlay import OverlayPyramid, get_pyramid, purge_stale as purge_stale_overlays
+from utils.xray_preprocess import INDEX_FILE as PREPROCESS_INDEX_FILE, PREPROCESS_DIR, PreprocessedStore
+from utils.guideline_index import SCENARIO_TITLES, GuidelineIndex, load_or_build_index
 import os
 import math
 import html
+import textwrap
+import logging
 
 
 # =============================================================================
@@ -34,33 +61,53 @@ CHAT_CONFIG = {
 }
 
 IMAGE_PATHS = {
-    "logo": "images/logo.png",
     "framework": "images/framework.png",
     "status_framework": "images/status_framework.png",
     "predicting_framework": "images/predicting_framework.png",
     "recommendation_framework": "images/Recommendation_framework.png"
 }
 
+SEMANTIC_CACHE_CONFIG = {
+    "max_entries": 2048,
+    "threshold": 0.92
+}
+
+chat_log = logging.getLogger("kom.chat.render")
+qwen_log = logging.getLogger("kom.qwen")
+
 CASES_FILE = "cases.json"
+CASE_PAGE_SIZE = 20
 PARAMS_FILE = "predict_params.json"
 PREDICT_FILE = "predict_params_ori.json"
 
+# 预测页可手动调整的输入，调整后只重算依赖这些字段的节点
+ADJUSTABLE_FEATURES = {
+    "AGE": "Age",
+    "BMI": "BMI",
+    "WEIGHT": "Weight (kg)",
+}
+
+# what-if 可扫描的特征；一维扫描取 WHAT_IF_STEPS[0] 个点，二维每轴 WHAT_IF_STEPS[1] 个点
+WHAT_IF_FEATURES = {
+    "BMI": "BMI",
+    "WEIGHT": "Weight (kg)",
+    "AGE": "Age",
+    "RFmaxF": "Right lower-limb max force",
+    "LFmaxF": "Left lower-limb max force",
+    "XRKL_R": "KL grade, right knee",
+    "XRKL_L": "KL grade, left knee",
+    "KOOSPain_R": "Baseline KOOS pain, right",
+    "KOOSPain_L": "Baseline KOOS pain, left",
+    "KOOSQOL": "Baseline KOOS QOL",
+}
+WHAT_IF_STEPS = (60, 30)
+# 叠加视图视口（瓦片数，列 × 行）
+OVERLAY_VIEWPORT = (2, 2)
+
 
 # =============================================================================
 # 工具函数
 # =============================================================================
-@st.cache_data
-def get_base64_image(image_path: str) -> Optional[str]:
-    """安全获取图片base64编码"""
-    try:
-        if Path(image_path).exists():
-            with open(image_path, "rb") as f:
-                data = f.read()
-            return base64.b64encode(data).decode()
-    except Exception as e:
-        st.error(f"无法加载图片 {image_path}: {e}")
-    return None
-
 @st.cache_data
 def load_initial_chat_history(file_path: str = "initial_chat.json") -> List[Dict]:
     try:
@@ -83,15 +130,74 @@ def load_analysis_report(json_file="assess_result.json") -> Dict:
         return {}
 
 
-@st.cache_data
-def load_case_data() -> Dict:
+@st.cache_resource
+def get_case_store() -> Optional[CaseStore]:
+    """病例库（SQLite/WAL），首次使用或 cases.json 变化时导入"""
     try:
-        if Path(CASES_FILE).exists():
-            with open(CASES_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
+        store = CaseStore(CASE_DB_FILE)
+        store.sync_from_json(CASES_FILE)
+        return store
     except Exception as e:
         st.error(f"无法加载病例数据: {e}")
-    return {}
+    return None
+
+
+@st.cache_resource
+def get_session_store() -> Optional[SessionStore]:
+    """会话存储（默认 SQLite/WAL），多个副本共享，按 ?sid= 恢复进度"""
+    try:
+        return open_session_store()
+    except Exception as e:
+        st.warning(f"会话存储不可用，进度仅保存在本进程: {e}")
+    return None
+
+
+@st.cache_resource
+def get_semantic_cache() -> SemanticCache:
+    """进程级语义缓存，所有会话共享"""
+    return SemanticCache(**SEMANTIC_CACHE_CONFIG)
+
+
+@st.cache_resource
+def get_guideline_index() -> GuidelineIndex:
+    """加载预构建的指南倒排索引（python -m utils.guideline_index build）"""
+    return load_or_build_index()
+
+
+@st.cache_data
+def load_structured_report(json_path: str = "structured_report_template.json") -> Dict:
+    with open(json_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@st.cache_resource
+def get_case_search_index(_store: CaseStore) -> CaseSearchIndex:
+    """病例全文索引（标题、对话内容、智能体角色，CJK 二元切分）"""
+    return CaseSearchIndex(_store)
+
+
+@st.cache_resource
+def get_build_artifacts() -> BuildArtifacts:
+    """预构建产物（python -m utils.build_artifacts build）；源文件有变化的条目不加载，改为现场渲染"""
+    return load_artifacts()
+
+
+def structured_report_pdf(report: Dict) -> bytes:
+    pdf = get_build_artifacts().get(STRUCTURED_REPORT_PDF, report)
+    return pdf if pdf is not None else get_template("structured_report").render_pdf(report)
+
+
+def prediction_report_pdf(prediction: Dict) -> bytes:
+    """预测内容与构建时相同则用预构建 PDF，否则现场渲染"""
+    pdf = get_build_artifacts().get(PREDICTION_REPORT_PDF, prediction)
+    return pdf if pdf is not None else get_template("prediction_report").render_pdf(prediction)
+
+
+def agent_html_blocks(agent_type: str, plan: Dict) -> List[str]:
+    blocks = get_build_artifacts().blocks(agent_artifact(agent_type), plan)
+    if blocks is None:
+        blocks = render_agent_blocks(agent_type, plan, get_guideline_index(), load_structured_report())
+    return blocks
 
 
 def load_plan(agent_type: str):
@@ -99,37 +205,133 @@ def load_plan(agent_type: str):
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
-def clean_text_for_pdf(text: str) -> str:
-    replacements = {
-        "–": "-",  
-        "—": "-",  
-        "“": "\"",  
-        "”": "\"",
-        "’": "'",
-        "•": "-", 
-        "→": "->",
-        "…": "...",
-        "©": "(c)",
-    }
-    for old, new in replacements.items():
-        text = text.replace(old, new)
-    return text.encode("latin-1", "ignore").decode("latin-1")
 
+@st.cache_resource
+def get_model_registry() -> ModelRegistry:
+    """进程级模型注册表：权重以只读内存映射打开，各 worker 经页缓存共享同一份"""
+    return ModelRegistry()
+
+
+@st.cache_resource
+def get_visit_store() -> VisitStore:
+    """纵向随访库（观测随访 + 各模型版本的预测）"""
+    return VisitStore(VISIT_DB_FILE)
+
+
+@st.cache_resource
+def get_cohort_stats() -> CohortStats:
+    """队列汇总（与随访同库，随新随访增量更新）"""
+    return CohortStats(get_visit_store(), get_guideline_index())
+
+
+@st.cache_resource
+def get_xray_analyzer() -> CannedAnalyzer:
+    """X 线分析器；接入影像模型前返回预生成报告，版本号随报告内容变化"""
+    return CannedAnalyzer()
+
+
+@st.cache_resource
+def get_analysis_cache() -> AnalysisCache:
+    """按 (图像内容哈希, 分析器版本) 缓存的分析结果；启动时清掉旧版本产生的条目（含叠加瓦片）"""
+    cache = AnalysisCache(XRAY_DB_FILE)
+    cache.purge_stale(get_xray_analyzer().version)
+    purge_stale_overlays(get_xray_analyzer().version)
+    return cache
+
+
+@st.cache_data
+def image_sha256(path: str, mtime_ns: int) -> str:
+    return hash_file(path)
+
+
+def analyse_image(path: str) -> Dict:
+    """同一张片子（按内容）只分析一次，重新上传直接命中缓存"""
+    sha = image_sha256(path, os.stat(path).st_mtime_ns)
+    return get_analysis_cache().analyse(get_xray_analyzer(), sha, path)
+
+
+@st.cache_resource
+def get_preprocessed_store() -> Optional[PreprocessedStore]:
+    """批量预处理结果（python -m utils.xray_preprocess）；未生成时为 None"""
+    if not (Path(PREPROCESS_DIR) / PREPROCESS_INDEX_FILE).exists():
+        return None
+    return PreprocessedStore(PREPROCESS_DIR)
+
+
+@st.cache_resource(max_entries=64)
+def get_overlay_pyramid(sha256: str, model_version: str, path: str) -> OverlayPyramid:
+    """显著图叠加瓦片：每张片子、每个分析器版本只生成一次（落盘，重启后仍复用）"""
+    return get_pyramid(sha256, model_version, path, get_xray_analyzer().saliency,
+                       store=get_preprocessed_store())
 
-def strip_non_latin1(text: str) -> str:
-    """去除无法被 Latin-1 编码的字符（如 emoji、中文）"""
-    return text.encode("latin-1", errors="ignore").decode("latin-1")
 
-def generate_pdf(text: str) -> bytes:
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Arial", size=12)
+@st.cache_resource(max_entries=16)
+def open_dicom(path: str, mtime_ns: int) -> DicomImage:
+    """头信息只解析一次；像素是内存映射，缓存的对象本身几乎不占内存"""
+    return DicomImage(path)
 
-    for line in text.split("\n"):
-        clean_line = strip_non_latin1(line)
-        pdf.multi_cell(0, 10, txt=clean_line)
 
-    return pdf.output(dest="S").encode("latin1")
+@st.cache_data(max_entries=64)
+def dicom_preview_png(path: str, mtime_ns: int, frame: int, max_size: int = 1024) -> bytes:
+    buffer = io.BytesIO()
+    open_dicom(path, mtime_ns).preview(frame, max_size).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def get_trajectory_model() -> Optional[TrajectoryModel]:
+    """
+    KOOS 轨迹模型的当前版本（训练作业发布、python -m utils.model_registry 切换，运行中自动生效）。
+    注册表中没有、或版本未注明 fitted（如旧的示意系数）时返回 None，依赖它的视图不显示。
+    """
+    model = get_model_registry().get(TrajectoryModel.ARTIFACT_NAME, TrajectoryModel.from_artifact)
+    return model if model is not None and model.fitted else None
+
+
+def predict_trajectory(features: Dict) -> Dict:
+    """
+    完整模型预生成的预测（KOOS / 影像轨迹、SHAP 等）。
+    注册表中的线性 TrajectoryModel 只用于 what-if 与随访对照，不覆盖这里的预测值。
+    """
+    return load_default_params(PREDICT_FILE)
+
+
+def plan_agent(agent_type: str):
+    """治疗方案智能体；目前返回预先生成的 *_plan.json"""
+    def run(**_upstream) -> Dict:
+        return load_plan(agent_type)
+    return run
+
+
+def get_patient_pipeline() -> PipelineGraph:
+    """
+    每个会话一条流水线（评估 → 特征 → 预测 → 方案），节点备忘跨 rerun 保留。
+    每次只刷新输入；内容未变化时整条链直接复用上次结果。
+    """
+    pipeline = st.session_state.get("patient_pipeline")
+    if pipeline is None:
+        pipeline = build_patient_pipeline(
+            # 影像分析目前为预先生成的结果
+            assess=lambda source: source,
+            predict=predict_trajectory,
+            plan_agents={name: plan_agent(name) for name in PLAN_AGENTS},
+        )
+        st.session_state.patient_pipeline = pipeline
+    # 已选片子的分析结果（按内容哈希缓存）；未选时为预生成的默认报告。
+    # 只有上传的片子经真实分析器得到的结果才并入患者特征，示例报告只用于展示
+    image_path = st.session_state.get("selected_image_path")
+    if image_path and os.path.exists(image_path):
+        pipeline.set_input("assessment_source", analyse_image(image_path)["report"])
+        uploaded = Path(image_path).resolve().is_relative_to(Path(UPLOAD_DIR).resolve())
+        pipeline.set_input("assessment_measured",
+                           uploaded and not getattr(get_xray_analyzer(), "sample", False))
+    else:
+        pipeline.set_input("assessment_source", load_analysis_report().get("default", {}))
+        pipeline.set_input("assessment_measured", False)
+    pipeline.set_input("default_params", load_default_params(PARAMS_FILE))
+    pipeline.set_input("chat_record", resolve_chat_features())
+    model = get_trajectory_model()
+    pipeline.set_input("model_version", model.version if model is not None else None)
+    return pipeline
 
 def safe_image_display(image_path: str, caption: str = "", **kwargs):
     """显示图片"""
@@ -141,118 +343,17 @@ def safe_image_display(image_path: str, caption: str = "", **kwargs):
     except Exception as e:
         st.error(f"显示图片时出错: {e}")
 
-def generate_report_text_from_prediction(params: dict) -> str:
-    lines = []
-    
-    # 1. Symptom Trajectory Forecast
-    lines.append("📊 Symptom Trajectory Forecast (KOOS, 0–100)")
-    symptom_rows = [
-        ("Right Knee Pain", "symptom_trajectory.right_knee.pain"),
-        ("Right Knee Symptoms", "symptom_trajectory.right_knee.symptoms"),
-        ("Left Knee Pain", "symptom_trajectory.left_knee.pain"),
-        ("Left Knee Symptoms", "symptom_trajectory.left_knee.symptoms"),
-        ("Sport/Recreation Function", "symptom_trajectory.right_knee.sport_recreation_function"),
-        ("Quality of Life", "symptom_trajectory.right_knee.quality_of_life")
-    ]
-    for label, base_key in symptom_rows:
-        v00 = params.get(f"{base_key}.v00", "N/A")
-        v01 = params.get(f"{base_key}.v01", "N/A")
-        v04 = params.get(f"{base_key}.v04", "N/A")
-        lines.append(f"- {label}:  Current={v00}, Year 2={v01}, Year 4={v04}")
-    lines.append("")
-
-    # 2. Imaging Trajectory Forecast
-    lines.append("🦴 Imaging Trajectory (KL grade, 0–4)")
-    for side in ["right", "left"]:
-        v00 = params.get(f"imaging_trajectory.{side}_knee.pain.v00", "N/A")
-        v01 = params.get(f"imaging_trajectory.{side}_knee.pain.v01", "N/A")
-        v04 = params.get(f"imaging_trajectory.{side}_knee.pain.v04", "N/A")
-        lines.append(f"- {side.capitalize()} Knee:  Current={v00}, Year 2={v01}, Year 4={v04}")
-    lines.append("")
-
-    # 3. SHAP Key Factors
-    lines.append("💡 Key Contributing Factors (SHAP)")
-    shap_data = params.get("key_factors.right_knee_symptoms_year2", [])
-    for item in shap_data:
-        feature = item.get("feature", "Unknown")
-        impact = item.get("impact", "N/A")
-        effect = item.get("effect", "")
-        lines.append(f"- {feature}: {impact} ({effect})")
-
-    return "\n".join(lines)
-
-
 # =============================================================================
 # 样式定义
 # =============================================================================
-def get_navigation_styles(logo_base64: str) -> str:
-    """获取导航栏样式"""
-    return f"""
-    <style>
-    .nav-container {{
-        display: flex;
-        justify-content: space-between;
-        align-items: center;
-        border-bottom: 1px solid #ddd;
-        flex-wrap: wrap;
-        margin-bottom: 0;
-    }}
-    .left-section {{
-        display: flex;
-        align-items: center;
-        gap: 20px;
-        flex: 1;
-        min-width: 300px;
-    }}
-    .app-title {{
-        color: #4B6EAF;
-        font-family: "Segoe UI", sans-serif;
-    }}
-    .app-title div:first-child {{
-        font-size: 20px;
-        font-weight: bold;
-    }}
-    .app-title div:last-child {{
-        font-size: 18px;
-    }}
-    .logo-img {{
-        height: 70px;
-    }}
-    .nav-buttons {{
-        display: flex;
-        align-items: center;
-        gap: 12px;
-        flex-wrap: wrap;
-        justify-content: flex-end;
-    }}
-    .nav-buttons form {{ margin: 0; }}
-    .agent-button {{
-        font-size: 16px;
-        padding: 10px 16px;
-        display: inline-flex;
-        align-items: center;
-        background-color: #f0f0f0;
-        border: 2px solid #ccc;
-        border-radius: 6px;
-        cursor: pointer;
-        transition: background-color 0.2s ease;
-        box-shadow: 1px 1px 5px rgba(0,0,0,0.1);
-    }}
-    .agent-button:hover {{ background-color: #e0e0e0; }}
-    .agent-button img {{
-        width: 24px;
-        height: 24px;
-        margin-right: 8px;
-    }}
-    .arrow-icon {{
-        font-size: 20px;
-        color: #888;
-    }}
-    </style>
-
+def get_navigation_html(sid: Optional[str] = None) -> str:
+    """导航栏：样式与图标来自 static/ 下带版本号的静态文件；导航会新建会话，带上 sid 以恢复进度"""
+    robot = icon("robot")
+    sid_input = f'<input type="hidden" name="{SESSION_PARAM}" value="{html.escape(sid)}">' if sid else ""
+    nav_html = textwrap.dedent(f"""
     <div class="nav-container">
         <div class="left-section">
-            <img src="data:image/png;base64,{logo_base64}" class="logo-img" />
+            <img src="{logo_src(get_build_artifacts().text(LOGO_DATA_URI))}" class="logo-img" />
             <div class="app-title">
                 <div>Knee Osteoarthritis Management Platform</div>
                 <div>膝骨关节炎人工智能平台</div>
@@ -261,93 +362,44 @@ def get_navigation_styles(logo_base64: str) -> str:
         <div class="nav-buttons">
             <form action="/" method="get" title="Home Page">
                 <input type="hidden" name="page" value="Home">
+                {sid_input}
                 <button type="submit" class="agent-button" style="font-weight: 600;">Home</button>
             </form>
             <form action="/" method="get" title="Assess status">
                 <input type="hidden" name="page" value="Assessing Current Status">
+                {sid_input}
                 <button type="submit" class="agent-button">
-                    <img src="https://www.svgrepo.com/download/285252/robot.svg" alt="robot icon">
+                    {robot}
                     评估(Assessment Agent)
                 </button>
             </form>
             <div class="arrow-icon">➡️</div>
             <form action="/" method="get" title="Predict risk">
                 <input type="hidden" name="page" value="Predicting Progression Risk">
+                {sid_input}
                 <button type="submit" class="agent-button">
-                    <img src="https://www.svgrepo.com/download/285252/robot.svg" alt="robot icon">
+                    {robot}
                     预测(Risk Agent)
                 </button>
             </form>
             <div class="arrow-icon">➡️</div>
             <form action="/" method="get" title="Recommend therapy">
                 <input type="hidden" name="page" value="Tailored Therapy Recommendation">
+                {sid_input}
                 <button type="submit" class="agent-button">
-                    <img src="https://www.svgrepo.com/download/285252/robot.svg" alt="robot icon">
+                    {robot}
                     处方(Therapy Agent)
                 </button>
             </form>
+            <form action="/" method="get" title="Cohort analytics">
+                <input type="hidden" name="page" value="Cohort Analytics">
+                {sid_input}
+                <button type="submit" class="agent-button" style="margin-left: 16px;">队列(Cohort)</button>
+            </form>
         </div>
     </div>
-    """
-
-
-def get_chat_styles() -> str:
-    """返回优化后的聊天气泡样式"""
-    return """
-    <style>
-    .chat-bubble {
-        border-radius: 10px;
-        padding: 14px 18px;
-        margin-bottom: 20px;
-        font-size: 15px;
-        line-height: 1.6;
-        box-shadow: 0 2px 6px rgba(0, 0, 0, 0.04);
-        border-left: 5px solid transparent;
-        background-color: #f9f9f9;
-    }
-
-    .chat-content {
-        white-space: normal !important;
-        word-break: break-word;
-        overflow-wrap: break-word;
-        line-height: 1.6;
-    }
-
-    .exercise {
-        background-color: #f0fff4;
-        border-left-color: #34c759;
-    }
-
-    .pharma {
-        background-color: #f0f8ff;
-        border-left-color: #1e90ff;
-    }
-
-    .nutrition {
-        background-color: #fffaf0;
-        border-left-color: #f4b400;
-    }
-
-    .summary {
-        background-color: #fff0f0;
-        border-left-color: #ff6b6b;
-    }
-
-    .chat-icon {
-        font-weight: bold;
-        margin-bottom: 6px;
-        display: block;
-        color: #333;
-    }
-
-    .chat-bubble strong {
-        display: inline-block;
-        margin-bottom: 4px;
-        color: #222;
-    }
-    </style>
-    """
-
+    """)
+    return "\n".join([stylesheet_tag(), sprite_tag(), nav_html])
 
 
 # =============================================================================
@@ -362,9 +414,17 @@ class ChatManager:
         if "chat_history" not in st.session_state:
             st.session_state.chat_history = self.initial_history.copy()
             st.session_state.chat_step = 1
+        # 从会话存储恢复时只有聊天记录与进度，计时从恢复时刻重新开始
+        if "last_update_time" not in st.session_state:
             st.session_state.last_update_time = time.time()
+        if "chat_features" not in st.session_state:
+            st.session_state.chat_features = ChatFeatureExtractor()
 
-
+    def sync_features(self):
+        """增量抽取：只处理上次之后新显示的消息"""
+        st.session_state.chat_features.update(
+            st.session_state.chat_history[:st.session_state.chat_step]
+        )
 
     def update_progress(self):
         """更新聊天进度（非阻塞）"""
@@ -432,8 +492,12 @@ class ChatManager:
             """
 
     def render_chat_interface(self):
-        for msg in st.session_state.chat_history[:st.session_state.chat_step]:
-            print("原始 content 内容：", repr(msg["content"]))
+        if chat_log.isEnabledFor(logging.DEBUG):
+            shown = st.session_state.chat_history[:st.session_state.chat_step]
+            chat_log.debug("chat rendered", extra={
+                "messages": len(shown),
+                "chars": sum(len(msg["content"]) for msg in shown),
+            })
 
         # # def process_content(content):
         # #     # 将换行符转换为 HTML 换行标签
@@ -511,60 +575,27 @@ class ChatManager:
         if not api_key:
             return "❌ 请在 Hugging Face 的 Secrets 中配置 DASHSCOPE_API_KEY。"
     
+        started = time.perf_counter()
         try:
-            st.write(f"🚀 正在调用 Qwen，输入：{user_input}")
-            response = call_qwen_agent(user_input, app_id, api_key)
-            st.write(f"✅ Qwen 返回前200字：{response[:200]}")
+            response = call_qwen_agent_cached(user_input, app_id, api_key, get_semantic_cache())
+            qwen_log.info("qwen reply", extra={
+                "app_id": app_id,
+                "prompt_chars": len(user_input),
+                "reply_chars": len(response),
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            })
             return response
-        except Exception as e:
-            st.write(f"❌ Qwen 调用失败：{e}")
+        except Exception:
+            qwen_log.exception("qwen call failed", extra={"app_id": app_id, "prompt_chars": len(user_input)})
             return "调用 Qwen API 出错，请稍后再试。"
 
 
 # =============================================================================
 # 页面渲染函数
 # =============================================================================
-def render_navigation():
+def render_navigation(sid: Optional[str] = None):
     """渲染导航栏"""
-    logo_base64 = get_base64_image(IMAGE_PATHS["logo"])
-    if logo_base64:
-        st.markdown(get_navigation_styles(logo_base64), unsafe_allow_html=True)
-    else:
-        st.title("Knee Osteoarthritis Management Platform")
-
-def inject_agent_styles():
-    """注入各智能体颜色样式"""
-    st.markdown("""
-    <style>
-        .chat-bubble {
-            border-radius: 12px;
-            padding: 16px;
-            margin: 16px 0;
-            box-shadow: 0 2px 6px rgba(0,0,0,0.1);
-        }
-        .chat-bubble.exercise {
-            background-color: #e6f4ea;
-            border-left: 6px solid #34a853;
-        }
-        .chat-bubble.surgical, .chat-bubble.pharma {
-            background-color: #e8f0fe;
-            border-left: 6px solid #4285f4;
-        }
-        .chat-bubble.nutrition, .chat-bubble.psychology {
-            background-color: #fff8e1;
-            border-left: 6px solid #fbbc04;
-        }
-        .chat-icon {
-            font-weight: bold;
-            margin-bottom: 8px;
-        }
-        .chat-bubble.decision {
-            background-color: #f1f3f4;
-            border-left: 6px solid #5f6368;
-        }
-    </style>
-    """, unsafe_allow_html=True)
-
+    st.markdown(get_navigation_html(sid), unsafe_allow_html=True)
 
 def render_home_page():
     """渲染首页"""
@@ -598,25 +629,15 @@ This website is at an early stage of development and intended for research purpo
     # 每秒刷新一次（根据需要调整频率），最多刷新 N 次
 
 
-def generate_report_text_from_json(json_path: str = "structured_report_template.json") -> str:
-    with open(json_path, "r", encoding="utf-8") as f:
-        report_dict = json.load(f)
-
-    lines = []
-    for section, contents in report_dict.items():
-        lines.append(section)
-        for line in contents:
-            lines.append(line)
-        lines.append("")  # 每个 section 之间空一行
-    return "\n".join(lines)
+def render_centered_image_full(image_path, width=300):
+    with open(image_path, "rb") as img_file:
+        render_centered_image_bytes(img_file.read(), width)
 
 
-def render_centered_image_full(image_path, width=300):
+def render_centered_image_bytes(img_bytes: bytes, width=300):
     import base64
-    with open(image_path, "rb") as img_file:
-        img_bytes = img_file.read()
-        encoded = base64.b64encode(img_bytes).decode("utf-8")
-    
+    encoded = base64.b64encode(img_bytes).decode("utf-8")
+
     html = f'''
         <div style="width: 100%; text-align: center; margin-top: 20px;">
             <img src="data:image/png;base64,{encoded}" width="{width}" />
@@ -624,48 +645,109 @@ def render_centered_image_full(image_path, width=300):
     '''
     st.markdown(html, unsafe_allow_html=True)
 
+def render_semantic_cache_stats():
+    stats = get_semantic_cache().stats()
+    if stats["hits"] + stats["misses"] == 0:
+        return
+    st.caption(
+        f"Semantic cache: hit rate {stats['hit_rate']:.0%} "
+        f"({stats['hits']}/{stats['hits'] + stats['misses']}), "
+        f"avg lookup {stats['avg_lookup_ms']:.2f} ms, "
+        f"entries {stats['entries']}/{stats['max_entries']}"
+    )
+
+def render_delta_stats_panel(recorder: DeltaRecorder):
+    """开发者面板：上一次 rerun 发往浏览器的字节数，按渲染函数 / 元素类型排序"""
+    with st.expander("🛠️ Delta payload (dev)"):
+        last = recorder.last_completed()
+        if last is None:
+            st.caption("Collecting… rerun the page to see a complete rerun.")
+            return
+        st.caption(
+            f"Rerun #{last.index}: {last.total_bytes / 1024:.1f} KiB in {last.messages} messages "
+            f"(current rerun so far: {recorder.current.total_bytes / 1024:.1f} KiB)"
+        )
+        st.dataframe(pd.DataFrame(last.top(10)), hide_index=True, use_container_width=True)
+        history = pd.DataFrame(
+            [{"rerun": r.index, "KiB": r.total_bytes / 1024} for r in recorder.history]
+        ).set_index("rerun")
+        st.bar_chart(history)
+
+def render_profile_summary(result: ProfileResult):
+    """本次 rerun 的采样结果：热点函数与内存分配位置，完整数据保存在 profiles/"""
+    with st.expander(f"⏱️ Profile: {result.label} ({result.elapsed * 1000:.0f} ms, {result.samples} samples)"):
+        st.caption(f"Flamegraph input: {result.folded_path} · tracemalloc snapshot: {result.snapshot_path}")
+        if result.samples:
+            st.dataframe(pd.DataFrame(result.hotspots(10)), hide_index=True, use_container_width=True)
+        st.dataframe(pd.DataFrame(result.memory_top), hide_index=True, use_container_width=True)
+
+def render_dicom_view(path: str, width=450):
+    """DICOM：先读头信息，多帧时选帧，只为当前帧生成加窗降采样的预览"""
+    mtime_ns = os.stat(path).st_mtime_ns
+    try:
+        dicom = open_dicom(path, mtime_ns)
+    except Exception as e:
+        st.error(f"Cannot read DICOM: {e}")
+        return
+    frame = 0
+    if dicom.frames > 1:
+        frame = st.slider("Frame", 1, dicom.frames, 1, key="dicom_frame") - 1
+    render_centered_image_bytes(dicom_preview_png(path, mtime_ns, frame), width)
+    header = dicom.header
+    st.caption(" · ".join(str(v) for v in (
+        header.get("Modality"), header.get("ViewPosition"),
+        header.get("ImageLaterality") or header.get("Laterality"),
+        f"{dicom.columns}×{dicom.rows}", f"{dicom.frames} frame(s)",
+        "memory-mapped" if dicom.memory_mapped else "decoded per frame",
+    ) if v))
+    with st.expander("DICOM header"):
+        st.json(header)
+
+
+@st.fragment
+def render_overlay_viewer(path: str, analysis: Dict, width=450):
+    """
+    显著图叠加视图（分析器提供的显著图；占位分析器为局部对比度）：缩放 / 平移只换用金字塔中现成的瓦片，不重新混合。
+    作为 fragment 运行，拖动控件只重跑本函数。
+    """
+    pyramid = get_overlay_pyramid(analysis["sha256"], analysis["model_version"], path)
+    level = 0
+    if pyramid.levels > 1:
+        level = st.slider("Zoom", 1, pyramid.levels, 1, key="overlay_zoom") - 1
+    cols, rows = pyramid.grid(level)
+    view_cols, view_rows = min(cols, OVERLAY_VIEWPORT[0]), min(rows, OVERLAY_VIEWPORT[1])
+    x0 = y0 = 0
+    pan_x, pan_y = st.columns(2)
+    if cols > view_cols:
+        with pan_x:
+            x0 = st.slider("Pan →", 0, cols - view_cols, 0, key=f"overlay_x_{level}")
+    if rows > view_rows:
+        with pan_y:
+            y0 = st.slider("Pan ↓", 0, rows - view_rows, 0, key=f"overlay_y_{level}")
+
+    import base64
+    cells = "".join(
+        f'<img src="data:image/png;base64,{base64.b64encode(pyramid.tile(level, x, y)).decode()}" '
+        f'style="display:block;max-width:none;" />'
+        for y in range(y0, y0 + view_rows) for x in range(x0, x0 + view_cols)
+    )
+    st.markdown(
+        f'''<div style="width: 100%; overflow: auto; max-width: {max(width, view_cols * pyramid.tile_size)}px; margin: 0 auto;">
+            <div style="display: grid; grid-template-columns: repeat({view_cols}, auto); justify-content: center;">{cells}</div>
+        </div>''',
+        unsafe_allow_html=True,
+    )
+    st.caption(f"Level {level + 1}/{pyramid.levels} · tiles {x0}–{x0 + view_cols - 1} × {y0}–{y0 + view_rows - 1} "
+               f"of {cols} × {rows} · analysis {analysis['model_version']}")
+
+
 def spacer(height_px=24):
     st.markdown(f"<div style='height: {height_px}px;'></div>", unsafe_allow_html=True)
 
 def render_assessment_page():
     """渲染评估页面"""
-    st.markdown("""
-        <style>
-        /* 按钮字体 */
-        .stButton > button,
-        .stDownloadButton > button {
-            font-size: 16px !important;
-        }
-        /* 调整上传图片按钮宽度为100% */
-
-        div[data-testid="stButton-upload_image_btn"] > button {
-            width: 100% !important;
-            padding: 0.5rem 1rem !important;
-            min-width: 100% !important;
-            box-sizing: border-box !important;
-        }
-        
-        /* 下拉框输入框和选中项 */
-        div[data-baseweb="select"] > div > div > input,
-        div[data-baseweb="select"] > div > div > div,
-        div[data-baseweb="select"] ul > li {
-            font-size: 16px !important;
-        }
-        /* 标签字体 */
-        label, .stTextInput label, .stSelectbox label, .stMultiSelect label {
-            font-size: 16px !important;
-        }
-        .st-emotion-cache-tn0cau {  
-            gap: 0 !important;  /* 覆盖1remgap */
-            margin-top: 0 !important;  
-            padding-top: 0 !important; 
-        }
-        
-        .stColumns {
-            gap: 0 !important;
-        }
-        </style>
-    """, unsafe_allow_html=True)
+    # 评估页面专用样式见 static/css/kom.css（以该标记元素限定作用范围）
+    st.markdown('<div class="kom-page-assessment"></div>', unsafe_allow_html=True)
     
     chat_manager = ChatManager()
     chat_manager.initialize_state()
@@ -702,6 +784,24 @@ def render_assessment_page():
                         st.session_state.selected_image_label = label
                         st.session_state.show_sidebar = False
                         st.rerun()
+
+            st.markdown("### ⬆️ Or upload a radiograph")
+            uploaded = st.file_uploader(
+                f"PNG / JPEG up to {MAX_UPLOAD_BYTES // (1024 * 1024)} MB, "
+                f"DICOM up to {MAX_DICOM_UPLOAD_BYTES // (1024 * 1024)} MB",
+                type=["png", "jpg", "jpeg"] + [suffix.lstrip(".") for suffix in DICOM_SUFFIXES],
+                key="xray_upload",
+            )
+            if uploaded is not None:
+                try:
+                    _, stored_path = store_upload(uploaded, Path(uploaded.name).suffix)
+                except Exception as e:
+                    st.error(f"Upload rejected: {e}")
+                else:
+                    st.session_state.selected_image_path = stored_path
+                    st.session_state.selected_image_label = uploaded.name
+                    st.session_state.show_sidebar = False
+                    st.rerun()
     
 
     st.markdown('<p class="chat-note">Demo chat interface (display only).</p>', unsafe_allow_html=True)
@@ -711,7 +811,9 @@ def render_assessment_page():
     with col1:
         chat_manager.render_chat_interface()
         chat_manager.update_progress()
+        chat_manager.sync_features()
         chat_manager.handle_user_input()
+        render_semantic_cache_stats()
 
         st.divider()
 
@@ -722,12 +824,32 @@ def render_assessment_page():
         if st.session_state.selected_image_path and st.session_state.selected_image_label:
             st.success(f"✅ Selected: {st.session_state.selected_image_label}")
 
-            render_centered_image_full(st.session_state.selected_image_path, width=450)
+            if is_dicom(st.session_state.selected_image_path):
+                render_dicom_view(st.session_state.selected_image_path, width=450)
+            else:
+                render_centered_image_full(st.session_state.selected_image_path, width=450)
 
             spacer(24)
 
-            analysis_data = load_analysis_report()
-            report = analysis_data.get("default")
+            analysis = analyse_image(st.session_state.selected_image_path)
+            if getattr(get_xray_analyzer(), "sample", False):
+                st.info("Sample output: no imaging model is connected yet, so every radiograph shows "
+                        "the same pre-generated demo report. It is not an analysis of this image.")
+                st.caption(f"Image {analysis['sha256'][:12]} · sample report {analysis['model_version']}")
+            else:
+                st.caption(
+                    f"Image {analysis['sha256'][:12]} · analysis {analysis['model_version']} · "
+                    + ("cached" if analysis["cached"] else f"computed in {analysis['elapsed_ms']:.0f} ms")
+                )
+            if getattr(get_xray_analyzer(), "placeholder_saliency", False):
+                with st.expander("Contrast overlay (placeholder)"):
+                    st.caption("Local image contrast (bone edges, joint space), not model attention. "
+                               "It will be replaced by the model's saliency once an imaging model is connected.")
+                    render_overlay_viewer(st.session_state.selected_image_path, analysis)
+            else:
+                with st.expander("🔥 Attention overlay"):
+                    render_overlay_viewer(st.session_state.selected_image_path, analysis)
+            report = get_patient_pipeline().get("assessment")
 
             if report:
                 with st.expander("📝 View Structured Analysis Report"):
@@ -737,9 +859,7 @@ def render_assessment_page():
                             st.markdown(f"**{section_title}**")
                             for item in items:
                                 st.markdown(f"- {item}")
-                report_text = generate_report_text_from_json()
-                report_text = clean_text_for_pdf(report_text)
-                pdf_bytes = generate_pdf(report_text)
+                pdf_bytes = structured_report_pdf(load_structured_report())
 
                 with open("custom_patient_report_ori.json", "r", encoding="utf-8") as f:
                     custom_json_data = json.load(f)
@@ -927,14 +1047,186 @@ def multi_column_radio(label, options, cols=6, index=0):
     return st.session_state[key]
 
 
+def resolve_chat_features() -> dict:
+    """
+    评估对话中抽取的结构化字段（覆盖默认参数），规则无法判定的字段才调用 Qwen。
+    映射提示词只在患者回答上有差别，不走语义缓存，以免拿到别的患者的映射结果。
+    """
+    extractor = st.session_state.get("chat_features")
+    if extractor is None:
+        return {}
+
+    api_key = os.getenv("DASHSCOPE_API_KEY")
+    if extractor.pending and api_key:
+        app_id = "c968f91131ac432787f5ef81f51922ba"
+        extractor.resolve_pending(lambda prompt: call_qwen_agent(prompt, app_id, api_key))
+    return dict(extractor.record)
+
+
+def render_feature_overrides(pipeline: PipelineGraph):
+    """手动调整部分输入；只把与默认值/对话抽取值不同的字段作为 overrides"""
+    base = {**pipeline.get("default_params"), **pipeline.get("chat_record")}
+    overrides = {}
+    with st.expander("Adjust patient inputs"):
+        cols = st.columns(len(ADJUSTABLE_FEATURES))
+        for col, (key, label) in zip(cols, ADJUSTABLE_FEATURES.items()):
+            if base.get(key) is None:
+                continue
+            with col:
+                value = st.number_input(label, value=base[key], key=f"override_{key}")
+            if value != base[key]:
+                overrides[key] = value
+    pipeline.set_input("overrides", overrides)
+
+
+@st.fragment
+def render_what_if_explorer(params: dict):
+    """
+    在当前特征上扫描 1~2 个特征，整张网格一次批量打分。
+    只用注册表中已发布的拟合模型；没有时调用方不显示本视图（人工设定的示意系数不给临床看）。
+    作为 fragment 运行：调整控件只重跑本函数，不重新渲染整个预测页。
+    """
+    model = get_trajectory_model()
+    if model is None:
+        return
+    st.markdown("<h5>🔍 What-if Explorer</h5>", unsafe_allow_html=True)
+
+    col_features, col_metric = st.columns([1.4, 1])
+    with col_features:
+        swept = st.multiselect(
+            "Vary one or two features",
+            options=list(WHAT_IF_FEATURES),
+            default=["BMI"],
+            max_selections=2,
+            format_func=WHAT_IF_FEATURES.get,
+            key="what_if_features",
+        )
+    with col_metric:
+        metric_index = st.selectbox(
+            "Outcome",
+            options=range(len(OUTPUT_METRICS)),
+            format_func=lambda i: OUTPUT_METRICS[i][2],
+            key="what_if_metric",
+        )
+    if not swept:
+        st.caption("Select a feature to see how the forecast responds.")
+        return
+
+    steps = WHAT_IF_STEPS[len(swept) - 1]
+    axes = {}
+    for col, name in zip(st.columns(len(swept)), swept):
+        low, high = FEATURE_RANGES[name]
+        with col:
+            lo, hi = st.slider(f"{WHAT_IF_FEATURES[name]} range", float(low), float(high),
+                               (float(low), float(high)), key=f"what_if_range_{name}")
+        axes[name] = np.linspace(lo, hi, steps)
+
+    metric = OUTPUT_METRICS[metric_index]
+    grid = model.sweep(params, axes)
+    columns = [model.output_index(metric[0], visit) for visit, _ in HORIZONS]
+
+    if len(swept) == 1:
+        name = swept[0]
+        df = pd.DataFrame({name: axes[name]})
+        for (_, label), idx in zip(HORIZONS, columns):
+            df[label] = grid[:, idx]
+        df = df.melt(id_vars=name, var_name="Horizon", value_name="KOOS")
+        chart = alt.Chart(df).mark_line().encode(
+            x=alt.X(f"{name}:Q", title=WHAT_IF_FEATURES[name]),
+            y=alt.Y("KOOS:Q", title=f"{metric[2]} (KOOS)", scale=alt.Scale(domain=[0, 100])),
+            color="Horizon:N",
+        )
+        current = params.get(name)
+        if isinstance(current, (int, float)):
+            chart += alt.Chart(pd.DataFrame({name: [current]})).mark_rule(strokeDash=[4, 4]).encode(x=f"{name}:Q")
+    else:
+        horizon = st.radio("Horizon", [label for _, label in HORIZONS], horizontal=True, key="what_if_horizon")
+        idx = columns[[label for _, label in HORIZONS].index(horizon)]
+        x_name, y_name = swept
+        xs, ys = np.meshgrid(axes[x_name], axes[y_name], indexing="ij")
+        df = pd.DataFrame({x_name: xs.ravel().round(2), y_name: ys.ravel().round(2),
+                           "KOOS": grid[..., idx].ravel()})
+        chart = alt.Chart(df).mark_rect().encode(
+            x=alt.X(f"{x_name}:O", title=WHAT_IF_FEATURES[x_name], axis=alt.Axis(labelOverlap=True)),
+            y=alt.Y(f"{y_name}:O", title=WHAT_IF_FEATURES[y_name], sort="descending",
+                    axis=alt.Axis(labelOverlap=True)),
+            color=alt.Color("KOOS:Q", scale=alt.Scale(scheme="redyellowgreen", domain=[0, 100])),
+            tooltip=[x_name, y_name, alt.Tooltip("KOOS:Q", format=".1f")],
+        )
+    st.altair_chart(chart, use_container_width=True)
+    st.caption(f"Higher KOOS means fewer symptoms. Responses come from trajectory model {model.version}; "
+               "they show associations learned from the training cohort, not the effect of an intervention.")
+
+
+def render_visit_history(params: dict):
+    """
+    随访对照：把当前患者登记为基线，注册表中有已拟合的轨迹模型时同时记录其预测，
+    之后的观测随访与预测叠加显示。没有拟合模型时只记录基线，不写入预测。
+    """
+    st.markdown("<h5>📈 Follow-up Visits</h5>", unsafe_allow_html=True)
+    store = get_visit_store()
+
+    with st.form("visit_baseline"):
+        col_id, col_date, col_save = st.columns([1.2, 1, 0.8])
+        patient_id = col_id.text_input("Patient ID")
+        baseline_date = col_date.date_input("Baseline date")
+        col_save.markdown("<div style='height: 28px;'></div>", unsafe_allow_html=True)
+        saved = col_save.form_submit_button("Save baseline", use_container_width=True)
+    model = get_trajectory_model()
+    if saved and patient_id.strip():
+        try:
+            store.add_visit(patient_id.strip(), "V00", baseline_date,
+                            {k: v for k, v in params.items() if isinstance(v, (int, float, str))})
+        except ValueError as e:
+            st.warning(str(e))
+        if model is not None:
+            store.record_prediction(patient_id.strip(), baseline_date, model.predict(params), model.version)
+        st.session_state.visit_patient = patient_id.strip()
+
+    patients = store.patients()
+    if not patients:
+        st.caption("No visits recorded yet. Save a baseline above, or import follow-ups with "
+                   "`python -m utils.visit_store import visits.csv`.")
+        return
+    if st.session_state.get("visit_patient") not in patients:
+        st.session_state.visit_patient = patients[0]
+    patient_id = st.selectbox("Patient", patients, key="visit_patient")
+    history = store.history(patient_id)
+
+    rows = trajectory_rows(history)
+    if rows:
+        chart = alt.Chart(pd.DataFrame(rows)).mark_line(point=True).encode(
+            x=alt.X("visit_date:T", title="Visit date"),
+            y=alt.Y("value:Q", title="KOOS", scale=alt.Scale(domain=[0, 100])),
+            color=alt.Color("metric:N", title=None),
+            strokeDash=alt.StrokeDash("kind:N", title=None),
+            detail="source:N",
+            tooltip=["visit", "visit_date", "kind", "source", "metric", alt.Tooltip("value:Q", format=".0f")],
+        ).properties(height=280)
+        st.altair_chart(chart, use_container_width=True)
+    comparison = compare(history)
+    if comparison:
+        st.dataframe(pd.DataFrame(comparison), hide_index=True, use_container_width=True)
+    elif model is None:
+        st.caption("No fitted trajectory model is published yet, so baselines are saved without a forecast "
+                   "and follow-ups are not compared.")
+    else:
+        st.caption("Observed follow-ups (V01 / V04) will be compared with the forecast once recorded.")
+
+
 def render_prediction_page():
     """渲染预测页面"""
 
     col1, col2 = st.columns([1.2, 0.8])
 
     with col1:
-        params = load_default_params(PARAMS_FILE)
-        predict = load_default_params(PREDICT_FILE)
+        pipeline = get_patient_pipeline()
+        chat_record = pipeline.get("chat_record")
+        if chat_record:
+            st.caption("Updated from the assessment chat: " + ", ".join(sorted(chat_record)))
+        render_feature_overrides(pipeline)
+        params = pipeline.get("features")
+        predict = pipeline.get("prediction")
 
         param_display_list = []
         display_to_key = {}
@@ -1050,12 +1342,16 @@ def render_prediction_page():
         if st.session_state["prediction_done"]:
             render_prediction_report(params)
             spacer(16)
+            if get_trajectory_model() is not None:
+                render_what_if_explorer(params)
+                spacer(16)
+            render_visit_history(params)
+            spacer(16)
         
             export_col1, export_col2 = st.columns([1, 1])
         
             with export_col1:
-                pdf_text = generate_report_text_from_prediction(predict)
-                pdf_bytes = generate_pdf(pdf_text)
+                pdf_bytes = prediction_report_pdf(predict)
         
                 st.download_button(
                     label="📄 Download Prediction Report as PDF",
@@ -1066,8 +1362,7 @@ def render_prediction_page():
                 )
         
             with export_col2:
-                with open(PARAMS_FILE, "rb") as f:
-                    json_bytes = f.read()
+                json_bytes = json.dumps(params, ensure_ascii=False, indent=2).encode("utf-8")
             
                 st.download_button(
                     label="Download Prediction Report JSON",
@@ -1081,321 +1376,6 @@ def render_prediction_page():
         safe_image_display(IMAGE_PATHS["predicting_framework"], "Framework for predicting progress risks", use_container_width=True)
 
 
-def render_agent_message_return_html(role: str, action_html: str, style_class: str) -> str:
-    return f"""
-    <div class="chat-bubble {style_class}">
-        <div class="chat-icon"><strong>{role}</strong></div>
-        <div class="chat-content" style="margin-top: 8px; text-align: left;">
-            {action_html}
-        </div>
-    </div>
-    """
-
-def render_agent_message(role: str, action: str, style_class: str) -> str:
-    action_html = markdown.markdown(action, extensions=["extra", "nl2br"])  # 转换 Markdown 为 HTML
-    return f"""
-    <div class="chat-bubble {style_class}">
-        <div class="chat-icon"><strong>{role}</strong></div>
-        <div style="margin-top: 8px; text-align: left;">{action_html}</div>
-    </div>
-    """
-
-def extract_week_number(phase_name: str) -> int:
-    """从 'Week 1–4'（含 en dash）中提取排序基准数字"""
-    # 替换 en dash（–）和 em dash（—）为 ASCII dash（-）
-    normalized = phase_name.replace("–", "-").replace("—", "-")
-    match = re.search(r"Week (\d+)", normalized)
-    return int(match.group(1)) if match else 0
-
-
-def render_exercise_plan_return_html(plan: Dict) -> str:
-    sorted_phases = sorted(plan.items(), key=lambda x: extract_week_number(x[0]))
-    html_blocks = []
-
-    for i, (phase, content) in enumerate(sorted_phases, start=1):
-        goal = content.get("Goal", "")
-        prescriptions = content.get("Prescription", [])
-
-        markdown_text = f"<h4>Phase {i}: {phase}</h4>"
-        markdown_text += f"<b>GOAL:</b> {goal}<br><br>"
-
-
-        for item in prescriptions:
-            category = item.get("Category", "Training")
-            description = item.get("Description", "")
-            markdown_text += f"<b>{category} Training:</b><br>"
-            for part in description.split(", "):
-                markdown_text += f"- {part.strip()}<br>"
-            markdown_text += "<br>"
-
-        html = render_agent_message_return_html(
-            role="A. Exercise Prescriptionist Agent",
-            action_html=markdown_text,
-            style_class="exercise"
-        )
-        html_blocks.append(html)
-
-    return "\n".join(html_blocks)
-
-
-def render_surgical_pharma_plan_return_html(plan_data: Dict) -> List[str]:
-    """
-    返回 Surgical & Pharmacological Specialist Agent 的多个 HTML 块列表，
-    每个块单独传入 st.markdown(..., unsafe_allow_html=True) 渲染。
-    """
-    html_blocks = []
-
-    # Step 1: 渲染 Guideline Summary
-    guideline_markdown = "#### Clinical Guideline Analysis\n\n### Matched Guidelines Summary\n\n"
-    title_map = {
-        "564": "Severe Functional Limitation",
-        "225": "Moderate Functional Limitation with Mechanical Symptoms",
-        "482": "Younger Patient with Single-Compartment Disease"
-    }
-
-    for item in plan_data.get("matched_guidelines", []):
-        guideline_text = item.get("guideline", "")
-        match = re.search(r"Scenario (\d+):", guideline_text)
-        gid = match.group(1) if match else "Unknown"
-        title = title_map.get(gid, "Clinical Scenario")
-
-        guideline_markdown += f"**Guideline {gid}: {title}**\n"
-
-        def extract_section(text, start_kw, end_kw=None):
-            try:
-                start = text.index(start_kw)
-                end = text.index(end_kw, start) if end_kw else None
-                return text[start + len(start_kw):end].strip()
-            except ValueError:
-                return ""
-
-        clinical = extract_section(guideline_text, 'The patient reports', 'Demonstrates') or extract_section(guideline_text, 'Experiences', 'has limited') or ""
-        physical = extract_section(guideline_text, 'Demonstrates', 'Shows') or extract_section(guideline_text, 'has limited', 'shows') or ""
-        radio = extract_section(guideline_text, 'Shows', 'Total') or extract_section(guideline_text, 'exhibits', 'Total') or ""
-
-        guideline_markdown += f"- **Clinical Presentation:** {clinical}\n"
-        guideline_markdown += f"- **Physical Findings:** {physical}\n"
-        guideline_markdown += f"- **Radiographic Features:** {radio}\n"
-        guideline_markdown += f"**Recommendations:**\n"
-
-        recos = re.findall(r"(Total knee arthroplasty|Unicompartmental knee arthroplasty.*?|Realignment Osteotomy.*?)\s*(Appropriate|May Be Appropriate|Rarely Appropriate)\s*(\d)", guideline_text)
-        for rec in recos:
-            guideline_markdown += f"- {rec[0]}: {rec[1]} ({rec[2]}/9)\n"
-        guideline_markdown += "\n"
-
-    guideline_html = render_agent_message_return_html(
-        role="B. Surgical & Pharmacological Specialist Agent",
-        action_html=markdown.markdown(guideline_markdown,extensions=["extra", "nl2br"]),
-        style_class="surgical"
-    )
-    html_blocks.append(guideline_html)
-
-    # Step 2: 药物推荐表格
-    meds = plan_data.get("medication_plan", [])
-    med_table_md = "#### Pharmacological Management Plan\n\n"
-    med_table_md += "| Medication | Dosage | Administration Schedule | Notes |\n"
-    med_table_md += "|------------|--------|-------------------------|-------|\n"
-
-    for med in meds:
-        name = med.get("name", "")
-        dosage = med.get("dosage", "")
-        freq = med.get("frequency", "")
-        notes = ""
-        if "Ibuprofen" in name:
-            notes = "Monitor for GI effects; take with food"
-        elif "Acetaminophen" in name:
-            notes = "Not to exceed 3000 mg daily"
-        elif "Corticosteroids" in name:
-            notes = "Consider after failed oral analgesics"
-        med_table_md += f"| {name} | {dosage} | {freq} | {notes} |\n"
-
-    med_table_md += "\nNote: Medication regimen should be tailored based on patient comorbidities, concomitant medications, and individual response to therapy.\n"
-
-    med_table_html = markdown.markdown(med_table_md, extensions=["extra", "nl2br"])
-    wrapped_html = f"<div class='markdown-wrapper'>{med_table_html}</div>"
-
-    pharma_html = render_agent_message_return_html(
-        role="B. Surgical & Pharmacological Specialist Agent",
-        action_html=wrapped_html,
-        style_class="pharma"
-    )
-    html_blocks.append(pharma_html)
-
-    return html_blocks
-
-
-def render_nutrition_psychology_plan_return_html(plan_data: Dict) -> List[str]:
-    """返回 Nutritional & Psychological Specialist Agent 的多个 HTML 气泡块"""
-    html_blocks = []
-
-    # ----------- Nutrition 部分 -----------
-    nutrition = plan_data.get("nutrition", {})
-    n_goal = nutrition.get("goal", "")
-    n_duration = nutrition.get("duration", "")
-    n_content = nutrition.get("content", [])
-
-    nutrition_md = "#### Nutritional Intervention Plan\n"
-    nutrition_md += f"**Goal:** {n_goal}\n\n"
-    nutrition_md += f"**Delivery Method:** Personalized one-on-one counseling supplemented with mobile application reminders\n"
-    nutrition_md += f"**Program Structure:**\n"
-    nutrition_md += f"- **Initial Phase:** Weekly consultations (first 6 weeks)\n"
-    nutrition_md += f"- **Maintenance Phase:** Bi-weekly check-ins\n"
-    nutrition_md += f"- **Total Duration:** {n_duration} comprehensive program\n"
-
-    # 分类策略
-    strategies = {
-        "Anti-inflammatory": [],
-        "Macronutrient": [],
-        "Weight": []
-    }
-
-    for item in n_content:
-        if "Anti-inflammatory" in item or "Adequacy" in item:
-            strategies["Anti-inflammatory"].append(item)
-        elif "macronutrient" in item or "Balance" in item:
-            strategies["Macronutrient"].append(item)
-        elif "calorie" in item.lower() or "Calorie control" in item:
-            strategies["Weight"].append(item)
-
-    nutrition_md += "**Key Nutritional Strategies:**\n"
-    if strategies["Anti-inflammatory"]:
-        nutrition_md += "1. **Anti-inflammatory Focus**\n"
-        nutrition_md += "   - Incorporate omega-3 rich foods (fatty fish, walnuts, flaxseeds)\n"
-        nutrition_md += "   - Increase consumption of antioxidant-rich leafy greens\n"
-        nutrition_md += "   - Integrate nuts and seeds for micronutrient support\n"
-        nutrition_md += "   - Purpose: Reduce joint inflammation and support tissue repair\n"
-    if strategies["Macronutrient"]:
-        nutrition_md += "2. **Macronutrient Optimization**\n"
-        nutrition_md += "   - Ensure adequate protein intake to support muscle maintenance\n"
-        nutrition_md += "   - Balance complex carbohydrates for sustained energy\n"
-        nutrition_md += "   - Include healthy fats to support joint lubrication\n"
-        nutrition_md += "   - Purpose: Enhance musculoskeletal strength and joint function\n"
-    if strategies["Weight"]:
-        nutrition_md += "3. **Weight Management**\n"
-        nutrition_md += "   - Implement portion awareness techniques\n"
-        nutrition_md += "   - Monitor caloric balance through guided food journaling\n"
-        nutrition_md += "   - Adjust intake based on activity levels and rehabilitation phases\n"
-        nutrition_md += "   - Purpose: Reduce mechanical stress on knee joints\n"
-
-    nutrition_html = render_agent_message_return_html(
-        role="C. Nutritional & Psychological Specialist Agent",
-        action_html=markdown.markdown(nutrition_md,extensions=["extra", "nl2br"]),
-        style_class="nutrition"
-    )
-    html_blocks.append(nutrition_html)
-
-    # ----------- Psychology 部分 -----------
-    psych = plan_data.get("psychology", {})
-    p_goal = psych.get("goal", "")
-    p_duration = psych.get("duration", "")
-    p_content = psych.get("content", [])
-
-    psychology_md = "#### Psychological Support\n"
-    psychology_md += f"**Goal:** {p_goal}\n\n"
-    psychology_md += f"**Delivery Method:** Tele-health Cognitive Behavioral Therapy with structured daily practice components\n"
-    psychology_md += f"**Program Structure:**\n"
-    psychology_md += f"- **Intensive Phase:** Weekly sessions (first 8 weeks)\n"
-    psychology_md += f"- **Consolidation Phase:** Bi-weekly sessions\n"
-    psychology_md += f"- **Total Duration:** {p_duration} comprehensive program\n"
-
-    psychology_md += "**Evidence-Based Psychological Approaches:**\n"
-    for idx, item in enumerate(p_content, start=1):
-        if "Motivational" in item:
-            psychology_md += f"{idx}. **Motivational Interviewing**\n"
-            psychology_md += "   - Explore personal values related to mobility and function\n"
-            psychology_md += "   - Resolve ambivalence about rehabilitation commitment\n"
-            psychology_md += "   - Develop intrinsic motivation for consistent exercise adherence\n"
-            psychology_md += "   - Purpose: Strengthen commitment to rehabilitation protocols\n"
-        elif "CBT" in item:
-            psychology_md += f"{idx}. **Cognitive Restructuring**\n"
-            psychology_md += "   - Identify and challenge maladaptive thoughts about pain and recovery\n"
-            psychology_md += "   - Transform catastrophizing patterns into realistic perspectives\n"
-            psychology_md += "   - Develop confidence in functional improvement\n"
-            psychology_md += "   - Purpose: Reduce pain-related fear and enhance rehabilitation engagement\n"
-        elif "mindfulness" in item.lower():
-            psychology_md += f"{idx}. **Digital Mindfulness Integration**\n"
-            psychology_md += "   - Implement scheduled mindfulness practice through mobile notifications\n"
-            psychology_md += "   - Provide guided pain-specific meditation recordings\n"
-            psychology_md += "   - Track stress levels in relation to symptom fluctuations\n"
-            psychology_md += "   - Purpose: Enhance stress management and improve pain tolerance\n"
-
-    psychology_md += "*Note: Both nutritional and psychological interventions will be coordinated with physical rehabilitation to ensure comprehensive care integration.*"
-
-    psychology_html = render_agent_message_return_html(
-        role="C. Nutritional & Psychological Specialist Agent",
-        action_html=markdown.markdown(psychology_md, extensions=["extra", "nl2br"]),
-        style_class="psychology"
-    )
-    html_blocks.append(psychology_html)
-
-    return html_blocks
-
-
-def render_clinical_decision_agent_return_html(plan_data: Dict) -> str:
-    primary_goal = plan_data.get("Goals", {}).get("Primary", "")
-    secondary_goal = plan_data.get("Goals", {}).get("Secondary", "")
-
-    plan = plan_data.get("InterventionPlan", {})
-    action_md = "#### Integrated Multimodal Intervention Plan\n\n"
-
-    # Medication
-    med_summary = plan.get("Medication", {}).get("Summary", "")
-    action_md += "**🩺 Medication Strategy**\n"
-    action_md += f"- {med_summary}\n\n"
-
-    # Nutrition
-    nutrition_desc = plan.get("NutritionPlan", {}).get("Description", "")
-    framework = plan.get("NutritionPlan", {}).get("Framework", "")
-    action_md += "**🥗 Nutrition Plan**\n"
-    action_md += f"- **Framework:** {framework}\n"
-    action_md += f"- {nutrition_desc}\n\n"
-
-    # Exercise
-    exercise = plan.get("ExercisePlan", {})
-    framework = exercise.get("Framework", "")
-    phases = exercise.get("Phases", {})
-    action_md += "**🏃 Exercise Plan**\n"
-    action_md += f"- **Framework:** {framework}\n"
-    for week_range, content in phases.items():
-        goal = content.get("Goal", "")
-        prescription = content.get("Prescription", "")
-        action_md += f"  - **{week_range}:** {goal}\n"
-        action_md += f"    - {prescription}\n"
-    action_md += "\n"
-
-    # Psychology
-    psych_summary = plan.get("PsychologicalSupport", {}).get("Summary", "")
-    action_md += "**🧠 Psychological Support**\n"
-    action_md += f"- {psych_summary}\n\n"
-
-    # Surgical
-    surgical_summary = plan.get("SurgicalOrInjectionConsiderations", {}).get("Summary", "")
-    action_md += "**🛠️ Surgical or Injection Considerations**\n"
-    action_md += f"- {surgical_summary}\n\n"
-
-    # Safety
-    safety_summary = plan.get("SafetyMonitoring", {}).get("Summary", "")
-    action_md += "**🔍 Safety Monitoring Plan**\n"
-    action_md += f"- {safety_summary}\n\n"
-
-    # Personalization
-    accessibility = plan_data.get("AccessibilityFeasibility", "")
-    rationale = plan_data.get("PersonalizationRationale", "")
-    evidence = plan_data.get("EvidenceCompliance", "")
-    action_md += "#### Personalized Treatment Context\n"
-    action_md += f"- **Accessibility & Feasibility:** {accessibility}\n"
-    action_md += f"- **Personalization Rationale:** {rationale}\n"
-    action_md += f"- **Evidence Compliance:** {evidence}\n"
-
-    html = render_agent_message(
-        role="🧩 Clinical Decision-Making Agent",
-        action=action_md,
-        style_class="decision"
-    )
-
-    return html
-
-
 def render_progress_bar(step: int, total: int):
     '''进度条函数'''
     progress = step / total
@@ -1409,34 +1389,29 @@ def render_progress_bar(step: int, total: int):
 
 def render_all_agents_auto():
     total_agents = 4
+    pipeline = get_patient_pipeline()
     progress_placeholder = st.empty()
 
     # ✅ Agent A: Exercise
     progress_placeholder.markdown(render_progress_bar_html(1, total_agents), unsafe_allow_html=True)
-    exercise_plan = load_plan("exercise")
+    exercise_plan = pipeline.get("exercise_plan")
     with st.expander("A. Exercise Prescriptionist Agent", expanded=False):
-        html = render_exercise_plan_return_html(exercise_plan)
-        st.markdown(html, unsafe_allow_html=True)
+        for html in agent_html_blocks("exercise", exercise_plan):
+            st.markdown(html, unsafe_allow_html=True)
 
     # ✅ Agent B: Surgical & Pharma
     progress_placeholder.markdown(render_progress_bar_html(2, total_agents), unsafe_allow_html=True)
-    surgical_plan = load_plan("surgical_pharma")
+    surgical_plan = pipeline.get("surgical_pharma_plan")
     with st.expander("B. Surgical & Pharmacological Specialist Agent", expanded=False):
-        # html = render_surgical_pharma_plan_return_html(surgical_plan)
-        # st.markdown(html, unsafe_allow_html=True)
-        html_blocks = render_surgical_pharma_plan_return_html(surgical_plan)
-        for html in html_blocks:
+        for html in agent_html_blocks("surgical_pharma", surgical_plan):
             st.markdown(html, unsafe_allow_html=True)
 
 
     # ✅ Agent C: Nutrition & Psychology
     progress_placeholder.markdown(render_progress_bar_html(3, total_agents), unsafe_allow_html=True)
-    nutrition_plan = load_plan("nutrition_psychology")
+    nutrition_plan = pipeline.get("nutrition_psychology_plan")
     with st.expander("C. Nutritional & Psychological Specialist Agent", expanded=False):
-        # html = render_nutrition_psychology_plan_return_html(nutrition_plan)
-        # st.markdown(html, unsafe_allow_html=True)
-        html_blocks = render_nutrition_psychology_plan_return_html(nutrition_plan)
-        for html in html_blocks:
+        for html in agent_html_blocks("nutrition_psychology", nutrition_plan):
             st.markdown(html, unsafe_allow_html=True)
 
 
@@ -1445,10 +1420,10 @@ def render_all_agents_auto():
         time.sleep(3)
 
     progress_placeholder.markdown(render_progress_bar_html(4, total_agents), unsafe_allow_html=True)
-    decision_plan = load_plan("clinical_integration")
+    decision_plan = pipeline.get("clinical_integration_plan")
     with st.expander("D. Clinical Decision-Making Agent", expanded=False):
-        html = render_clinical_decision_agent_return_html(decision_plan)
-        st.markdown(html, unsafe_allow_html=True)
+        for html in agent_html_blocks("clinical_integration", decision_plan):
+            st.markdown(html, unsafe_allow_html=True)
 
 
 # 进度条 HTML 渲染拆出来方便复用
@@ -1461,9 +1436,98 @@ def render_progress_bar_html(step: int, total: int) -> str:
     <small style='color: grey;'>Progress: {int(progress * 100)}%</small>
     """
 
+def render_case_picker(store: CaseStore) -> Tuple[Optional[int], List[Dict]]:
+    """分页病例选择：每页只查询 CASE_PAGE_SIZE 行摘要，与病例总数无关"""
+    if "case_page" not in st.session_state:
+        st.session_state.case_page = 0
+
+    def reset_page():
+        st.session_state.case_page = 0
+
+    query = st.text_input("Search cases (title, dialogue, agent role)", key="case_filter", on_change=reset_page)
+    offset = st.session_state.case_page * CASE_PAGE_SIZE
+    if query:
+        index = get_case_search_index(store)
+        index.refresh()
+        cases = index.search(query, limit=CASE_PAGE_SIZE + 1, offset=offset)
+        has_next = len(cases) > CASE_PAGE_SIZE
+        cases = cases[:CASE_PAGE_SIZE]
+    else:
+        cases, has_next = store.list_cases(offset=offset, limit=CASE_PAGE_SIZE)
+
+    case_ids = {case["title"]: case["id"] for case in cases}
+    selected_case = st.selectbox("Select a sample case：", [""] + list(case_ids))
+
+    if st.session_state.case_page > 0 or has_next:
+        prev_col, page_col, next_col = st.columns([1, 2, 1])
+        with prev_col:
+            if st.button("◀ Prev", disabled=st.session_state.case_page == 0):
+                st.session_state.case_page -= 1
+                st.rerun()
+        with page_col:
+            st.caption(f"Page {st.session_state.case_page + 1}")
+        with next_col:
+            if st.button("Next ▶", disabled=not has_next):
+                st.session_state.case_page += 1
+                st.rerun()
+
+    return case_ids.get(selected_case), cases
+
+
+@st.cache_resource
+def purge_stale_exports() -> int:
+    """进程启动时清掉过期会话留下的导出分卷（之后每次导出前再清一次）"""
+    return purge_exports()
+
+
+def render_bulk_export(store: CaseStore, cases: List[Dict], query: str):
+    """
+    批量导出：并行生成 PDF + JSON，分块写入静态目录下的 ZIP 分卷，由静态服务从磁盘发送，
+    内存占用与病例数无关。可导出手动勾选的病例（跨页保留），或当前搜索匹配的全部病例。
+    """
+    purge_stale_exports()
+    with st.expander("📦 Bulk export reports (ZIP)"):
+        # 勾选按 id 保存：同名病例不会合并，翻页 / 换搜索后仍保留
+        chosen: Dict[int, str] = st.session_state.setdefault("bulk_export_selection", {})
+        options = {**chosen, **{case["id"]: case["title"] for case in cases}}
+        picked = st.multiselect("Selected cases (kept across pages and searches)", list(options),
+                                default=list(chosen), format_func=lambda i: f"#{i} {options[i]}")
+        st.session_state.bulk_export_selection = {i: options[i] for i in picked}
+
+        scope_all = "All cases matching the search" if query else "All cases"
+        scope = st.radio("Export", ["Selected cases", scope_all], horizontal=True, key="bulk_export_scope")
+        if st.button("Build ZIP", disabled=scope == "Selected cases" and not picked):
+            if scope == "Selected cases":
+                case_ids = picked
+            elif query:
+                case_ids = get_case_search_index(store).search_ids(query)
+            else:
+                case_ids = store.case_ids()
+            for old in st.session_state.get("bulk_export_parts", []):
+                Path(old).unlink(missing_ok=True)
+            purge_exports()
+            with st.spinner(f"Exporting {len(case_ids)} cases..."):
+                parts, count = export_cases_zip_parts(case_ids, db_path=store.db_path)
+            st.session_state.bulk_export_parts = [str(part) for part in parts]
+            st.session_state.bulk_export_count = count
+
+        parts = [Path(p) for p in st.session_state.get("bulk_export_parts", []) if Path(p).exists()]
+        if not parts:
+            return
+        st.caption(f"{st.session_state.get('bulk_export_count', 0)} cases in {len(parts)} file(s); "
+                   f"links expire after {EXPORT_TTL // 60} minutes.")
+        if static_serving_enabled():
+            for i, part in enumerate(parts, 1):
+                label = "📥 Download ZIP" if len(parts) == 1 else f"📥 Download ZIP (part {i}/{len(parts)})"
+                st.link_button(label, f"{STATIC_URL_PREFIX}/exports/{part.name}")
+        else:
+            # 不经过 st.download_button：那样会把整个 ZIP 读进会话内存
+            st.caption("Static file serving is disabled; the export is on the server at: "
+                       + ", ".join(f"`{part}`" for part in parts))
+
+
 def render_therapy_page():
     """渲染治疗推荐页面"""
-    inject_agent_styles() 
     col1, col2 = st.columns([1.5, 1])
 
     with col2:
@@ -1475,21 +1539,18 @@ def render_therapy_page():
         if "start_clicked" not in st.session_state:
             st.session_state.start_clicked = False
     
-        case_data = load_case_data()
-        if not case_data:
+        store = get_case_store()
+        if store is None or store.is_empty():
             st.warning("Case data cannot be loaded.")
             return
-        
-        case_names = list(case_data.keys())
-        case_options = [""] + case_names
-        
-        selected_case = st.selectbox("Select a sample case：", case_options)
-        
-        st.markdown(get_chat_styles(), unsafe_allow_html=True)
-        
-        if selected_case != "":
-            case = case_data[selected_case]
-            
+
+        selected_id, page_cases = render_case_picker(store)
+        render_bulk_export(store, page_cases, st.session_state.get("case_filter", ""))
+
+        if selected_id is not None:
+            case = store.get_case(selected_id)
+            selected_case = case["title"]
+
             def on_start_click():
                 st.session_state.start_clicked = True
                 st.query_params.update({"start": "1"})
@@ -1525,11 +1586,76 @@ def render_therapy_page():
 # =============================================================================
 # 主程序
 # =============================================================================
-def main():
+def render_cohort_page():
+    """队列仪表盘：先把新随访并入汇总，再在汇总格上按筛选条件聚合"""
+    st.markdown("### 📊 Cohort Analytics")
+    stats = get_cohort_stats()
+    if stats.pending():
+        with st.spinner("Updating cohort aggregates"):
+            stats.sync()
+
+    def scenario_label(scenario: str) -> str:
+        return f"{scenario} · {SCENARIO_TITLES[scenario]}" if scenario in SCENARIO_TITLES else scenario
+
+    col_age, col_bmi, col_kl, col_scenario = st.columns(4)
+    age_bands = col_age.multiselect("Age", [label for _, label in AGE_BANDS], key="cohort_age")
+    bmi_bands = col_bmi.multiselect("BMI", [label for _, label in BMI_BANDS], key="cohort_bmi")
+    kl_grades = col_kl.multiselect("KL grade (either knee)", list(KL_GRADES), key="cohort_kl")
+    scenarios = col_scenario.multiselect("Guideline scenario", list(SCENARIO_TITLES),
+                                         format_func=scenario_label, key="cohort_scenario")
+
+    started = time.perf_counter()
+    summary = stats.query(age_bands, bmi_bands, kl_grades, scenarios)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    col_n, col_followup, col_time = st.columns(3)
+    col_n.metric("Patients", f"{summary['patients']:,}")
+    col_followup.metric("With follow-up", f"{summary['followup']:,}")
+    col_time.metric("Query", f"{elapsed_ms:.0f} ms")
+    if not summary["patients"]:
+        st.caption("No patients match. Import follow-up visits with "
+                   "`python -m utils.visit_store import visits.csv`.")
+        return
+
+    col_kl_chart, col_scenario_chart = st.columns(2)
+    with col_kl_chart:
+        st.markdown("**KL grade distribution**")
+        kl = pd.DataFrame(summary["kl"])
+        kl["grade"] = kl["grade"].map(lambda g: str(g) if g >= 0 else "n/a")
+        st.altair_chart(alt.Chart(kl).mark_bar().encode(
+            x=alt.X("grade:N", title="KL grade"),
+            xOffset="knee:N",
+            y=alt.Y("patients:Q", title="Knees"),
+            color=alt.Color("knee:N", title=None),
+            tooltip=["knee", "grade", "patients"],
+        ).properties(height=260), use_container_width=True)
+    with col_scenario_chart:
+        st.markdown("**Guideline scenario matches**")
+        matched = pd.DataFrame(summary["scenarios"])
+        matched["scenario"] = matched["scenario"].map(scenario_label)
+        st.altair_chart(alt.Chart(matched).mark_bar().encode(
+            x=alt.X("patients:Q", title="Patients"),
+            y=alt.Y("scenario:N", title=None, sort="-x"),
+            tooltip=["scenario", "patients"],
+        ).properties(height=260), use_container_width=True)
+
+    st.markdown("**Mean KOOS change by BMI band** (latest follow-up − baseline)")
+    if summary["koos_change"]:
+        change = pd.DataFrame(summary["koos_change"])
+        st.altair_chart(alt.Chart(change).mark_bar().encode(
+            x=alt.X("bmi_band:N", title="BMI", sort=[label for _, label in BMI_BANDS]),
+            xOffset="metric:N",
+            y=alt.Y("mean_change:Q", title="Mean change (points)"),
+            color=alt.Color("metric:N", title=None),
+            tooltip=["bmi_band", "metric", alt.Tooltip("mean_change:Q", format=".1f"), "patients"],
+        ).properties(height=300), use_container_width=True)
+    else:
+        st.caption("No follow-up visits recorded for the selected patients yet.")
 
-    st.set_page_config(**PAGE_CONFIG)
 
-    render_navigation()
+def render_page(sid: Optional[str]):
+    """渲染导航栏与当前页面"""
+    render_navigation(sid)
 
     page = st.query_params.get("page", "Home")
 
@@ -1537,14 +1663,40 @@ def main():
         "Home": render_home_page,
         "Assessing Current Status": render_assessment_page,
         "Predicting Progression Risk": render_prediction_page,
-        "Tailored Therapy Recommendation": render_therapy_page
+        "Tailored Therapy Recommendation": render_therapy_page,
+        "Cohort Analytics": render_cohort_page,
     }
     
     render_func = page_routes.get(page)
-    if render_func:
+    if render_func and profiling_requested(st.query_params.get(PROFILE_PARAM)):
+        with RerunProfile(page) as profile:
+            render_func()
+        # 签名参数一次性（已在 profiling_requested 中消耗），从地址栏去掉
+        st.query_params.pop(PROFILE_PARAM, None)
+        render_profile_summary(profile.result)
+    elif render_func:
         render_func()
     else:
         st.error(f"未知页面: {page}")
 
+
+def main():
+
+    st.set_page_config(**PAGE_CONFIG)
+    setup_logging()
+    ctx = get_script_run_ctx()
+    begin_rerun(ctx.session_id if ctx else None)
+    delta_recorder = install_delta_recorder()
+    session_sync = attach_session(get_session_store())
+    try:
+        render_page(session_sync.sid if session_sync else None)
+    finally:
+        # st.rerun() / st.stop() 以异常结束脚本，同样要写入本次的变化
+        if session_sync is not None:
+            session_sync.flush()
+
+    if delta_recorder is not None:
+        render_delta_stats_panel(delta_recorder)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,69 @@
+# tests/test_build_artifacts.py
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+
+from utils import build_artifacts
+from utils.build_artifacts import (CODE_FILES, CURRENT_FILE, MANIFEST_FILE, PLAN_AGENTS, PREDICT_FILE,
+                                   PREDICTION_REPORT_PDF, STRUCTURED_REPORT_FILE, STRUCTURED_REPORT_PDF,
+                                   agent_artifact, build, load_artifacts, plan_file)
+from utils.guideline_index import GUIDELINE_INDEX_FILE
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """产物的源文件按相对路径记录：在临时目录里放一份输入再构建，不改动仓库中的文件"""
+    for name in (STRUCTURED_REPORT_FILE, PREDICT_FILE, GUIDELINE_INDEX_FILE,
+                 *(plan_file(agent) for agent in PLAN_AGENTS)):
+        shutil.copy(ROOT / name, tmp_path / name)
+    monkeypatch.chdir(tmp_path)
+    build("build", allow_latin_font=True)
+    return tmp_path
+
+
+def test_fresh_build_loads_everything(workdir):
+    artifacts = load_artifacts("build")
+    assert not artifacts.stale
+    plan = json.loads((workdir / plan_file("exercise")).read_text(encoding="utf-8"))
+    assert artifacts.blocks(agent_artifact("exercise"), plan)
+    # 输入与构建时不同则不返回，调用方现场渲染
+    assert artifacts.blocks(agent_artifact("exercise"), {**plan, "extra": 1}) is None
+
+
+def test_changed_source_invalidates_only_its_artifacts(workdir):
+    path = workdir / plan_file("exercise")
+    plan = json.loads(path.read_text(encoding="utf-8"))
+    plan["Week 13–16"] = {"Goal": "Maintain", "Prescription": []}
+    path.write_text(json.dumps(plan), encoding="utf-8")
+
+    artifacts = load_artifacts("build")
+    assert artifacts.stale == [agent_artifact("exercise")]
+    assert artifacts.get(PREDICTION_REPORT_PDF, json.loads((workdir / PREDICT_FILE).read_text(encoding="utf-8")))
+
+
+def test_shared_source_invalidates_all_dependents(workdir):
+    (workdir / STRUCTURED_REPORT_FILE).write_text("{}", encoding="utf-8")
+    stale = set(load_artifacts("build").stale)
+    assert {STRUCTURED_REPORT_PDF, agent_artifact("surgical_pharma")} <= stale
+    assert agent_artifact("exercise") not in stale
+
+
+def test_changed_code_invalidates_whole_build(workdir, monkeypatch):
+    checksums = build_artifacts.code_checksums()
+    changed = {**checksums, CODE_FILES[0]: "0" * 64}
+    monkeypatch.setattr(build_artifacts, "code_checksums", lambda: changed)
+
+    artifacts = load_artifacts("build")
+    assert len(artifacts) == 0
+    assert set(artifacts.stale) == set(json.loads(
+        (workdir / "build" / artifacts.version / MANIFEST_FILE).read_text(encoding="utf-8")
+    )["artifacts"])
+
+
+def test_rebuild_with_same_inputs_keeps_version(workdir):
+    first = (workdir / "build" / CURRENT_FILE).read_text(encoding="utf-8")
+    assert build("build", allow_latin_font=True)["version"] == first.strip()
@@ -0,0 +1,58 @@
+# tests/test_case_store.py
+import json
+import os
+
+from utils.case_store import CaseStore
+
+
+def _case(age, sex="Female", reports=("X-ray",)):
+    return {"demographics": {"age": age, "sex": sex, "bmi": 27.5},
+            "reports": list(reports), "dialogue": [{"role": "doctor", "text": "hi"}]}
+
+
+def _write(path, cases, mtime_ns):
+    path.write_text(json.dumps(cases), encoding="utf-8")
+    # 签名按 mtime/大小判断，显式设置 mtime，避免同一时钟刻度内两次写入被视为未变化
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_sync_imports_updates_and_deletes(tmp_path):
+    source = tmp_path / "cases.json"
+    store = CaseStore(str(tmp_path / "cases.db"))
+
+    _write(source, {"A": _case(60), "B": _case(70, "Male")}, 1_000_000_000)
+    assert store.sync_from_json(str(source))
+    assert [c["title"] for c in store.list_cases()[0]] == ["A", "B"]
+    ids = store.case_ids()
+
+    # 文件未变化时不重新导入
+    assert not store.sync_from_json(str(source))
+
+    _write(source, {"B": _case(71, "Male"), "C": _case(55)}, 2_000_000_000)
+    assert store.sync_from_json(str(source))
+    rows, has_more = store.list_cases()
+    assert [c["title"] for c in rows] == ["B", "C"]
+    assert not has_more
+    # 已有标题原地更新，id 不变
+    b = next(c for c in rows if c["title"] == "B")
+    assert b["id"] == ids[1] and b["age"] == 71
+    assert store.get_case(ids[0]) is None
+
+
+def test_list_cases_pages_and_filters(tmp_path):
+    store = CaseStore(str(tmp_path / "cases.db"))
+    for i in range(5):
+        store.upsert_case(f"case {i}", _case(50 + i, "Male" if i % 2 else "Female", reports=(f"R{i}",)))
+
+    page, has_more = store.list_cases(offset=0, limit=2)
+    assert [c["title"] for c in page] == ["case 0", "case 1"] and has_more
+    page, has_more = store.list_cases(offset=4, limit=2)
+    assert [c["title"] for c in page] == ["case 4"] and not has_more
+
+    assert [c["title"] for c in store.list_cases(sex="Male")[0]] == ["case 1", "case 3"]
+    assert [c["title"] for c in store.list_cases(age_range=(52, 53))[0]] == ["case 2", "case 3"]
+    assert [c["title"] for c in store.list_cases(report_name="R4")[0]] == ["case 4"]
+
+    full = store.get_case(store.case_ids()[0])
+    assert full["dialogue"] == [{"role": "doctor", "text": "hi"}]
+    assert full["report_names"] == ["R0"]
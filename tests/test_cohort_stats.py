@@ -0,0 +1,83 @@
+# tests/test_cohort_stats.py
+import random
+from pathlib import Path
+
+import pytest
+
+from utils.cohort_stats import CohortStats
+from utils.guideline_index import GUIDELINE_INDEX_FILE, load_or_build_index
+from utils.visit_store import TRACKED_METRICS, VisitStore
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def features(rng: random.Random, age: float):
+    return {"AGE": age, "BMI": rng.uniform(18, 40), "XRKL_R": rng.randint(0, 4), "XRKL_L": rng.randint(0, 4),
+            **{key: rng.uniform(20, 100) for key, _ in TRACKED_METRICS}}
+
+
+def cells(stats: CohortStats):
+    return sorted((r["age_band"], r["bmi_band"], r["kl_r"], r["kl_l"], r["scenario"], r["metric"],
+                   r["n"], round(r["total"], 6))
+                  for r in stats.conn.execute("SELECT * FROM cohort_cells"))
+
+
+def rounded(summary):
+    """query() 结果中的均值按浮点求和顺序可能有末位差异"""
+    return {key: [{k: round(v, 6) if isinstance(v, float) else v for k, v in row.items()} for row in value]
+            if isinstance(value, list) else value for key, value in summary.items()}
+
+
+def facts(stats: CohortStats):
+    return sorted(tuple(r) for r in stats.conn.execute("SELECT * FROM cohort_facts"))
+
+
+@pytest.fixture(scope="module")
+def index():
+    return load_or_build_index(str(ROOT / GUIDELINE_INDEX_FILE))
+
+
+@pytest.fixture
+def populated(tmp_path, index):
+    rng = random.Random(7)
+    store = VisitStore(str(tmp_path / "visits.db"))
+    for i in range(40):
+        age = 45 + i
+        store.add_visit(f"p{i}", "V00", "2020-01-01", features(rng, age))
+        if i % 3:
+            store.add_visit(f"p{i}", "V01", "2022-01-01", features(rng, age + 2))
+    return store, CohortStats(store, index), rng
+
+
+def test_incremental_sync_matches_rebuild(populated, index):
+    store, stats, rng = populated
+    assert stats.sync() == 40
+    assert stats.pending() == 0
+
+    # 追加随访：有随访的患者变化量改变，无随访的患者新增随访
+    store.add_visit("p1", "V04", "2024-01-01", features(rng, 50))
+    store.add_visit("p3", "V01", "2022-02-01", features(rng, 50))
+    store.add_visit("p99", "V00", "2021-05-05", features(rng, 70))
+    assert stats.pending() == 3
+    assert stats.sync() == 3
+    incremental_cells, incremental_facts = cells(stats), facts(stats)
+    incremental_query = rounded(stats.query())
+
+    rebuilt = CohortStats(store, index)
+    assert rebuilt.rebuild() == 41
+    assert cells(rebuilt) == incremental_cells
+    assert facts(rebuilt) == incremental_facts
+    assert rounded(rebuilt.query()) == incremental_query
+
+
+def test_sync_is_idempotent(populated):
+    _, stats, _ = populated
+    stats.sync()
+    before = cells(stats)
+    assert stats.sync() == 0
+    # 重新入队同一批患者：事实未变，不产生差量
+    stats.conn.execute("INSERT INTO cohort_queue (patient_id) VALUES ('p0'), ('p1')")
+    stats.conn.commit()
+    assert stats.sync() == 2
+    assert cells(stats) == before
+    assert stats.query()["patients"] == 40
@@ -0,0 +1,59 @@
+# tests/test_dicom_ingest.py
+import numpy as np
+import pytest
+
+pydicom = pytest.importorskip("pydicom")
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRBigEndian, ExplicitVRLittleEndian, generate_uid
+
+from utils.dicom_ingest import DicomImage
+
+# 16 位容器中的 12 位像素，高 4 位带有无关位；含正负边界值
+RAW = np.array([[0x0FFF, 0xF005, 0x0800, 0x07FF],
+                [0xF800, 0x1234, 0x0000, 0x0001],
+                [0xA7FF, 0x5800, 0x0FFE, 0x8001]], dtype=np.uint16)
+
+
+def write_dicom(path, raw: np.ndarray, signed: bool, little_endian: bool):
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian if little_endian else ExplicitVRBigEndian
+    ds.file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.1.1"
+    ds.file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    ds.SOPClassUID = ds.file_meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = ds.file_meta.MediaStorageSOPInstanceUID
+    ds.Modality = "DX"
+    ds.Rows, ds.Columns = raw.shape
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit = 16, 12, 11
+    ds.PixelRepresentation = int(signed)
+    ds.PixelData = raw.astype("<u2" if little_endian else ">u2").tobytes()
+    ds.save_as(path, enforce_file_format=True, little_endian=little_endian, implicit_vr=False)
+
+
+@pytest.mark.parametrize("little_endian", [True, False], ids=["little", "big"])
+@pytest.mark.parametrize("signed", [True, False], ids=["signed", "unsigned"])
+def test_12_bit_memmap_matches_pydicom(tmp_path, signed, little_endian):
+    path = str(tmp_path / "image.dcm")
+    write_dicom(path, RAW, signed, little_endian)
+
+    image = DicomImage(path)
+    assert image.memory_mapped
+    pixels = image.frame(0)
+    expected = pydicom.dcmread(path).pixel_array
+
+    np.testing.assert_array_equal(pixels, expected)
+    assert pixels.dtype.kind == expected.dtype.kind
+    if signed:
+        assert pixels.min() == -2048 and pixels.max() == 2047
+
+
+def test_preview_reads_sampled_rows(tmp_path):
+    path = str(tmp_path / "image.dcm")
+    raw = (np.arange(64 * 48, dtype=np.uint16) % 4096).reshape(64, 48)
+    write_dicom(path, raw, signed=False, little_endian=True)
+
+    preview = DicomImage(path).preview(0, max_size=16)
+    assert preview.mode == "L"
+    assert max(preview.size) == 16
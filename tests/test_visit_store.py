@@ -0,0 +1,61 @@
+# tests/test_visit_store.py
+import time
+
+import pytest
+
+from utils.trajectory_model import HORIZONS, OUTPUT_METRICS
+from utils.visit_store import OBSERVED, PREDICTED, VisitStore, compare, trajectory_rows
+
+PAIN = OUTPUT_METRICS[0][1]
+
+
+def prediction(value: float):
+    """每个指标、每个随访都取同一个值的模型输出"""
+    return {f"symptom_trajectory.{path}.{visit}": value for path, _, _, _ in OUTPUT_METRICS for visit, _ in HORIZONS}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = VisitStore(str(tmp_path / "visits.db"))
+    store.add_visit("p1", "V00", "2020-03-01", {PAIN: 60.0, "AGE": 61})
+    store.add_visit("p1", "V01", "2022-03-02", {PAIN: 70.0})
+    return store
+
+
+def test_visits_are_append_only(store):
+    with pytest.raises(ValueError):
+        store.add_visit("p1", "V00", "2020-03-01", {PAIN: 1.0})
+    added = store.import_visits([{"patient_id": "p1", "visit": "V00", "visit_date": "2020-03-01", PAIN: "5"},
+                                 {"patient_id": "p2", "visit": "V00", "visit_date": "2021-01-01", PAIN: "55"}])
+    assert added == 1
+    assert store.history("p1", OBSERVED)[0]["features"][PAIN] == 60.0
+    assert store.history("p2")[0]["features"][PAIN] == 55.0
+
+
+def test_record_prediction_once_per_version(store):
+    assert store.record_prediction("p1", "2020-03-01", prediction(65.0), "v1") == len(HORIZONS)
+    assert store.record_prediction("p1", "2020-03-01", prediction(99.0), "v1") == 0
+    predicted = store.history("p1", PREDICTED)
+    assert {r["visit"]: r["visit_date"] for r in predicted} == {"V01": "2022-03-01", "V04": "2024-03-01"}
+    assert all(r["features"][PAIN] == 65.0 for r in predicted)
+
+
+def test_compare_uses_latest_recorded_version(store):
+    # 版本名的字典序与记录顺序相反：应按 recorded 取最近记录的版本
+    store.record_prediction("p1", "2020-03-01", prediction(66.0), "z-old")
+    time.sleep(0.01)
+    store.record_prediction("p1", "2020-03-01", prediction(68.0), "a-new")
+
+    rows = [r for r in compare(store.history("p1")) if r["visit"] == "V01"]
+    pain = next(r for r in rows if r["metric"] == OUTPUT_METRICS[0][2])
+    assert pain["predicted"] == 68.0 and pain["error"] == 2.0
+
+    pinned = compare(store.history("p1"), model_version="z-old")
+    assert next(r for r in pinned if r["metric"] == OUTPUT_METRICS[0][2])["predicted"] == 66.0
+
+
+def test_unfitted_predictions_are_ignored(store):
+    store.record_prediction("p1", "2020-03-01", prediction(10.0), "reference")
+    history = store.history("p1")
+    assert compare(history) == []
+    assert {r["kind"] for r in trajectory_rows(history)} == {OBSERVED}
@@ -0,0 +1,258 @@
+# utils/agent_html.py
+import re
+from typing import Dict, List
+
+import markdown
+
+from utils.guideline_index import GuidelineIndex, parse_guideline, patient_query_from_report
+from utils.report_template import get_template
+
+# 治疗方案智能体的对话气泡 HTML。只依赖方案 JSON（及指南索引 / 结构化病历），
+# 应用运行时与预构建（python -m utils.build_artifacts）共用同一套渲染。
+PLAN_AGENTS = ("exercise", "surgical_pharma", "nutrition_psychology", "clinical_integration")
+
+
+def render_agent_message_return_html(role: str, action_html: str, style_class: str) -> str:
+    return f"""
+    <div class="chat-bubble {style_class}">
+        <div class="chat-icon"><strong>{role}</strong></div>
+        <div class="chat-content" style="margin-top: 8px; text-align: left;">
+            {action_html}
+        </div>
+    </div>
+    """
+
+def render_agent_message(role: str, action: str, style_class: str) -> str:
+    action_html = markdown.markdown(action, extensions=["extra", "nl2br"])  # 转换 Markdown 为 HTML
+    return f"""
+    <div class="chat-bubble {style_class}">
+        <div class="chat-icon"><strong>{role}</strong></div>
+        <div style="margin-top: 8px; text-align: left;">{action_html}</div>
+    </div>
+    """
+
+def extract_week_number(phase_name: str) -> int:
+    """从 'Week 1–4'（含 en dash）中提取排序基准数字"""
+    # 替换 en dash（–）和 em dash（—）为 ASCII dash（-）
+    normalized = phase_name.replace("–", "-").replace("—", "-")
+    match = re.search(r"Week (\d+)", normalized)
+    return int(match.group(1)) if match else 0
+
+
+def render_exercise_plan_return_html(plan: Dict) -> str:
+    sorted_phases = sorted(plan.items(), key=lambda x: extract_week_number(x[0]))
+    template = get_template("exercise_phase")
+    html_blocks = []
+
+    for i, (phase, content) in enumerate(sorted_phases, start=1):
+        view = {
+            "index": i,
+            "phase": phase,
+            "goal": content.get("Goal", ""),
+            "prescriptions": [
+                {
+                    "category": item.get("Category", "Training"),
+                    "parts": [part.strip() for part in item.get("Description", "").split(", ")],
+                }
+                for item in content.get("Prescription", [])
+            ],
+        }
+        html = render_agent_message_return_html(
+            role="A. Exercise Prescriptionist Agent",
+            action_html=template.render_html(view),
+            style_class="exercise"
+        )
+        html_blocks.append(html)
+
+    return "\n".join(html_blocks)
+
+
+# =============================================================================
+# Surgical & Pharmacological：药物备注规则（按药名关键字匹配，取第一条）
+# =============================================================================
+MEDICATION_NOTES = (
+    ("Ibuprofen", "Monitor for GI effects; take with food"),
+    ("Acetaminophen", "Not to exceed 3000 mg daily"),
+    ("Corticosteroids", "Consider after failed oral analgesics"),
+)
+
+
+def medication_notes(name: str) -> str:
+    return next((note for key, note in MEDICATION_NOTES if key in name), "")
+
+
+def render_surgical_pharma_plan_return_html(plan_data: Dict, index: GuidelineIndex,
+                                           structured_report: Dict) -> List[str]:
+    """
+    返回 Surgical & Pharmacological Specialist Agent 的多个 HTML 块列表，
+    每个块单独传入 st.markdown(..., unsafe_allow_html=True) 渲染。
+    方案未给出匹配指南时，用结构化病历在指南索引中检索。
+    """
+    html_blocks = []
+
+    # Step 1: 渲染 Guideline Summary（结构化字段来自预构建的本地指南索引）
+    matched = []
+    for item in plan_data.get("matched_guidelines", []):
+        guideline_text = item.get("guideline", "")
+        match = re.search(r"Scenario (\d+):", guideline_text)
+        doc = index.get(match.group(1)) if match else None
+        matched.append(doc or parse_guideline(guideline_text))
+    if not matched:
+        matched = index.search(patient_query_from_report(structured_report), top_k=3)
+
+    guideline_html = render_agent_message_return_html(
+        role="B. Surgical & Pharmacological Specialist Agent",
+        action_html=get_template("guideline_summary").render_html({"guidelines": matched}),
+        style_class="surgical"
+    )
+    html_blocks.append(guideline_html)
+
+    # Step 2: 药物推荐表格
+    meds = [
+        {
+            "name": med.get("name", ""),
+            "dosage": med.get("dosage", ""),
+            "frequency": med.get("frequency", ""),
+            "notes": medication_notes(med.get("name", "")),
+        }
+        for med in plan_data.get("medication_plan", [])
+    ]
+    med_table_html = get_template("medication_plan").render_html({"medications": meds})
+    wrapped_html = f"<div class='markdown-wrapper'>{med_table_html}</div>"
+
+    pharma_html = render_agent_message_return_html(
+        role="B. Surgical & Pharmacological Specialist Agent",
+        action_html=wrapped_html,
+        style_class="pharma"
+    )
+    html_blocks.append(pharma_html)
+
+    return html_blocks
+
+
+# =============================================================================
+# Nutritional & Psychological：固定的方案结构与策略说明
+#   营养策略按 (编号, 标题, 匹配条目的谓词, 要点) 分类，编号固定；
+#   心理干预按 (匹配条目的谓词, 标题, 要点) 匹配，编号为条目在方案中的序号。
+# =============================================================================
+NUTRITION_STRATEGIES = (
+    (1, "Anti-inflammatory Focus",
+     lambda item: "Anti-inflammatory" in item or "Adequacy" in item,
+     ["Incorporate omega-3 rich foods (fatty fish, walnuts, flaxseeds)",
+      "Increase consumption of antioxidant-rich leafy greens",
+      "Integrate nuts and seeds for micronutrient support",
+      "Purpose: Reduce joint inflammation and support tissue repair"]),
+    (2, "Macronutrient Optimization",
+     lambda item: "macronutrient" in item or "Balance" in item,
+     ["Ensure adequate protein intake to support muscle maintenance",
+      "Balance complex carbohydrates for sustained energy",
+      "Include healthy fats to support joint lubrication",
+      "Purpose: Enhance musculoskeletal strength and joint function"]),
+    (3, "Weight Management",
+     lambda item: "calorie" in item.lower(),
+     ["Implement portion awareness techniques",
+      "Monitor caloric balance through guided food journaling",
+      "Adjust intake based on activity levels and rehabilitation phases",
+      "Purpose: Reduce mechanical stress on knee joints"]),
+)
+
+PSYCHOLOGY_APPROACHES = (
+    (lambda item: "Motivational" in item, "Motivational Interviewing",
+     ["Explore personal values related to mobility and function",
+      "Resolve ambivalence about rehabilitation commitment",
+      "Develop intrinsic motivation for consistent exercise adherence",
+      "Purpose: Strengthen commitment to rehabilitation protocols"]),
+    (lambda item: "CBT" in item, "Cognitive Restructuring",
+     ["Identify and challenge maladaptive thoughts about pain and recovery",
+      "Transform catastrophizing patterns into realistic perspectives",
+      "Develop confidence in functional improvement",
+      "Purpose: Reduce pain-related fear and enhance rehabilitation engagement"]),
+    (lambda item: "mindfulness" in item.lower(), "Digital Mindfulness Integration",
+     ["Implement scheduled mindfulness practice through mobile notifications",
+      "Provide guided pain-specific meditation recordings",
+      "Track stress levels in relation to symptom fluctuations",
+      "Purpose: Enhance stress management and improve pain tolerance"]),
+)
+
+
+def _nutrition_view(nutrition: Dict) -> Dict:
+    content = nutrition.get("content", [])
+    # 每个条目只归入第一个匹配的分类
+    categories = {next((n for n, _, match, _ in NUTRITION_STRATEGIES if match(item)), None) for item in content}
+    return {
+        "title": "Nutritional Intervention Plan",
+        "goal": nutrition.get("goal", ""),
+        "delivery": "Personalized one-on-one counseling supplemented with mobile application reminders",
+        "structure": [
+            "Initial Phase: Weekly consultations (first 6 weeks)",
+            "Maintenance Phase: Bi-weekly check-ins",
+            f"Total Duration: {nutrition.get('duration', '')} comprehensive program",
+        ],
+        "approaches_label": "Key Nutritional Strategies:",
+        "approaches": [
+            {"number": n, "title": title, "points": points}
+            for n, title, _, points in NUTRITION_STRATEGIES if n in categories
+        ],
+        "note": "",
+    }
+
+
+def _psychology_view(psych: Dict) -> Dict:
+    approaches = []
+    for idx, item in enumerate(psych.get("content", []), start=1):
+        found = next(((title, points) for match, title, points in PSYCHOLOGY_APPROACHES if match(item)), None)
+        if found:
+            approaches.append({"number": idx, "title": found[0], "points": found[1]})
+    return {
+        "title": "Psychological Support",
+        "goal": psych.get("goal", ""),
+        "delivery": "Tele-health Cognitive Behavioral Therapy with structured daily practice components",
+        "structure": [
+            "Intensive Phase: Weekly sessions (first 8 weeks)",
+            "Consolidation Phase: Bi-weekly sessions",
+            f"Total Duration: {psych.get('duration', '')} comprehensive program",
+        ],
+        "approaches_label": "Evidence-Based Psychological Approaches:",
+        "approaches": approaches,
+        "note": "Note: Both nutritional and psychological interventions will be coordinated with "
+                "physical rehabilitation to ensure comprehensive care integration.",
+    }
+
+
+def render_nutrition_psychology_plan_return_html(plan_data: Dict) -> List[str]:
+    """返回 Nutritional & Psychological Specialist Agent 的多个 HTML 气泡块"""
+    template = get_template("support_program")
+    views = (
+        (_nutrition_view(plan_data.get("nutrition", {})), "nutrition"),
+        (_psychology_view(plan_data.get("psychology", {})), "psychology"),
+    )
+    return [
+        render_agent_message_return_html(
+            role="C. Nutritional & Psychological Specialist Agent",
+            action_html=template.render_html(view),
+            style_class=style_class
+        )
+        for view, style_class in views
+    ]
+
+
+def render_clinical_decision_agent_return_html(plan_data: Dict) -> str:
+    return render_agent_message_return_html(
+        role="🧩 Clinical Decision-Making Agent",
+        action_html=get_template("clinical_decision").render_html(plan_data),
+        style_class="decision"
+    )
+
+
+
+def render_agent_blocks(agent_type: str, plan: Dict, index: GuidelineIndex, structured_report: Dict) -> List[str]:
+    """某个智能体方案的全部 HTML 块；agent_type 同 PLAN_AGENTS"""
+    if agent_type == "exercise":
+        return [render_exercise_plan_return_html(plan)]
+    if agent_type == "surgical_pharma":
+        return render_surgical_pharma_plan_return_html(plan, index, structured_report)
+    if agent_type == "nutrition_psychology":
+        return render_nutrition_psychology_plan_return_html(plan)
+    if agent_type == "clinical_integration":
+        return [render_clinical_decision_agent_return_html(plan)]
+    raise KeyError(f"未知的智能体: {agent_type}")
@@ -0,0 +1,269 @@
+# utils/build_artifacts.py
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from utils.agent_html import PLAN_AGENTS, render_agent_blocks
+from utils.guideline_index import GUIDELINE_INDEX_FILE, load_or_build_index
+from utils.pdf_report import FONT_CANDIDATES, PDF_FONT_ENV, find_unicode_font, has_cjk
+from utils.report_template import get_template
+from utils.static_assets import LOGO, STATIC_DIR, logo_data_uri
+
+# 预构建产物（例如在镜像构建时执行 python -m utils.build_artifacts build）：
+#   build/CURRENT                    当前版本号（一行文本）
+#   build/<version>/manifest.json    每个产物的文件名、输入摘要与源文件校验和
+#   build/<version>/<artifact>
+# 版本号由渲染代码与源文件的校验和导出，内容不变则版本不变。
+# 应用启动时逐个核对源文件校验和，有变化的产物不加载，改为现场渲染；
+# 取用时再核对输入数据的摘要，与构建时不同（例如运行中改动了方案 JSON）同样现场渲染。
+BUILD_DIR = "build"
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+BUILD_FORMAT = 1
+
+STRUCTURED_REPORT_FILE = "structured_report_template.json"
+PREDICT_FILE = "predict_params_ori.json"
+
+STRUCTURED_REPORT_PDF = "structured_report.pdf"
+PREDICTION_REPORT_PDF = "prediction_report.pdf"
+LOGO_DATA_URI = "logo.txt"
+
+# 渲染代码：任何一个变化都会使全部产物失效（相对仓库根目录）
+ROOT = Path(__file__).resolve().parent.parent
+CODE_FILES = ("utils/agent_html.py", "utils/guideline_index.py", "utils/report_template.py",
+              "utils/pdf_report.py", "utils/static_assets.py", "utils/build_artifacts.py")
+
+log = logging.getLogger("kom.artifacts")
+
+
+def agent_artifact(agent_type: str) -> str:
+    return f"agent_{agent_type}.json"
+
+
+def plan_file(agent_type: str) -> str:
+    return f"{agent_type}_plan.json"
+
+
+def input_digest(data) -> str:
+    """渲染输入的摘要：字节直接哈希，其余按键排序的 JSON 哈希"""
+    if not isinstance(data, bytes):
+        data = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_checksum(path: Path) -> Optional[str]:
+    """源文件的 sha256；文件不存在记为 None（如未预构建的指南索引）"""
+    try:
+        return hashlib.sha256(path.read_bytes()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def code_checksums() -> Dict[str, Optional[str]]:
+    return {rel: file_checksum(ROOT / rel) for rel in CODE_FILES}
+
+
+def source_checksums(paths: List[str]) -> Dict[str, Optional[str]]:
+    return {path: file_checksum(Path(path)) for path in paths}
+
+
+def _load_json(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def default_prediction() -> Dict:
+    """默认患者的预测，与应用中 predict_trajectory 一致：完整模型预生成的结果"""
+    return _load_json(PREDICT_FILE)
+
+
+# =============================================================================
+# 构建
+# =============================================================================
+def render_all() -> Dict[str, Dict]:
+    """渲染全部产物：name -> {"data": bytes, "input": 摘要, "sources": 源文件列表}"""
+    structured_report = _load_json(STRUCTURED_REPORT_FILE)
+    prediction = default_prediction()
+    index = load_or_build_index()
+    logo = logo_data_uri()
+
+    artifacts = {
+        STRUCTURED_REPORT_PDF: {
+            "data": get_template("structured_report").render_pdf(structured_report),
+            "input": input_digest(structured_report),
+            "sources": [STRUCTURED_REPORT_FILE],
+        },
+        PREDICTION_REPORT_PDF: {
+            "data": get_template("prediction_report").render_pdf(prediction),
+            "input": input_digest(prediction),
+            "sources": [PREDICT_FILE],
+        },
+        LOGO_DATA_URI: {
+            "data": logo.encode("ascii"),
+            "input": input_digest(b""),
+            "sources": [str(STATIC_DIR / LOGO)],
+        },
+    }
+    for agent_type in PLAN_AGENTS:
+        plan = _load_json(plan_file(agent_type))
+        blocks = render_agent_blocks(agent_type, plan, index, structured_report)
+        sources = [plan_file(agent_type)]
+        if agent_type == "surgical_pharma":
+            sources += [GUIDELINE_INDEX_FILE, STRUCTURED_REPORT_FILE]
+        artifacts[agent_artifact(agent_type)] = {
+            "data": json.dumps(blocks, ensure_ascii=False).encode("utf-8"),
+            "input": input_digest(plan),
+            "sources": sources,
+        }
+    return artifacts
+
+
+def build(build_dir: str = BUILD_DIR, allow_latin_font: bool = False) -> Dict:
+    """
+    渲染全部产物写入 build/<version>/ 并切换 CURRENT。
+    与模型注册表相同：先写临时目录再整体改名，读者不会看到只写了一半的版本。
+    找不到含中文字形的字体时失败（报告 PDF 会丢掉中文），allow_latin_font 仅供开发时跳过。
+    """
+    font = find_unicode_font()
+    if not has_cjk(font) and not allow_latin_font:
+        raise RuntimeError(f"PDF 字体 {font} 不含中文字形：请放置 {FONT_CANDIDATES[0]} 或设置 {PDF_FONT_ENV}"
+                           "（见 fonts/README.md）")
+    start = time.perf_counter()
+    rendered = render_all()
+    code = code_checksums()
+    entries = {
+        name: {"file": name, "input": item["input"], "size": len(item["data"]),
+               "sources": source_checksums(item["sources"])}
+        for name, item in rendered.items()
+    }
+    version = input_digest({"format": BUILD_FORMAT, "code": code, "font": font,
+                            "inputs": {name: entry["input"] for name, entry in entries.items()},
+                            "sources": {name: entry["sources"] for name, entry in entries.items()}})[:12]
+    manifest = {"format": BUILD_FORMAT, "version": version, "built": time.time(), "font": font,
+                "code": code, "artifacts": entries,
+                "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)}
+
+    root = Path(build_dir)
+    root.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(dir=root, prefix=f".{version}."))
+    try:
+        for name, item in rendered.items():
+            (staging / name).write_bytes(item["data"])
+        (staging / MANIFEST_FILE).write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.chmod(staging, 0o755)
+        target = root / version
+        if target.exists():
+            shutil.rmtree(target)
+        os.rename(staging, target)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    pointer = root / f".{CURRENT_FILE}.tmp"
+    pointer.write_text(version + "\n", encoding="utf-8")
+    os.replace(pointer, root / CURRENT_FILE)
+    return manifest
+
+
+# =============================================================================
+# 加载
+# =============================================================================
+class BuildArtifacts:
+    """已校验的预构建产物（全部读入内存，总共几百 KB）；get 返回 None 时调用方现场渲染"""
+
+    def __init__(self, version: Optional[str] = None, entries: Optional[Dict[str, Dict]] = None,
+                 stale: Optional[List[str]] = None):
+        self.version = version
+        self.entries = entries or {}
+        self.stale = stale or []
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, name: str, data=b"") -> Optional[bytes]:
+        """产物存在且构建时的输入与 data 相同才返回"""
+        entry = self.entries.get(name)
+        if entry is None or entry["input"] != input_digest(data):
+            return None
+        return entry["data"]
+
+    def text(self, name: str, data=b"") -> Optional[str]:
+        payload = self.get(name, data)
+        return None if payload is None else payload.decode("utf-8")
+
+    def blocks(self, name: str, data) -> Optional[List[str]]:
+        payload = self.get(name, data)
+        return None if payload is None else json.loads(payload)
+
+
+def load_artifacts(build_dir: str = BUILD_DIR) -> BuildArtifacts:
+    """
+    读取 CURRENT 指向的版本。渲染代码或字体变化时整体不用；
+    否则逐个产物核对源文件校验和，不一致的记入 stale，其余读入内存。
+    """
+    root = Path(build_dir)
+    try:
+        version = (root / CURRENT_FILE).read_text(encoding="utf-8").strip()
+        manifest = _load_json(str(root / version / MANIFEST_FILE))
+    except FileNotFoundError:
+        return BuildArtifacts()
+    if manifest.get("format") != BUILD_FORMAT:
+        log.warning("build artifacts ignored", extra={"version": version, "reason": "format"})
+        return BuildArtifacts(version, stale=list(manifest.get("artifacts", {})))
+    if manifest["code"] != code_checksums() or manifest["font"] != find_unicode_font():
+        log.warning("build artifacts ignored", extra={"version": version, "reason": "code"})
+        return BuildArtifacts(version, stale=list(manifest["artifacts"]))
+
+    entries, stale = {}, []
+    checksums: Dict[str, Optional[str]] = {}
+    for name, entry in manifest["artifacts"].items():
+        for path in entry["sources"]:
+            if path not in checksums:
+                checksums[path] = file_checksum(Path(path))
+        if any(checksums[path] != checksum for path, checksum in entry["sources"].items()):
+            stale.append(name)
+            continue
+        entries[name] = {"input": entry["input"], "data": (root / version / entry["file"]).read_bytes()}
+    if stale:
+        log.warning("build artifacts stale", extra={"version": version, "stale": stale})
+    log.info("build artifacts loaded", extra={"version": version, "artifacts": len(entries)})
+    return BuildArtifacts(version, entries, stale)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="预构建静态产物（报告 PDF、智能体 HTML、内联 logo）")
+    parser.add_argument("--root", default=BUILD_DIR)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    build_cmd = sub.add_parser("build", help="渲染全部产物并切换为当前版本")
+    build_cmd.add_argument("--allow-latin-font", action="store_true",
+                           help="字体不含中文字形时仍然构建（报告中的中文会被剔除，仅供开发）")
+    sub.add_parser("check", help="核对当前版本与源文件是否一致")
+    args = parser.parse_args()
+
+    if args.cmd == "build":
+        try:
+            manifest = build(args.root, args.allow_latin_font)
+        except RuntimeError as e:
+            parser.exit(1, f"{e}\n")
+        for name, entry in manifest["artifacts"].items():
+            print(f"{entry['size']:>9,}  {name}")
+        print(f"已生成 {args.root}/{manifest['version']}（{manifest['elapsed_ms']:.0f} ms）")
+    else:
+        artifacts = load_artifacts(args.root)
+        if artifacts.version is None:
+            print("尚未构建")
+            return
+        print(f"版本 {artifacts.version}：可用 {len(artifacts)} 个，已过期 {len(artifacts.stale)} 个")
+        for name in artifacts.stale:
+            print(f"  过期: {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+# utils/bulk_export.py
+import argparse
+import json
+import multiprocessing
+import os
+import secrets
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple, Union
+
+from utils.case_store import CASE_DB_FILE, CaseStore
+from utils.report_template import get_template
+
+CHUNK_SIZE = 64 * 1024
+# 应用内导出写到静态目录，由 Streamlit 静态服务（app/static/exports/...）从磁盘分块发送，
+# 不经过会话内存；文件名含随机令牌。Streamlit 静态服务单文件上限 200 MB，超过时分卷。
+EXPORT_DIR = Path(__file__).resolve().parent.parent / "static" / "exports"
+EXPORT_PART_BYTES = 150 * 1024 * 1024
+# 超过该时长的导出文件（包括已过期会话留下的）在下次导出或应用启动时删除
+EXPORT_TTL = 3600
+
+
+def _safe_name(case_id: int, title: str) -> str:
+    stem = "".join(c if c.isalnum() or c in "-_" else "_" for c in title.split(":")[0]).strip("_")
+    return f"{case_id:06d}_{stem or 'case'}"
+
+
+# 在子进程中执行：每个进程自己打开只读连接，按病例生成 PDF + JSON
+_worker_store: Optional[CaseStore] = None
+
+
+def _init_worker(db_path: str):
+    global _worker_store
+    _worker_store = CaseStore(db_path)
+
+
+def _render_case(case_id: int) -> Optional[Tuple[str, bytes, bytes]]:
+    case = _worker_store.get_case(case_id)
+    if case is None:
+        return None
+    # 模板在每个子进程中只编译一次，之后每个病例只做绑定
+    pdf_bytes = get_template("case_report").render_pdf(case)
+    json_bytes = json.dumps(case, ensure_ascii=False, indent=2).encode("utf-8")
+    return _safe_name(case_id, case["title"]), pdf_bytes, json_bytes
+
+
+def _write_member(zf: zipfile.ZipFile, name: str, data: bytes):
+    # 分块写入，force_zip64 保证超大归档也能流式写出
+    with zf.open(name, "w", force_zip64=True) as member:
+        view = memoryview(data)
+        for start in range(0, len(view), CHUNK_SIZE):
+            member.write(view[start:start + CHUNK_SIZE])
+
+
+def _iter_rendered(db_path: str, case_ids: List[int], workers: int) -> Iterator[Tuple[str, bytes, bytes]]:
+    """
+    并行渲染，最多 2×workers 个报告同时驻留内存；按提交顺序产出，保证归档顺序稳定。
+    使用 spawn，避免在 Streamlit 多线程进程里 fork。
+    重复的 id 只渲染一次（成员名以 id 开头，重复会产生同名成员）。
+    """
+    case_ids = list(dict.fromkeys(case_ids))
+    ctx = multiprocessing.get_context("spawn")
+    max_in_flight = workers * 2
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                             initializer=_init_worker, initargs=(db_path,)) as pool:
+        pending = deque()
+        ids = iter(case_ids)
+        for case_id in ids:
+            pending.append(pool.submit(_render_case, case_id))
+            if len(pending) >= max_in_flight:
+                break
+        while pending:
+            result = pending.popleft().result()
+            next_id = next(ids, None)
+            if next_id is not None:
+                pending.append(pool.submit(_render_case, next_id))
+            if result is not None:
+                yield result
+
+
+def export_cases_zip(case_ids: Iterable[int],
+                     out: Union[str, BinaryIO],
+                     db_path: str = CASE_DB_FILE,
+                     workers: Optional[int] = None) -> int:
+    """把选定病例的 PDF + JSON 报告写入 ZIP（路径或可写流，可不支持 seek），返回病例数"""
+    workers = workers or max(1, min(4, os.cpu_count() or 1))
+    count = 0
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for base, pdf_bytes, json_bytes in _iter_rendered(db_path, list(case_ids), workers):
+            _write_member(zf, f"{base}/report.pdf", pdf_bytes)
+            _write_member(zf, f"{base}/case.json", json_bytes)
+            count += 1
+    return count
+
+
+def export_cases_zip_parts(case_ids: Iterable[int],
+                           out_dir: Union[str, Path] = EXPORT_DIR,
+                           db_path: str = CASE_DB_FILE,
+                           workers: Optional[int] = None,
+                           part_bytes: int = EXPORT_PART_BYTES) -> Tuple[List[Path], int]:
+    """
+    与 export_cases_zip 相同，但写成一个或多个分卷（每卷写满 part_bytes 后换下一卷，
+    单个病例不跨卷）。分卷名为 <随机令牌>-<序号>.zip，返回 (分卷路径, 病例数)。
+    """
+    workers = workers or max(1, min(4, os.cpu_count() or 1))
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    token = secrets.token_urlsafe(16)
+    parts: List[Path] = []
+    count = 0
+    f = zf = None
+    try:
+        for base, pdf_bytes, json_bytes in _iter_rendered(db_path, list(case_ids), workers):
+            if zf is None:
+                parts.append(out_dir / f"{token}-{len(parts) + 1}.zip")
+                f = open(parts[-1], "wb")
+                zf = zipfile.ZipFile(f, "w", compression=zipfile.ZIP_DEFLATED)
+            _write_member(zf, f"{base}/report.pdf", pdf_bytes)
+            _write_member(zf, f"{base}/case.json", json_bytes)
+            count += 1
+            if f.tell() >= part_bytes:
+                zf.close()
+                f.close()
+                f = zf = None
+    except BaseException:
+        for part in parts:
+            part.unlink(missing_ok=True)
+        raise
+    finally:
+        if zf is not None:
+            zf.close()
+        if f is not None:
+            f.close()
+    return parts, count
+
+
+def purge_exports(out_dir: Union[str, Path] = EXPORT_DIR, max_age: float = EXPORT_TTL) -> int:
+    """删除超过 max_age 秒的导出分卷，返回删除的文件数"""
+    removed = 0
+    cutoff = time.time() - max_age
+    for path in Path(out_dir).glob("*.zip"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+class _ChunkSink:
+    """只写、不可 seek 的缓冲区，供生成器逐段取走 ZIP 字节"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+def stream_cases_zip(case_ids: Iterable[int],
+                     db_path: str = CASE_DB_FILE,
+                     workers: Optional[int] = None) -> Iterator[bytes]:
+    """以生成器形式流式产出 ZIP 字节（适合 HTTP 分块响应）"""
+    workers = workers or max(1, min(4, os.cpu_count() or 1))
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for base, pdf_bytes, json_bytes in _iter_rendered(db_path, list(case_ids), workers):
+            _write_member(zf, f"{base}/report.pdf", pdf_bytes)
+            _write_member(zf, f"{base}/case.json", json_bytes)
+            yield sink.drain()
+    yield sink.drain()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量导出病例报告（ZIP）")
+    parser.add_argument("out", help="输出 ZIP 路径")
+    parser.add_argument("--ids", type=int, nargs="*", help="病例 id，缺省导出全部")
+    parser.add_argument("--db", default=CASE_DB_FILE)
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args()
+
+    if args.ids:
+        case_ids = args.ids
+    else:
+        case_ids = CaseStore(args.db).case_ids()
+    count = export_cases_zip(case_ids, args.out, db_path=args.db, workers=args.workers)
+    print(f"已导出 {count} 个病例到 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# utils/case_search.py
+import json
+import re
+from typing import Dict, List
+
+from utils.case_store import CaseStore
+
+# 中日韩统一表意文字、假名、韩文音节
+_CJK_RUN_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+")
+_WORD_RE = re.compile(r"[A-Za-z0-9]+")
+
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS case_fts USING fts5(
+    title, content, roles,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+CREATE TABLE IF NOT EXISTS case_fts_queue (
+    case_id INTEGER PRIMARY KEY
+);
+CREATE TRIGGER IF NOT EXISTS cases_fts_ins AFTER INSERT ON cases BEGIN
+    INSERT OR IGNORE INTO case_fts_queue (case_id) VALUES (new.id);
+END;
+CREATE TRIGGER IF NOT EXISTS cases_fts_upd AFTER UPDATE ON cases BEGIN
+    INSERT OR IGNORE INTO case_fts_queue (case_id) VALUES (new.id);
+END;
+CREATE TRIGGER IF NOT EXISTS cases_fts_del AFTER DELETE ON cases BEGIN
+    INSERT OR IGNORE INTO case_fts_queue (case_id) VALUES (old.id);
+END;
+"""
+
+# bm25 列权重：标题 > 角色 > 对话内容
+BM25_WEIGHTS = (5.0, 1.0, 2.0)
+# 切分方式变化时递增，已有库的索引整体重建
+FTS_VERSION = "2"
+
+
+def ngram_tokens(text: str, n: int = 2) -> List[str]:
+    """拉丁文按词切分；CJK 连续片段切成重叠 n-gram（不足 n 字时保留原片段）"""
+    tokens = [w.lower() for w in _WORD_RE.findall(text)]
+    for run in _CJK_RUN_RE.findall(text):
+        if len(run) <= n:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + n] for i in range(len(run) - n + 1))
+    return tokens
+
+
+def _to_fts_text(text: str) -> str:
+    """索引文本：二元组之外再收单字，单字查询（如 "痛"）也能命中"""
+    unigrams = [ch for run in _CJK_RUN_RE.findall(text) if len(run) > 1 for ch in run]
+    return " ".join(ngram_tokens(text) + unigrams)
+
+
+class CaseSearchIndex:
+    """
+    病例全文检索：FTS5 存放预切分的 n-gram 文本。
+    cases 表上的触发器把变更的病例 id 写入队列，refresh() 只处理队列中的病例。
+    """
+
+    def __init__(self, store: CaseStore):
+        self.store = store
+        with store.conn as conn:
+            conn.executescript(SCHEMA)
+            built = conn.execute("SELECT value FROM meta WHERE key = 'fts:built'").fetchone()
+            if built is None or built["value"] != FTS_VERSION:
+                # 首次建索引或切分方式变化：已存在的病例全部入队重建
+                conn.execute("INSERT OR IGNORE INTO case_fts_queue (case_id) SELECT id FROM cases")
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('fts:built', ?)", (FTS_VERSION,))
+        self.refresh()
+
+    def refresh(self, batch_size: int = 500) -> int:
+        """增量更新索引，返回处理的病例数"""
+        conn = self.store.conn
+        total = 0
+        while True:
+            ids = [r["case_id"] for r in conn.execute(
+                "SELECT case_id FROM case_fts_queue LIMIT ?", (batch_size,))]
+            if not ids:
+                return total
+            placeholders = ",".join("?" * len(ids))
+            rows = conn.execute(
+                f"SELECT id, title, payload FROM cases WHERE id IN ({placeholders})", ids
+            ).fetchall()
+            with conn:
+                conn.execute(f"DELETE FROM case_fts WHERE rowid IN ({placeholders})", ids)
+                conn.executemany(
+                    "INSERT INTO case_fts (rowid, title, content, roles) VALUES (?, ?, ?, ?)",
+                    [_fts_row(r["id"], r["title"], json.loads(r["payload"])) for r in rows],
+                )
+                conn.execute(f"DELETE FROM case_fts_queue WHERE case_id IN ({placeholders})", ids)
+            total += len(ids)
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> List[Dict]:
+        match = _match_expression(query)
+        if not match:
+            return []
+        rows = self.store.conn.execute(
+            f"""
+            SELECT cases.id, cases.title, bm25(case_fts, {', '.join(map(str, BM25_WEIGHTS))}) AS rank
+            FROM case_fts JOIN cases ON cases.id = case_fts.rowid
+            WHERE case_fts MATCH ?
+            ORDER BY rank LIMIT ? OFFSET ?
+            """,
+            (match, limit, offset),
+        ).fetchall()
+        return [{"id": r["id"], "title": r["title"], "score": -r["rank"]} for r in rows]
+
+    def search_ids(self, query: str) -> List[int]:
+        """全部匹配病例的 id（按相关度排序，不分页；批量导出用）"""
+        match = _match_expression(query)
+        if not match:
+            return []
+        return [r[0] for r in self.store.conn.execute(
+            f"SELECT rowid FROM case_fts WHERE case_fts MATCH ? "
+            f"ORDER BY bm25(case_fts, {', '.join(map(str, BM25_WEIGHTS))})", (match,))]
+
+
+def _match_expression(query: str) -> str:
+    # 每个 token 加引号作为短语，AND 连接
+    return " AND ".join('"{}"'.format(t.replace('"', '""')) for t in dict.fromkeys(ngram_tokens(query)))
+
+
+def _fts_row(case_id: int, title: str, payload: Dict):
+    dialogue = payload.get("dialogue", [])
+    content = " ".join(turn.get("content", "") for turn in dialogue)
+    roles = " ".join(sorted({turn.get("role", "").replace("_", " ") for turn in dialogue}))
+    return case_id, _to_fts_text(title), _to_fts_text(content), _to_fts_text(roles)
@@ -0,0 +1,171 @@
+# utils/case_store.py
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+CASE_DB_FILE = "cases.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    id           INTEGER PRIMARY KEY,
+    title        TEXT NOT NULL UNIQUE,
+    age          INTEGER,
+    sex          TEXT,
+    bmi          REAL,
+    report_names TEXT NOT NULL DEFAULT '',
+    payload      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_cases_demo ON cases(sex, age);
+CREATE INDEX IF NOT EXISTS idx_cases_bmi ON cases(bmi);
+-- title 的 UNIQUE 约束已带索引；标题 / 报告名是包含匹配（LIKE '%…%'），普通索引用不上
+DROP INDEX IF EXISTS idx_cases_title;
+DROP INDEX IF EXISTS idx_cases_reports;
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class CaseStore:
+    """
+    病例库：SQLite（WAL 模式）。列表页只读索引列，
+    对话与报告（payload）在打开具体病例时才读取。
+    """
+
+    def __init__(self, db_path: str = CASE_DB_FILE):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self.conn as conn:
+            conn.executescript(SCHEMA)
+
+    # -------------------------------------------------------------------------
+    # 连接管理：每个线程（Streamlit 会话）一条连接
+    # -------------------------------------------------------------------------
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # -------------------------------------------------------------------------
+    # 导入 / 写入
+    # -------------------------------------------------------------------------
+    def upsert_case(self, title: str, case: Dict) -> int:
+        # sqlite3.Connection 作为上下文管理器：成功提交，异常回滚
+        with self.conn as conn:
+            return _upsert(conn, title, case)
+
+    def sync_from_json(self, json_path: str) -> bool:
+        """
+        cases.json 有变化（mtime/大小）时才重新导入，返回是否导入。
+        同一事务内删除 JSON 中已不存在的病例，库与文件保持一致。
+        """
+        p = Path(json_path)
+        if not p.exists():
+            return False
+        stat = p.stat()
+        signature = f"{stat.st_mtime_ns}:{stat.st_size}"
+        key = f"source:{p.resolve()}"
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        if row and row["value"] == signature:
+            return False
+
+        with open(p, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        with self.conn as conn:
+            for title, case in data.items():
+                _upsert(conn, title, case)
+            removed = [(r["title"],) for r in conn.execute("SELECT title FROM cases") if r["title"] not in data]
+            conn.executemany("DELETE FROM cases WHERE title = ?", removed)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, signature))
+        return True
+
+    # -------------------------------------------------------------------------
+    # 查询
+    # -------------------------------------------------------------------------
+    def list_cases(self,
+                   offset: int = 0,
+                   limit: int = 20,
+                   title_contains: Optional[str] = None,
+                   sex: Optional[str] = None,
+                   age_range: Optional[Tuple[int, int]] = None,
+                   report_name: Optional[str] = None) -> Tuple[List[Dict], bool]:
+        """分页列出病例摘要（不含对话），返回 (本页行, 是否还有下一页)"""
+        clauses, args = [], []
+        if title_contains:
+            clauses.append("title LIKE ?")
+            args.append(f"%{title_contains}%")
+        if sex:
+            clauses.append("sex = ?")
+            args.append(sex)
+        if age_range:
+            clauses.append("age BETWEEN ? AND ?")
+            args.extend(age_range)
+        if report_name:
+            clauses.append("report_names LIKE ?")
+            args.append(f"%{report_name}%")
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        # 多取一行判断是否有下一页，避免 COUNT(*) 全表扫描
+        rows = self.conn.execute(
+            f"SELECT id, title, age, sex, bmi, report_names FROM cases {where} "
+            f"ORDER BY id LIMIT ? OFFSET ?",
+            (*args, limit + 1, offset),
+        ).fetchall()
+        summaries = [_summary(r) for r in rows[:limit]]
+        return summaries, len(rows) > limit
+
+    def case_ids(self) -> List[int]:
+        """全部病例 id（只读主键，供批量导出）"""
+        return [r["id"] for r in self.conn.execute("SELECT id FROM cases ORDER BY id")]
+
+    def get_case(self, case_id: int) -> Optional[Dict]:
+        row = self.conn.execute(
+            "SELECT id, title, age, sex, bmi, report_names, payload FROM cases WHERE id = ?",
+            (case_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return {**_summary(row), **json.loads(row["payload"])}
+
+    def is_empty(self) -> bool:
+        return self.conn.execute("SELECT 1 FROM cases LIMIT 1").fetchone() is None
+
+
+def _upsert(conn: sqlite3.Connection, title: str, case: Dict) -> int:
+    demo = case.get("demographics", {})
+    payload = json.dumps(
+        {"reports": case.get("reports", []), "dialogue": case.get("dialogue", [])},
+        ensure_ascii=False,
+    )
+    conn.execute(
+        """
+        INSERT INTO cases (title, age, sex, bmi, report_names, payload)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(title) DO UPDATE SET
+            age = excluded.age, sex = excluded.sex, bmi = excluded.bmi,
+            report_names = excluded.report_names, payload = excluded.payload
+        """,
+        (title, demo.get("age"), demo.get("sex"), demo.get("bmi"),
+         "\n".join(case.get("reports", [])), payload),
+    )
+    return conn.execute("SELECT id FROM cases WHERE title = ?", (title,)).fetchone()["id"]
+
+
+def _summary(row: sqlite3.Row) -> Dict:
+    return {
+        "id": row["id"],
+        "title": row["title"],
+        "age": row["age"],
+        "sex": row["sex"],
+        "bmi": row["bmi"],
+        "report_names": row["report_names"].split("\n") if row["report_names"] else [],
+    }
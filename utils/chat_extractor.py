@@ -0,0 +1,211 @@
+# utils/chat_extractor.py
+import json
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+from utils.koos import SUBSCALE_ITEMS as KOOS_SUBSCALE_ITEMS, score_items
+
+# 助手提问关键词 -> KOOS 条目
+QUESTION_RULES: List[Tuple[str, List[str]]] = [
+    (r"walking on flat", ["P5"]),
+    (r"stairs", ["P6"]),
+    (r"night|in bed", ["P7"]),
+    (r"sitting or lying", ["P8"]),
+    (r"standing upright", ["P9"]),
+    (r"twisting|pivoting on your knee", ["P3"]),
+    (r"stiffness", ["S6"]),
+    (r"grinding|clicking|catching", ["S2", "S3"]),
+    (r"swelling", ["S1"]),
+    (r"kneel, squat, jump, or pivot", ["SP1", "SP3", "SP4", "SP5"]),
+    (r"aware of your knee problem", ["Q1"]),
+    (r"confidence", ["Q3"]),
+    (r"impact your daily life|difficulty in general", ["Q4"]),
+]
+
+# 追问整组（例如 "Any other pain symptoms"），仅在回答为 "无" 时补齐该侧剩余条目
+GROUP_RULES: List[Tuple[str, str]] = [
+    (r"any other pain", "pain"),
+    (r"any of these symptoms|other symptoms", "symptoms"),
+]
+
+# 回答用语 -> Likert 0~4（0 = 无困难/无症状）
+ANSWER_SCALE: List[Tuple[str, int]] = [
+    (r"\bextreme(ly)?\b|\bconstantly\b|\bunable\b", 4),
+    (r"\bsevere(ly)?\b|quite a lot|\ba lot\b|\bdaily\b|most of the time", 3),
+    (r"\bmoderate(ly)?\b|\bsometimes\b|\bweekly\b|\bsomewhat\b", 2),
+    (r"\bmild(ly)?\b|\ba little\b|\brarely\b|\bmonthly\b|\bslight(ly)?\b", 1),
+    (r"\bnone\b|\bnever\b|\bno\b|\bnot at all\b|completely fine", 0),
+]
+
+_AGE_RE = re.compile(r"(\d{1,3})\s*(?:years?\s*old|y/?o\b|岁)", re.I)
+_SEX_RE = re.compile(r"\b(male|female|man|woman)\b|(男|女)", re.I)
+_WEIGHT_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(kg|kilograms?|lbs?|pounds?|公斤)", re.I)
+_HEIGHT_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(cm|centimet(?:er|re)s?|m\b|厘米)", re.I)
+_STATED_KOOS_RE = re.compile(
+    r"(Right Knee Pain|Right Knee Symptoms|Left Knee Pain(?: & Symptoms)?|Sport/Recreation Function|Quality of Life)"
+    r":\s*(\d+(?:\.\d+)?)\s*/\s*100", re.I)
+
+STATED_KOOS_KEYS = {
+    "right knee pain": ["KOOSPain_R"],
+    "right knee symptoms": ["KOOSSym_R"],
+    "left knee pain": ["KOOSPain_L"],
+    "left knee pain & symptoms": ["KOOSPain_L", "KOOSSym_L"],
+    "sport/recreation function": ["KOOSSport"],
+    "quality of life": ["KOOSQOL"],
+}
+
+SUBSCALE_KEYS = {
+    ("pain", "R"): "KOOSPain_R",
+    ("symptoms", "R"): "KOOSSym_R",
+    ("pain", "L"): "KOOSPain_L",
+    ("symptoms", "L"): "KOOSSym_L",
+    ("sport", None): "KOOSSport",
+    ("qol", None): "KOOSQOL",
+}
+
+
+def score_answer(text: str) -> Optional[int]:
+    lowered = text.lower()
+    for pattern, value in ANSWER_SCALE:
+        if re.search(pattern, lowered):
+            return value
+    return None
+
+
+def subscale_of(item: str) -> str:
+    for name, items in KOOS_SUBSCALE_ITEMS.items():
+        if item in items:
+            return name
+    raise KeyError(item)
+
+
+# =============================================================================
+# 增量抽取器：每轮只处理新消息
+# =============================================================================
+class ChatFeatureExtractor:
+    def __init__(self):
+        self.processed = 0
+        self.record: Dict = {}
+        self.extra: Dict = {}
+        self.koos_items: Dict[str, Dict[str, int]] = {"R": {}, "L": {}, "-": {}}
+        self.stated: Dict[str, float] = {}
+        self.pending: List[Dict] = []
+        self._side = "R"
+        self._question = ""
+
+    def update(self, history: List[Dict]) -> List[str]:
+        """处理 history 中尚未处理的消息，返回本次发生变化的字段"""
+        before = dict(self.record)
+        for msg in history[self.processed:]:
+            self._process_message(msg["role"], msg["content"])
+        self.processed = max(self.processed, len(history))
+        self._recompute()
+        return [k for k, v in self.record.items() if before.get(k) != v]
+
+    def _process_message(self, role: str, content: str):
+        if role == "assistant":
+            self._on_assistant(content)
+        else:
+            self._on_user(content)
+
+    def _on_assistant(self, content: str):
+        lowered = content.lower()
+        if "right knee" in lowered:
+            self._side = "R"
+        elif "left knee" in lowered:
+            self._side = "L"
+        for label, value in _STATED_KOOS_RE.findall(content):
+            for key in STATED_KOOS_KEYS.get(label.lower(), []):
+                self.stated[key] = float(value)
+        self._question = content
+
+    def _on_user(self, content: str):
+        self._extract_demographics(content)
+        if not self._question:
+            return
+        question = self._question.lower()
+        self._question = ""
+
+        for pattern, items in QUESTION_RULES:
+            if re.search(pattern, question):
+                side = self._side if subscale_of(items[0]) in ("pain", "symptoms") else "-"
+                value = score_answer(content)
+                if value is None:
+                    self._mark_pending(items, side, question, content)
+                else:
+                    for item in items:
+                        self.koos_items[side][item] = value
+                return
+
+        for pattern, subscale in GROUP_RULES:
+            if re.search(pattern, question):
+                value = score_answer(content)
+                remaining = [i for i in KOOS_SUBSCALE_ITEMS[subscale] if i not in self.koos_items[self._side]]
+                if value == 0:
+                    for item in remaining:
+                        self.koos_items[self._side][item] = 0
+                elif remaining:
+                    self._mark_pending(remaining, self._side, question, content)
+                return
+
+    def _extract_demographics(self, content: str):
+        if (m := _AGE_RE.search(content)):
+            self.record["AGE"] = int(m.group(1))
+        if (m := _SEX_RE.search(content)):
+            word = (m.group(1) or m.group(2)).lower()
+            self.extra["SEX"] = "Male" if word in ("male", "man", "男") else "Female"
+        if (m := _WEIGHT_RE.search(content)):
+            weight = float(m.group(1))
+            if m.group(2).lower().startswith(("lb", "pound")):
+                weight *= 0.4536
+            self.record["WEIGHT"] = round(weight, 1)
+        if (m := _HEIGHT_RE.search(content)):
+            height = float(m.group(1))
+            self.extra["HEIGHT"] = height * 100 if m.group(2).lower() == "m" else height
+
+    def _mark_pending(self, items: List[str], side: str, question: str, answer: str):
+        self.pending = [p for p in self.pending if (p["items"], p["side"]) != (items, side)]
+        self.pending.append({"items": items, "side": side, "question": question, "answer": answer})
+
+    def _recompute(self):
+        weight, height = self.record.get("WEIGHT"), self.extra.get("HEIGHT")
+        if weight and height:
+            self.record["BMI"] = round(weight / (height / 100) ** 2, 1)
+
+        for key, value in self.stated.items():
+            self.record[key] = value
+        for (subscale, side), key in SUBSCALE_KEYS.items():
+            score = score_items(self.koos_items[side or "-"], subscale)
+            if score is not None:
+                self.record[key] = score
+
+    # -------------------------------------------------------------------------
+    # 仅对规则无法判定的字段回退到 LLM（一次批量调用）
+    # -------------------------------------------------------------------------
+    def resolve_pending(self, llm: Callable[[str], str]) -> int:
+        """每个待定字段最多询问一次 LLM，返回成功解析的数量"""
+        batch = [p for p in self.pending if not p.get("asked")]
+        if not batch:
+            return 0
+        for p in batch:
+            p["asked"] = True
+        lines = [f'{i}. Q: "{p["question"]}" A: "{p["answer"]}"' for i, p in enumerate(batch)]
+        prompt = (
+            "Map each patient answer to a KOOS Likert score from 0 (none) to 4 (extreme). "
+            "Reply with a JSON list of integers only, in order.\n" + "\n".join(lines)
+        )
+        reply = llm(prompt)
+        match = re.search(r"\[[\d,\s]*\]", reply)
+        if not match:
+            return 0
+        values = json.loads(match.group(0))
+        resolved = 0
+        for p, value in zip(batch, values):
+            if not isinstance(value, int) or not 0 <= value <= 4:
+                continue
+            for item in p["items"]:
+                self.koos_items[p["side"]].setdefault(item, value)
+            self.pending.remove(p)
+            resolved += 1
+        self._recompute()
+        return resolved
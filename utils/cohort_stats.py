@@ -0,0 +1,294 @@
+# utils/cohort_stats.py
+import argparse
+import json
+import time
+from itertools import groupby
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from utils.guideline_index import GuidelineIndex, load_or_build_index, patient_query_from_features
+from utils.visit_store import OBSERVED, TRACKED_METRICS, VISIT_DB_FILE, VisitStore
+
+# 分组维度：年龄段、BMI 段、左右膝 KL 分级、匹配的指南场景
+AGE_BANDS: Tuple[Tuple[Optional[float], str], ...] = ((50, "<50"), (60, "50–59"), (70, "60–69"), (80, "70–79"), (None, "80+"))
+BMI_BANDS: Tuple[Tuple[Optional[float], str], ...] = ((18.5, "<18.5"), (25, "18.5–24.9"), (30, "25–29.9"), (35, "30–34.9"), (None, "≥35"))
+KL_GRADES = (0, 1, 2, 3, 4)
+UNKNOWN = "unknown"
+NO_SCENARIO = "none"
+# 汇总格中的度量：PATIENTS 行记人数，FOLLOWUP 行记有随访的人数，其余为各 KOOS 指标的 (人数, 变化量之和)
+PATIENTS = ""
+FOLLOWUP = "followup"
+SYNC_BATCH = 2000
+
+# 与随访表同库：cohort_facts 为每名患者当前的分组与 KOOS 变化，cohort_cells 为按全部维度分组的累计量。
+# 患者记录变化时先减去其旧贡献、再加上新贡献，汇总格永远与 cohort_facts 一致，仪表盘只查询汇总格。
+# 触发器在写入观测随访的同一事务里把患者放进 cohort_queue；SQLite 写事务串行，
+# 队列 id 顺序即提交顺序，sync() 处理到哪个 id 就删到哪个 id，不漏也不重复。
+# 旧事实的读取与差量写入在同一个 BEGIN IMMEDIATE 事务里：并发的 sync()（多个会话 / 命令行）
+# 在事务开始处排队，后来者读到的已是前者提交后的事实，同一差量不会被加两次。
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cohort_facts (
+    patient_id TEXT PRIMARY KEY,
+    age_band   TEXT NOT NULL,
+    bmi_band   TEXT NOT NULL,
+    kl_r       INTEGER NOT NULL,
+    kl_l       INTEGER NOT NULL,
+    scenario   TEXT NOT NULL,
+    followup   INTEGER NOT NULL,
+    changes    TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cohort_cells (
+    age_band TEXT NOT NULL,
+    bmi_band TEXT NOT NULL,
+    kl_r     INTEGER NOT NULL,
+    kl_l     INTEGER NOT NULL,
+    scenario TEXT NOT NULL,
+    metric   TEXT NOT NULL,
+    n        INTEGER NOT NULL,
+    total    REAL NOT NULL,
+    PRIMARY KEY (age_band, bmi_band, kl_r, kl_l, scenario, metric)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cohort_queue (
+    id         INTEGER PRIMARY KEY,
+    patient_id TEXT NOT NULL
+);
+"""
+TRIGGER = """
+CREATE TRIGGER cohort_enqueue AFTER INSERT ON visits WHEN NEW.kind = 'observed'
+BEGIN
+    INSERT INTO cohort_queue (patient_id) VALUES (NEW.patient_id);
+END;
+"""
+DIMENSIONS = ("age_band", "bmi_band", "kl_r", "kl_l", "scenario")
+
+
+def _number(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _band(value: Optional[float], bands) -> str:
+    if value is None:
+        return UNKNOWN
+    for upper, label in bands:
+        if upper is None or value < upper:
+            return label
+    return UNKNOWN
+
+
+def _grade(value) -> int:
+    grade = _number(value)
+    return int(grade) if grade is not None and int(grade) in KL_GRADES else -1
+
+
+def patient_fact(observed: Sequence[Dict], scenario_of: Callable[[Dict], str]) -> Dict:
+    """
+    由一名患者按日期排序的观测随访求分组与变化：基线取 V00（没有则取最早一次），
+    变化 = 基线之后最近一次随访 - 基线。
+    """
+    baseline = next((r for r in observed if r["visit"] == "V00"), observed[0])
+    later = [r for r in observed if r["visit_date"] > baseline["visit_date"]]
+    features = baseline["features"]
+    changes = {}
+    if later:
+        latest = later[-1]["features"]
+        for key, _ in TRACKED_METRICS:
+            before, after = _number(features.get(key)), _number(latest.get(key))
+            if before is not None and after is not None:
+                changes[key] = after - before
+    return {
+        "age_band": _band(_number(features.get("AGE")), AGE_BANDS),
+        "bmi_band": _band(_number(features.get("BMI")), BMI_BANDS),
+        "kl_r": _grade(features.get("XRKL_R")),
+        "kl_l": _grade(features.get("XRKL_L")),
+        # 治疗推荐已记录匹配场景时以其为准，否则按基线特征检索指南
+        "scenario": str(features.get("guideline_scenario") or scenario_of(features) or NO_SCENARIO),
+        "followup": int(bool(later)),
+        "changes": changes,
+    }
+
+
+def _contributions(fact: Dict) -> List[Tuple[str, int, float]]:
+    rows = [(PATIENTS, 1, 0.0), (FOLLOWUP, fact["followup"], 0.0)]
+    rows.extend((key, 1, change) for key, change in fact["changes"].items())
+    return rows
+
+
+class CohortStats:
+    """
+    队列汇总：增量维护的分组累计量。sync() 只处理上次同步之后有新随访的患者，
+    query() 在汇总格（最多几千行）上按筛选条件聚合，与患者总数无关。
+    """
+
+    def __init__(self, store: VisitStore, index: Optional[GuidelineIndex] = None):
+        self.store = store
+        self.index = index if index is not None else load_or_build_index()
+        self._scenario_memo: Dict[str, str] = {}
+        with self.conn as conn:
+            conn.executescript(SCHEMA)
+        with self.conn as conn:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'cohort_enqueue'").fetchone()
+            if not exists:
+                # 首次启用：已有的随访全部入队，之后由触发器增量入队
+                conn.execute(TRIGGER)
+                _enqueue_all(conn)
+
+    @property
+    def conn(self):
+        return self.store.conn
+
+    def scenario_of(self, features: Dict) -> str:
+        # 检索语句只由几个分档拼成，取值很少，按语句备忘
+        query = patient_query_from_features(features)
+        if query not in self._scenario_memo:
+            top = self.index.search(query, top_k=1) if query else []
+            self._scenario_memo[query] = top[0]["id"] if top else NO_SCENARIO
+        return self._scenario_memo[query]
+
+    # -------------------------------------------------------------------------
+    # 增量维护
+    # -------------------------------------------------------------------------
+    def pending(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM cohort_queue").fetchone()[0]
+
+    def sync(self, batch: int = SYNC_BATCH) -> int:
+        """把队列中（上次同步后有新观测随访）的患者并入汇总，返回处理的患者数"""
+        high = self.conn.execute("SELECT MAX(id) FROM cohort_queue").fetchone()[0]
+        if high is None:
+            return 0
+        changed = [r["patient_id"] for r in self.conn.execute(
+            "SELECT DISTINCT patient_id FROM cohort_queue WHERE id <= ?", (high,))]
+        for start in range(0, len(changed), batch):
+            self._update(changed[start:start + batch])
+        # 中途失败时队列保留，下次重算同一批患者：已提交的批次读到的旧事实即新事实，不再产生差量
+        with self.conn as conn:
+            conn.execute("DELETE FROM cohort_queue WHERE id <= ?", (high,))
+        return len(changed)
+
+    def rebuild(self) -> int:
+        with self.conn as conn:
+            conn.execute("DELETE FROM cohort_facts")
+            conn.execute("DELETE FROM cohort_cells")
+            conn.execute("DELETE FROM cohort_queue")
+            _enqueue_all(conn)
+        return self.sync()
+
+    def _update(self, patient_ids: Sequence[str]):
+        marks = ",".join("?" * len(patient_ids))
+        with self.conn as conn:
+            # 先取写锁再读：读到的旧事实与随后写入的差量属于同一事务
+            conn.execute("BEGIN IMMEDIATE")
+            # 一次主键范围读取这批患者的全部观测随访
+            rows = conn.execute(
+                f"SELECT patient_id, visit, visit_date, features FROM visits "
+                f"WHERE patient_id IN ({marks}) AND kind = ? ORDER BY patient_id, visit_date",
+                (*patient_ids, OBSERVED),
+            ).fetchall()
+            old = {r["patient_id"]: _fact_from_row(r) for r in conn.execute(
+                f"SELECT * FROM cohort_facts WHERE patient_id IN ({marks})", patient_ids)}
+
+            for patient_id, group in groupby(rows, key=lambda r: r["patient_id"]):
+                observed = [{"visit": r["visit"], "visit_date": r["visit_date"],
+                             "features": json.loads(r["features"])} for r in group]
+                fact = patient_fact(observed, self.scenario_of)
+                previous = old.get(patient_id)
+                if previous == fact:
+                    continue
+                if previous is not None:
+                    _apply(conn, previous, -1)
+                _apply(conn, fact, 1)
+                conn.execute(
+                    "INSERT OR REPLACE INTO cohort_facts "
+                    "(patient_id, age_band, bmi_band, kl_r, kl_l, scenario, followup, changes) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (patient_id, *(fact[d] for d in DIMENSIONS), fact["followup"], json.dumps(fact["changes"])),
+                )
+            conn.execute("DELETE FROM cohort_cells WHERE n = 0")
+
+    # -------------------------------------------------------------------------
+    # 查询
+    # -------------------------------------------------------------------------
+    def query(self, age_bands: Sequence[str] = (), bmi_bands: Sequence[str] = (),
+              kl_grades: Sequence[int] = (), scenarios: Sequence[str] = ()) -> Dict:
+        """
+        筛选后的三组汇总：各侧 KL 分级人数、各 BMI 段的平均 KOOS 变化、各指南场景的匹配人数。
+        KL 筛选为任一侧膝符合即可。
+        """
+        clauses, args = [], []
+        for column, values in (("age_band", age_bands), ("bmi_band", bmi_bands), ("scenario", scenarios)):
+            if values:
+                clauses.append(f"{column} IN ({','.join('?' * len(values))})")
+                args.extend(values)
+        if kl_grades:
+            marks = ",".join("?" * len(kl_grades))
+            clauses.append(f"(kl_r IN ({marks}) OR kl_l IN ({marks}))")
+            args.extend([*kl_grades, *kl_grades])
+        where = " AND ".join(clauses) or "1"
+
+        def grouped(select: str, group: str, metric_clause: str, metric_args=()) -> List:
+            return self.conn.execute(
+                f"SELECT {select} FROM cohort_cells WHERE {where} AND {metric_clause} GROUP BY {group}",
+                (*args, *metric_args),
+            ).fetchall()
+
+        totals = {r["metric"]: r["n"] for r in grouped(
+            "metric, SUM(n) AS n", "metric", "metric IN (?, ?)", (PATIENTS, FOLLOWUP))}
+        kl = [{"knee": knee, "grade": r["grade"], "patients": r["n"]}
+              for knee, column in (("Right", "kl_r"), ("Left", "kl_l"))
+              for r in grouped(f"{column} AS grade, SUM(n) AS n", column, "metric = ?", (PATIENTS,))]
+        labels = dict(TRACKED_METRICS)
+        koos_change = [
+            {"bmi_band": r["bmi_band"], "metric": labels.get(r["metric"], r["metric"]),
+             "mean_change": r["total"] / r["n"], "patients": r["n"]}
+            for r in grouped("bmi_band, metric, SUM(total) AS total, SUM(n) AS n", "bmi_band, metric",
+                             "metric NOT IN (?, ?)", (PATIENTS, FOLLOWUP))
+            if r["n"]
+        ]
+        scenarios_rows = [{"scenario": r["scenario"], "patients": r["n"]}
+                          for r in grouped("scenario, SUM(n) AS n", "scenario", "metric = ?", (PATIENTS,))]
+        return {"patients": totals.get(PATIENTS, 0), "followup": totals.get(FOLLOWUP, 0),
+                "kl": kl, "koos_change": koos_change, "scenarios": scenarios_rows}
+
+
+def _enqueue_all(conn):
+    conn.execute("INSERT INTO cohort_queue (patient_id) SELECT DISTINCT patient_id FROM visits WHERE kind = ?",
+                 (OBSERVED,))
+
+
+def _fact_from_row(row) -> Dict:
+    return {**{d: row[d] for d in DIMENSIONS}, "followup": row["followup"], "changes": json.loads(row["changes"])}
+
+
+def _apply(conn, fact: Dict, sign: int):
+    key = tuple(fact[d] for d in DIMENSIONS)
+    conn.executemany(
+        "INSERT INTO cohort_cells (age_band, bmi_band, kl_r, kl_l, scenario, metric, n, total) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (age_band, bmi_band, kl_r, kl_l, scenario, metric) "
+        "DO UPDATE SET n = n + excluded.n, total = total + excluded.total",
+        [(*key, metric, sign * n, sign * total) for metric, n, total in _contributions(fact)],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="队列汇总：增量同步 / 重建 / 查看")
+    parser.add_argument("--db", default=VISIT_DB_FILE)
+    parser.add_argument("cmd", choices=("sync", "rebuild", "show"))
+    args = parser.parse_args()
+
+    stats = CohortStats(VisitStore(args.db))
+    started = time.perf_counter()
+    if args.cmd == "sync":
+        print(f"同步 {stats.sync()} 名患者，{time.perf_counter() - started:.2f} 秒")
+    elif args.cmd == "rebuild":
+        print(f"重建 {stats.rebuild()} 名患者，{time.perf_counter() - started:.2f} 秒")
+    else:
+        result = stats.query()
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        print(f"({(time.perf_counter() - started) * 1000:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
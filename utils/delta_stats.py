@@ -0,0 +1,121 @@
+# utils/delta_stats.py
+import os
+import sys
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# 开发者开关：环境变量，或 URL 带 ?delta_stats=1（本会话内保持开启）
+DELTA_STATS_ENV = "DELTA_STATS"
+DELTA_STATS_PARAM = "delta_stats"
+HISTORY_SIZE = 20
+
+
+class RerunStats:
+    def __init__(self, index: int):
+        self.index = index
+        self.total_bytes = 0
+        self.messages = 0
+        # (渲染函数, 元素类型) -> [消息数, 字节数]
+        self.by_source: Dict[Tuple[str, str], List[int]] = {}
+
+    def add(self, source: str, element: str, size: int):
+        self.total_bytes += size
+        self.messages += 1
+        entry = self.by_source.setdefault((source, element), [0, 0])
+        entry[0] += 1
+        entry[1] += size
+
+    def top(self, n: int = 10) -> List[Dict]:
+        rows = sorted(self.by_source.items(), key=lambda kv: kv[1][1], reverse=True)[:n]
+        return [
+            {"function": source, "element": element, "messages": count, "bytes": size}
+            for (source, element), (count, size) in rows
+        ]
+
+
+class DeltaRecorder:
+    """
+    统计进入发送队列的 ForwardMsg 字节数：在入队时取完整消息的 ByteSize()，
+    早于会话的 ForwardMsg 缓存把已发送过的大消息替换成引用消息，
+    因此命中前端缓存的元素也按完整大小计，反映的是各函数产生的数据量而非实际线上字节数。
+    按主脚本中最内层的调用函数归因，new_session 消息标志一次 rerun 的开始。
+    """
+
+    def __init__(self, main_script_path: str):
+        self.main_script = os.path.realpath(main_script_path)
+        self.history: deque = deque(maxlen=HISTORY_SIZE)
+        self.current: Optional[RerunStats] = None
+        self._reruns = 0
+
+    def wrap(self, enqueue: Callable) -> Callable:
+        def recording_enqueue(msg):
+            self.record(msg)
+            enqueue(msg)
+        return recording_enqueue
+
+    def start_rerun(self):
+        if self.current is not None:
+            self.history.append(self.current)
+        self._reruns += 1
+        self.current = RerunStats(self._reruns)
+
+    def record(self, msg):
+        kind = msg.WhichOneof("type")
+        if kind == "new_session" or self.current is None:
+            self.start_rerun()
+        self.current.add(self._source(), _element_type(msg, kind), msg.ByteSize())
+
+    def _source(self) -> str:
+        frame = sys._getframe(2)
+        while frame is not None:
+            code = frame.f_code
+            if code.co_name != "<module>" and os.path.realpath(code.co_filename) == self.main_script:
+                return code.co_name
+            frame = frame.f_back
+        return "<streamlit>"
+
+    def last_completed(self) -> Optional[RerunStats]:
+        return self.history[-1] if self.history else None
+
+
+def _element_type(msg, kind: str) -> str:
+    if kind != "delta":
+        return kind or "ref"
+    delta_kind = msg.delta.WhichOneof("type")
+    if delta_kind == "new_element":
+        return msg.delta.new_element.WhichOneof("type") or "element"
+    return delta_kind or "delta"
+
+
+def delta_stats_enabled() -> bool:
+    if os.getenv(DELTA_STATS_ENV, "").lower() in ("1", "true", "yes"):
+        return True
+    if st.query_params.get(DELTA_STATS_PARAM) == "1":
+        st.session_state[DELTA_STATS_PARAM] = True
+    return st.session_state.get(DELTA_STATS_PARAM, False)
+
+
+def install_delta_recorder() -> Optional[DeltaRecorder]:
+    """
+    统计器存放在 session_state 中跨 rerun 保留；ScriptRunContext 通常每次 rerun 重建，
+    因此每次在新的 context 上重新挂接（同一 context 只挂一次）。
+    挂接方式是替换 ScriptRunContext 的私有属性 _enqueue，依赖 Streamlit 内部实现（在 1.66 上验证），
+    升级 Streamlit 后需重新确认；只有 delta_stats_enabled() 时才挂接，关闭时不做任何包装。
+    """
+    if not delta_stats_enabled():
+        return None
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return None
+    recorder = st.session_state.get("_delta_recorder")
+    if recorder is None:
+        recorder = st.session_state["_delta_recorder"] = DeltaRecorder(ctx.main_script_path)
+    if not getattr(ctx, "_delta_recorded", False):
+        # 本次 rerun 中挂接之前已发送的 new_session 等消息不计入
+        recorder.start_rerun()
+        ctx._enqueue = recorder.wrap(ctx._enqueue)
+        ctx._delta_recorded = True
+    return recorder
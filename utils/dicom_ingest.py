@@ -0,0 +1,205 @@
+# utils/dicom_ingest.py
+import argparse
+import json
+import math
+from collections.abc import MutableSequence
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+try:
+    import pydicom
+    from pydicom.pixels import pixel_array as decode_frame
+except ImportError:  # 未安装 pydicom 时 PNG/JPEG 流程照常可用，只是不能读 DICOM
+    pydicom = None
+
+DICOM_SUFFIXES = (".dcm", ".dicom")
+PIXEL_DATA = 0x7FE00010
+# 读取数据集时大于该字节数的元素只记位置不读值（即像素数据），用到时再取
+DEFER_SIZE = 1024
+PREVIEW_SIZE = 1024
+
+# 头信息中展示 / 选片时用到的字段；不读取姓名等身份信息
+HEADER_FIELDS = (
+    "Modality", "BodyPartExamined", "ViewPosition", "ImageLaterality", "Laterality",
+    "SeriesDescription", "StudyDate", "Rows", "Columns", "NumberOfFrames", "SamplesPerPixel",
+    "BitsAllocated", "BitsStored", "PixelRepresentation", "PhotometricInterpretation",
+    "WindowCenter", "WindowWidth", "RescaleSlope", "RescaleIntercept", "PixelSpacing",
+)
+
+
+def require_pydicom():
+    if pydicom is None:
+        raise RuntimeError("读取 DICOM 需要安装 pydicom（pip install pydicom）")
+
+
+def is_dicom(path: str) -> bool:
+    return str(path).lower().endswith(DICOM_SUFFIXES)
+
+
+def _plain(value):
+    """把 pydicom 的多值 / DS / IS / UID 等类型转成可 JSON 序列化的普通值"""
+    if isinstance(value, MutableSequence):
+        return [_plain(v) for v in value]
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, float):
+        return float(value)
+    return str(value)
+
+
+def _header(ds) -> Dict:
+    header = {name: _plain(ds.get(name)) for name in HEADER_FIELDS if ds.get(name) is not None}
+    header["TransferSyntaxUID"] = str(ds.file_meta.TransferSyntaxUID)
+    return header
+
+
+def read_header(path: str) -> Dict:
+    """只读头信息（stop_before_pixels），几百 MB 的文件也只读前面几 KB"""
+    require_pydicom()
+    return _header(pydicom.dcmread(path, stop_before_pixels=True))
+
+
+def _first(value, default: Optional[float] = None) -> Optional[float]:
+    """WindowCenter 等可能是多值，取第一个"""
+    if value is None:
+        return default
+    if isinstance(value, MutableSequence):
+        return float(value[0]) if len(value) else default
+    return float(value)
+
+
+class DicomImage:
+    """
+    懒加载的 DICOM 片子：构造时只解析头信息并记下像素数据在文件中的偏移，
+    未压缩的像素以 np.memmap 只读映射，取某一帧 / 降采样时只有被访问的页会读入内存；
+    压缩传输语法无法映射，按需只解码请求的那一帧。
+    BitsStored 小于 BitsAllocated 时（如 16 位容器中的 12 位），映射出的原始字可能带有高位无关位，
+    取用时按 HighBit / BitsStored 截取并对有符号数做符号扩展，与 pydicom 解码结果一致。
+    """
+
+    def __init__(self, path: str):
+        require_pydicom()
+        self.path = str(path)
+        ds = pydicom.dcmread(self.path, defer_size=DEFER_SIZE)
+        self.header = _header(ds)
+        self.transfer_syntax = ds.file_meta.TransferSyntaxUID
+
+        self.rows = int(ds.Rows)
+        self.columns = int(ds.Columns)
+        self.frames = int(ds.get("NumberOfFrames", 1) or 1)
+        self.samples = int(ds.get("SamplesPerPixel", 1))
+        self.photometric = str(ds.get("PhotometricInterpretation", "MONOCHROME2"))
+        self.slope = _first(ds.get("RescaleSlope"), 1.0)
+        self.intercept = _first(ds.get("RescaleIntercept"), 0.0)
+        self.window = (_first(ds.get("WindowCenter")), _first(ds.get("WindowWidth")))
+        if self.samples > 1 and int(ds.get("PlanarConfiguration", 0)) != 0:
+            raise ValueError("暂不支持 PlanarConfiguration=1 的彩色 DICOM")
+
+        self._pixels: Optional[np.ndarray] = None
+        self._unpack: Optional[Tuple[int, int, bool]] = None
+        if not self.transfer_syntax.is_encapsulated:
+            element = ds.get_item(PIXEL_DATA, keep_deferred=True)
+            if element is None:
+                raise ValueError(f"{self.path} 不含像素数据")
+            bits = int(ds.BitsAllocated)
+            if bits not in (8, 16, 32):
+                raise ValueError(f"不支持 BitsAllocated={bits}")
+            kind = "i" if int(ds.get("PixelRepresentation", 0)) == 1 else "u"
+            order = "<" if self.transfer_syntax.is_little_endian else ">"
+            shape = (self.frames, self.rows, self.columns) + ((self.samples,) if self.samples > 1 else ())
+            self._pixels = np.memmap(self.path, dtype=f"{order}{kind}{bits // 8}", mode="r",
+                                     offset=element.value_tell, shape=shape)
+            stored = int(ds.get("BitsStored", bits))
+            if stored < bits:
+                high_bit = int(ds.get("HighBit", stored - 1))
+                # (右移位数, 有效位数, 是否有符号)
+                self._unpack = (high_bit - stored + 1, stored, kind == "i")
+
+    @property
+    def memory_mapped(self) -> bool:
+        return self._pixels is not None
+
+    def frame(self, index: int = 0) -> np.ndarray:
+        """第 index 帧的原始像素：未压缩时为内存映射视图（不复制），压缩时只解码这一帧"""
+        if not 0 <= index < self.frames:
+            raise IndexError(f"帧号 {index} 超出范围 0..{self.frames - 1}")
+        if self._pixels is not None:
+            return self._unpacked(self._pixels[index])
+        return decode_frame(self.path, index=index)
+
+    def _unpacked(self, raw: np.ndarray) -> np.ndarray:
+        """截取 BitsStored 有效位并做符号扩展；无需处理时原样返回（仍是映射视图）"""
+        if self._unpack is None:
+            return raw
+        shift, stored, signed = self._unpack
+        values = (raw.astype(np.int64) >> shift) & ((1 << stored) - 1)
+        if signed:
+            values = np.where(values >= 1 << (stored - 1), values - (1 << stored), values)
+        return values.astype(raw.dtype.newbyteorder("="))
+
+    def preview(self, index: int = 0, max_size: int = PREVIEW_SIZE,
+                center: Optional[float] = None, width: Optional[float] = None) -> Image.Image:
+        """
+        加窗、降采样后的 8 位预览。先按步长隔行取样到不超过 2×max_size（内存映射时只读这些行），
+        再做 rescale / 窗宽窗位 / 查找表，最后由 PIL 抗锯齿缩到 max_size。
+        窗位窗宽缺省时取头信息，头信息也没有时取 1%–99% 分位数。
+        """
+        step = max(1, math.floor(max(self.rows, self.columns) / (2 * max_size)))
+        if self._pixels is not None:
+            # 先取样再截取有效位，只处理取到的行
+            if not 0 <= index < self.frames:
+                raise IndexError(f"帧号 {index} 超出范围 0..{self.frames - 1}")
+            pixels = self._unpacked(self._pixels[index][::step, ::step])
+        else:
+            pixels = self.frame(index)[::step, ::step]
+        sampled = np.asarray(pixels, dtype=np.float32)
+        values = sampled * self.slope + self.intercept
+
+        if self.samples > 1:
+            # 彩色（如二次截图）不加窗，直接按 8 位显示
+            image = Image.fromarray(np.clip(values, 0, 255).astype(np.uint8))
+        else:
+            center = center if center is not None else self.window[0]
+            width = width if width is not None else self.window[1]
+            if center is None or not width:
+                low, high = np.percentile(values, (1, 99))
+            else:
+                low, high = center - width / 2, center + width / 2
+            scaled = np.clip((values - low) / max(high - low, 1e-6), 0.0, 1.0)
+            if self.photometric == "MONOCHROME1":
+                scaled = 1.0 - scaled
+            image = Image.fromarray((scaled * 255).astype(np.uint8))
+
+        image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        return image
+
+
+def verify_dicom(path: str):
+    """上传校验：头信息可解析、且带有图像尺寸"""
+    header = read_header(path)
+    if "Rows" not in header or "Columns" not in header:
+        raise ValueError("DICOM 文件不含图像")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查看 DICOM 头信息并导出加窗预览（不整块读入像素）")
+    parser.add_argument("path")
+    parser.add_argument("--frame", type=int, default=0)
+    parser.add_argument("--preview", help="预览 PNG 输出路径")
+    parser.add_argument("--size", type=int, default=PREVIEW_SIZE)
+    parser.add_argument("--center", type=float)
+    parser.add_argument("--width", type=float)
+    args = parser.parse_args()
+
+    dicom = DicomImage(args.path)
+    print(json.dumps(dicom.header, ensure_ascii=False, indent=2))
+    print(f"{dicom.frames} 帧，{'内存映射' if dicom.memory_mapped else '按帧解码'}")
+    if args.preview:
+        dicom.preview(args.frame, args.size, args.center, args.width).save(args.preview)
+        print(f"已导出 {args.preview}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+# utils/guideline_index.py
+import argparse
+import json
+import math
+import re
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+GUIDELINE_SOURCES = ["surgical_pharma_plan.json"]
+GUIDELINE_INDEX_FILE = "guideline_index.json"
+INDEX_VERSION = 1
+
+SCENARIO_TITLES = {
+    "564": "Severe Functional Limitation",
+    "225": "Moderate Functional Limitation with Mechanical Symptoms",
+    "482": "Younger Patient with Single-Compartment Disease"
+}
+
+# 字段权重（BM25F）：临床表现与体格检查更能区分场景
+FIELD_WEIGHTS = {
+    "clinical_presentation": 1.5,
+    "physical_findings": 1.2,
+    "radiographic_features": 1.2,
+    "text": 0.6,
+}
+
+_RATING_RE = re.compile(
+    r"(Total knee arthroplasty|Unicompartmental knee arthroplasty.*?|Realignment Osteotomy.*?)\s*"
+    r"(Appropriate|May Be Appropriate|Rarely Appropriate)\s*(\d)"
+)
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "to", "in", "on", "with", "is", "are", "has",
+    "have", "than", "more", "less", "no", "not", "it", "be", "as", "at", "by", "for",
+    "within", "over", "into", "that", "this", "patient", "reports", "shows", "e", "g",
+}
+
+
+# =============================================================================
+# 场景文本解析
+# =============================================================================
+def _extract_section(text: str, start_kw: str, end_kw: Optional[str] = None) -> str:
+    try:
+        start = text.index(start_kw)
+        end = text.index(end_kw, start) if end_kw else None
+        return text[start + len(start_kw):end].strip()
+    except ValueError:
+        return ""
+
+
+def parse_guideline(guideline_text: str) -> Dict:
+    """把一条指南场景原文解析为结构化字段"""
+    match = re.search(r"Scenario (\d+):", guideline_text)
+    gid = match.group(1) if match else "Unknown"
+
+    clinical = _extract_section(guideline_text, "The patient reports", "Demonstrates") \
+        or _extract_section(guideline_text, "Experiences", "has limited") \
+        or _extract_section(guideline_text, "Patient experiences", "Range of motion")
+    physical = _extract_section(guideline_text, "Demonstrates", "Shows") \
+        or _extract_section(guideline_text, "has limited", "shows") \
+        or _extract_section(guideline_text, "Range of motion", "Imaging")
+    radio = _extract_section(guideline_text, "Shows", "Total") \
+        or _extract_section(guideline_text, "exhibits", "Total") \
+        or _extract_section(guideline_text, "Imaging", "Total")
+
+    appropriateness = [
+        {"procedure": proc.strip(), "rating": rating, "score": int(score)}
+        for proc, rating, score in _RATING_RE.findall(guideline_text)
+    ]
+    return {
+        "id": gid,
+        "title": SCENARIO_TITLES.get(gid, "Clinical Scenario"),
+        "clinical_presentation": clinical,
+        "physical_findings": physical,
+        "radiographic_features": radio,
+        "appropriateness": appropriateness,
+        "text": guideline_text,
+    }
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS]
+
+
+def iter_guideline_texts(paths: Iterable[str]) -> Iterable[str]:
+    """支持 *_plan.json（matched_guidelines）、JSON 列表和 JSONL 三种语料格式"""
+    for path in paths:
+        p = Path(path)
+        if not p.exists():
+            continue
+        if p.suffix == ".jsonl":
+            with open(p, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line).get("guideline", "")
+            continue
+        with open(p, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        items = data.get("matched_guidelines", []) if isinstance(data, dict) else data
+        for item in items:
+            yield item.get("guideline", "") if isinstance(item, dict) else str(item)
+
+
+# =============================================================================
+# 倒排索引 + BM25F 排序
+# =============================================================================
+class GuidelineIndex:
+    def __init__(self, docs: List[Dict], postings: Dict[str, Dict[str, List[List[int]]]],
+                 doc_lens: Dict[str, List[int]], k1: float = 1.2, b: float = 0.75):
+        self.docs = docs
+        self.postings = postings
+        self.doc_lens = doc_lens
+        self.k1 = k1
+        self.b = b
+        self.by_id = {doc["id"]: i for i, doc in enumerate(docs)}
+        self.avg_lens = {
+            field: (sum(lens) / len(lens) if lens else 0.0) for field, lens in doc_lens.items()
+        }
+
+    @classmethod
+    def build(cls, guideline_texts: Iterable[str]) -> "GuidelineIndex":
+        docs: List[Dict] = []
+        seen = set()
+        for text in guideline_texts:
+            if not text:
+                continue
+            doc = parse_guideline(text)
+            if doc["id"] == "Unknown":
+                doc["id"] = f"U{len(docs)}"
+            if doc["id"] in seen:
+                continue
+            seen.add(doc["id"])
+            docs.append(doc)
+
+        postings: Dict[str, Dict[str, List[List[int]]]] = {f: defaultdict(list) for f in FIELD_WEIGHTS}
+        doc_lens: Dict[str, List[int]] = {f: [] for f in FIELD_WEIGHTS}
+        for doc_id, doc in enumerate(docs):
+            for field in FIELD_WEIGHTS:
+                tokens = tokenize(doc[field])
+                doc_lens[field].append(len(tokens))
+                for term, tf in Counter(tokens).items():
+                    postings[field][term].append([doc_id, tf])
+        return cls(docs, {f: dict(p) for f, p in postings.items()}, doc_lens)
+
+    def save(self, path: str = GUIDELINE_INDEX_FILE):
+        payload = {
+            "version": INDEX_VERSION,
+            "docs": self.docs,
+            "postings": self.postings,
+            "doc_lens": self.doc_lens,
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str = GUIDELINE_INDEX_FILE) -> "GuidelineIndex":
+        with open(path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        if payload.get("version") != INDEX_VERSION:
+            raise ValueError(f"指南索引版本不匹配: {payload.get('version')}")
+        return cls(payload["docs"], payload["postings"], payload["doc_lens"])
+
+    def get(self, scenario_id: str) -> Optional[Dict]:
+        idx = self.by_id.get(scenario_id)
+        return self.docs[idx] if idx is not None else None
+
+    def _idf(self, field: str, term: str) -> float:
+        n = len(self.docs)
+        df = len(self.postings[field].get(term, ()))
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, top_k: int = 5, min_scores: Optional[Dict[str, int]] = None) -> List[Dict]:
+        """
+        BM25F 检索。min_scores 为结构化过滤，例如
+        {"Total knee arthroplasty": 7} 只保留该术式适宜性评分 ≥7 的场景。
+        """
+        terms = Counter(tokenize(query))
+        scores: Dict[int, float] = defaultdict(float)
+        for field, weight in FIELD_WEIGHTS.items():
+            avg_len = self.avg_lens[field] or 1.0
+            lens = self.doc_lens[field]
+            for term, qtf in terms.items():
+                plist = self.postings[field].get(term)
+                if not plist:
+                    continue
+                idf = self._idf(field, term)
+                for doc_id, tf in plist:
+                    norm = self.k1 * (1 - self.b + self.b * lens[doc_id] / avg_len)
+                    scores[doc_id] += weight * qtf * idf * tf * (self.k1 + 1) / (tf + norm)
+
+        results = []
+        for doc_id, score in sorted(scores.items(), key=lambda x: x[1], reverse=True):
+            doc = self.docs[doc_id]
+            if min_scores and not _passes_filters(doc, min_scores):
+                continue
+            results.append({"score": round(score, 4), **doc})
+            if len(results) >= top_k:
+                break
+        return results
+
+
+def _passes_filters(doc: Dict, min_scores: Dict[str, int]) -> bool:
+    ratings = {a["procedure"]: a["score"] for a in doc["appropriateness"]}
+    for procedure, min_score in min_scores.items():
+        score = next((s for name, s in ratings.items() if name.startswith(procedure)), None)
+        if score is None or score < min_score:
+            return False
+    return True
+
+
+def load_or_build_index(path: str = GUIDELINE_INDEX_FILE,
+                        sources: Optional[List[str]] = None) -> GuidelineIndex:
+    """优先读取预构建索引，缺失时用内置语料现场构建"""
+    if Path(path).exists():
+        return GuidelineIndex.load(path)
+    return GuidelineIndex.build(iter_guideline_texts(sources or GUIDELINE_SOURCES))
+
+
+def patient_query_from_report(report: Dict[str, List[str]]) -> str:
+    """把结构化病历（structured_report_template.json 格式）拼成检索语句"""
+    return " ".join(line for lines in report.values() for line in lines)
+
+
+def patient_query_from_features(features: Dict) -> str:
+    """
+    没有结构化病历时（如队列导入的随访），由 predict_params 字段拼出检索语句：
+    KOOS 疼痛 → 疼痛与行走受限程度，KL 分级 → 受累间室与力线，年龄 → 年轻 / 中年。
+    """
+    def number(key: str) -> Optional[float]:
+        try:
+            return float(features.get(key))
+        except (TypeError, ValueError):
+            return None
+
+    parts = []
+    pains = [v for v in (number("KOOSPain_R"), number("KOOSPain_L")) if v is not None]
+    if pains:
+        pain = min(pains)
+        if pain < 50:
+            parts.append("activity-restricting pain difficult to walk short distances city blocks")
+        elif pain < 75:
+            parts.append("pain restricts mobility over moderate to extended walking distances quarter-mile")
+        else:
+            parts.append("mild to moderate symptoms")
+    grades = [v for v in (number("XRKL_R"), number("XRKL_L")) if v is not None]
+    if grades:
+        parts.append("more than one joint compartment varus valgus alignment" if max(grades) >= 3
+                     else "one compartment joint space narrowing normal alignment")
+    age = number("AGE")
+    if age is not None:
+        parts.append("relatively young" if age < 55 else "middle-aged demographic")
+    return " ".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="构建 / 查询本地指南倒排索引")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build_p = sub.add_parser("build")
+    build_p.add_argument("sources", nargs="*", default=GUIDELINE_SOURCES)
+    build_p.add_argument("--out", default=GUIDELINE_INDEX_FILE)
+
+    search_p = sub.add_parser("search")
+    search_p.add_argument("query")
+    search_p.add_argument("--index", default=GUIDELINE_INDEX_FILE)
+    search_p.add_argument("--top-k", type=int, default=5)
+
+    args = parser.parse_args()
+    if args.command == "build":
+        index = GuidelineIndex.build(iter_guideline_texts(args.sources))
+        index.save(args.out)
+        print(f"已写入 {args.out}，共 {len(index.docs)} 个场景")
+    else:
+        index = load_or_build_index(args.index)
+        start = time.perf_counter()
+        results = index.search(args.query, top_k=args.top_k)
+        elapsed = (time.perf_counter() - start) * 1000
+        for r in results:
+            print(f"{r['score']:8.3f}  Scenario {r['id']}: {r['title']}")
+        print(f"({elapsed:.2f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# utils/koos.py
+import argparse
+import csv
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# KOOS 五个分量表及条目编号（KOOS User's Guide）
+# 条目按 0（无问题）~ 4（极重）编码，分量表得分 = 100 - 平均分 × 25
+SUBSCALE_ITEMS: Dict[str, List[str]] = {
+    "symptoms": [f"S{i}" for i in range(1, 8)],
+    "pain": [f"P{i}" for i in range(1, 10)],
+    "adl": [f"A{i}" for i in range(1, 18)],
+    "sport": [f"SP{i}" for i in range(1, 6)],
+    "qol": [f"Q{i}" for i in range(1, 5)],
+}
+
+SIDES = ("R", "L")
+
+# 至少作答一半条目才计分；缺失条目等价于用该分量表已答条目均值替代
+MIN_ANSWERED_FRACTION = 0.5
+
+# 与 predict_params.json 的字段名对应
+PARAM_KEYS = {
+    ("pain", "R"): "KOOSPain_R",
+    ("symptoms", "R"): "KOOSSym_R",
+    ("pain", "L"): "KOOSPain_L",
+    ("symptoms", "L"): "KOOSSym_L",
+}
+# 运动/生活质量在 predict_params 中不分侧，取指数膝（右膝）
+INDEX_KNEE = "R"
+UNSIDED_PARAM_KEYS = {"sport": "KOOSSport", "qol": "KOOSQOL"}
+
+
+def score_matrix(responses: np.ndarray, min_answered_fraction: float = MIN_ANSWERED_FRACTION) -> np.ndarray:
+    """
+    responses: (n_patients, n_items)，缺失为 NaN。
+    返回 (n_patients,) 的分量表得分，作答不足时为 NaN。
+    """
+    responses = np.asarray(responses, dtype=np.float64)
+    if responses.ndim == 1:
+        responses = responses[np.newaxis, :]
+    answered = ~np.isnan(responses)
+    n_answered = answered.sum(axis=1)
+    totals = np.where(answered, responses, 0.0).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = totals / n_answered
+    scores = 100.0 - means * 25.0
+    enough = n_answered >= np.ceil(responses.shape[1] * min_answered_fraction)
+    return np.where(enough, np.round(scores, 1), np.nan)
+
+
+def score_records(records: Sequence[Dict], sides: Sequence[str] = SIDES) -> Dict[str, np.ndarray]:
+    """
+    批量计分。records 中条目键为 "<item>_<side>"（如 P5_R），值可为空。
+    返回 {"pain_R": array, ...}，每个分量表/侧只做一次向量化计算。
+    """
+    columns = [f"{item}_{side}" for items in SUBSCALE_ITEMS.values() for side in sides for item in items]
+    # 一次性转换成 (n_patients, n_columns) 矩阵，再按分量表切片计分
+    matrix = np.array([[_to_float(r.get(key)) for key in columns] for r in records],
+                      dtype=np.float64).reshape(len(records), len(columns))
+    results = {}
+    start = 0
+    for subscale, items in SUBSCALE_ITEMS.items():
+        for side in sides:
+            results[f"{subscale}_{side}"] = score_matrix(matrix[:, start:start + len(items)])
+            start += len(items)
+    return results
+
+
+def score_items(answered: Dict[str, float], subscale: str) -> Optional[float]:
+    """单个患者、单侧单分量表（评估对话实时计分使用）"""
+    row = np.array([_to_float(answered.get(item)) for item in SUBSCALE_ITEMS[subscale]])
+    score = score_matrix(row)[0]
+    return None if np.isnan(score) else float(score)
+
+
+def to_predict_params(scores: Dict[str, np.ndarray], row: int = 0) -> Dict[str, float]:
+    """把 score_records 的一行结果映射为 predict_params.json 字段"""
+    params = {}
+    for (subscale, side), key in PARAM_KEYS.items():
+        value = scores[f"{subscale}_{side}"][row]
+        if not np.isnan(value):
+            params[key] = float(value)
+    for subscale, key in UNSIDED_PARAM_KEYS.items():
+        value = scores[f"{subscale}_{INDEX_KNEE}"][row]
+        if not np.isnan(value):
+            params[key] = float(value)
+    return params
+
+
+def _to_float(value) -> float:
+    if value is None or value == "":
+        return np.nan
+    return float(value)
+
+
+# =============================================================================
+# 队列文件批量计分
+# =============================================================================
+def load_cohort(path: str) -> List[Dict]:
+    p = Path(path)
+    with open(p, "r", encoding="utf-8") as f:
+        if p.suffix == ".csv":
+            return list(csv.DictReader(f))
+        if p.suffix == ".jsonl":
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+
+def score_cohort_file(path: str, id_field: str = "patient_id") -> List[Dict]:
+    records = load_cohort(path)
+    scores = score_records(records)
+    columns = list(scores)
+    rows = []
+    for i, record in enumerate(records):
+        row = {id_field: record.get(id_field, i)}
+        for col in columns:
+            value = scores[col][i]
+            row[col] = None if np.isnan(value) else float(value)
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KOOS 队列批量计分")
+    parser.add_argument("cohort", help="CSV / JSON / JSONL，条目列名形如 P5_R、S1_L")
+    parser.add_argument("--out", help="输出 CSV，缺省打印到终端")
+    parser.add_argument("--id-field", default="patient_id")
+    args = parser.parse_args()
+
+    rows = score_cohort_file(args.cohort, args.id_field)
+    if not rows:
+        return
+    if args.out:
+        with open(args.out, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"已写入 {args.out}，共 {len(rows)} 名患者")
+    else:
+        for row in rows:
+            print(json.dumps(row, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
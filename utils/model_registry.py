@@ -0,0 +1,179 @@
+# utils/model_registry.py
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+# 目录结构：
+#   models/<name>/CURRENT              当前版本号（一行文本），改写即热切换
+#   models/<name>/<version>/manifest.json
+#   models/<name>/<version>/<array>.npy
+# 数组以 mmap_mode="r" 打开：只读页由操作系统页缓存在所有 worker 进程间共享，
+# 增加 worker 不会让每个进程各自复制一份权重。
+MODEL_DIR_ENV = "MODEL_DIR"
+MODEL_DIR = "models"
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+CHECK_INTERVAL = 1.0
+
+log = logging.getLogger("kom.models")
+
+
+class ModelArtifact:
+    """某个版本的只读数组（内存映射）与元数据"""
+
+    def __init__(self, name: str, version: str, arrays: Dict[str, np.ndarray], meta: Dict):
+        self.name = name
+        self.version = version
+        self.arrays = arrays
+        self.meta = meta
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        return self.arrays[key]
+
+
+def _write_text_atomic(path: Path, text: str):
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, path)
+
+
+def save_model(root: str, name: str, arrays: Dict[str, np.ndarray], meta: Optional[Dict] = None,
+               version: Optional[str] = None, activate: bool = True) -> str:
+    """
+    写入一个新版本：先写到临时目录再整体改名，读者永远看不到写了一半的版本；
+    activate 时再原子地改写 CURRENT。已存在的版本不可覆盖。
+    """
+    model_dir = Path(root) / name
+    model_dir.mkdir(parents=True, exist_ok=True)
+    version = version or time.strftime("%Y%m%d-%H%M%S")
+    target = model_dir / version
+    if target.exists():
+        raise FileExistsError(f"模型版本已存在: {target}")
+
+    staging = Path(tempfile.mkdtemp(dir=model_dir, prefix=f".{version}."))
+    try:
+        manifest = {"name": name, "version": version, "created": time.time(), "meta": meta or {}, "arrays": {}}
+        for key, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            np.save(staging / f"{key}.npy", array, allow_pickle=False)
+            manifest["arrays"][key] = {"file": f"{key}.npy", "dtype": str(array.dtype), "shape": list(array.shape)}
+        (staging / MANIFEST_FILE).write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+        # mkdtemp 创建的目录仅属主可读，其他用户运行的 worker 也需要读取
+        os.chmod(staging, 0o755)
+        os.rename(staging, target)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    if activate:
+        activate_version(root, name, version)
+    return version
+
+
+def activate_version(root: str, name: str, version: str):
+    model_dir = Path(root) / name
+    if not (model_dir / version / MANIFEST_FILE).exists():
+        raise FileNotFoundError(f"模型版本不存在: {model_dir / version}")
+    _write_text_atomic(model_dir / CURRENT_FILE, version + "\n")
+
+
+def list_versions(root: str, name: str) -> List[str]:
+    model_dir = Path(root) / name
+    if not model_dir.is_dir():
+        return []
+    return sorted(p.name for p in model_dir.iterdir() if (p / MANIFEST_FILE).exists())
+
+
+def load_artifact(root: str, name: str, version: str) -> ModelArtifact:
+    version_dir = Path(root) / name / version
+    manifest = json.loads((version_dir / MANIFEST_FILE).read_text(encoding="utf-8"))
+    arrays = {}
+    for key, spec in manifest["arrays"].items():
+        array = np.load(version_dir / spec["file"], mmap_mode="r", allow_pickle=False)
+        if list(array.shape) != spec["shape"] or str(array.dtype) != spec["dtype"]:
+            raise ValueError(f"{version_dir / spec['file']} 与 manifest 不一致")
+        arrays[key] = array
+    return ModelArtifact(name, version, arrays, manifest.get("meta", {}))
+
+
+class ModelRegistry:
+    """
+    进程级注册表（在 app 中用 st.cache_resource 持有）。get() 最多每 CHECK_INTERVAL 秒看一次 CURRENT，
+    版本变化时加载新版本（热切换，无需重启）；旧版本对象仍被正在使用它的会话引用，用完自然释放。
+    builder 把原始数组包装成模型对象，每个版本只构建一次。
+    """
+
+    def __init__(self, root: Optional[str] = None, check_interval: float = CHECK_INTERVAL):
+        self.root = root or os.getenv(MODEL_DIR_ENV, MODEL_DIR)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._loaded: Dict[str, object] = {}
+        self._versions: Dict[str, Optional[str]] = {}
+        self._checked: Dict[str, float] = {}
+
+    def current_version(self, name: str) -> Optional[str]:
+        try:
+            return (Path(self.root) / name / CURRENT_FILE).read_text(encoding="utf-8").strip() or None
+        except FileNotFoundError:
+            return None
+
+    def get(self, name: str, builder: Callable[[ModelArtifact], object]) -> Optional[object]:
+        """返回当前版本的模型对象；注册表中没有该模型时返回 None（由调用方回退）"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked.get(name, float("-inf")) < self.check_interval:
+                return self._loaded.get(name)
+            self._checked[name] = now
+            version = self.current_version(name)
+            if version is None:
+                self._loaded.pop(name, None)
+                self._versions[name] = None
+                return None
+            if version != self._versions.get(name):
+                try:
+                    self._loaded[name] = builder(load_artifact(self.root, name, version))
+                except Exception:
+                    # 新版本有问题时继续使用已加载的版本
+                    log.exception("model load failed", extra={"model": name, "version": version})
+                    return self._loaded.get(name)
+                self._versions[name] = version
+                log.info("model loaded", extra={"model": name, "version": version})
+            return self._loaded.get(name)
+
+    def version(self, name: str) -> Optional[str]:
+        return self._versions.get(name)
+
+
+def main():
+    # 只管理已发布的版本；模型由训练作业以 save_model 发布（元数据中注明 fitted 与训练来源）
+    parser = argparse.ArgumentParser(description="模型注册表：切换 / 查看版本")
+    parser.add_argument("--root", default=os.getenv(MODEL_DIR_ENV, MODEL_DIR))
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    activate = sub.add_parser("activate", help="切换当前版本（运行中的应用自动加载）")
+    activate.add_argument("name")
+    activate.add_argument("version")
+    listing = sub.add_parser("list")
+    listing.add_argument("name")
+    args = parser.parse_args()
+
+    if args.cmd == "activate":
+        activate_version(args.root, args.name, args.version)
+        print(f"当前版本: {args.name}/{args.version}")
+    elif args.cmd == "list":
+        current = ModelRegistry(args.root).current_version(args.name)
+        for version in list_versions(args.root, args.name):
+            print(f"{'*' if version == current else ' '} {version}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+# utils/patient_pipeline.py
+import hashlib
+import json
+import logging
+import re
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+log = logging.getLogger("kom.pipeline")
+
+
+def fingerprint(value: Any) -> str:
+    """内容指纹：键排序后的 JSON 摘要，与对象身份无关"""
+    data = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class Node:
+    """
+    图中的一个计算节点。deps 为上游节点名；fields 可为某个上游（输出为 dict）只声明用到的字段，
+    该上游的其他字段变化不会使本节点失效。
+    """
+
+    def __init__(self, name: str, func: Callable[..., Any], deps: Sequence[str] = (),
+                 fields: Optional[Dict[str, Iterable[str]]] = None):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.fields = {dep: tuple(keys) for dep, keys in (fields or {}).items()}
+        # 备忘：上次计算时的输入指纹、输出值与输出指纹
+        self.input_fp: Optional[str] = None
+        self.value: Any = None
+        self.output_fp: Optional[str] = None
+        self.runs = 0
+        self.elapsed = 0.0
+
+
+class PipelineGraph:
+    """
+    按需求值的依赖图：取某节点时先使上游最新，再比较输入指纹，未变化则直接返回备忘值。
+    重新计算后若输出指纹不变（early cutoff），下游的输入指纹也不变，不会继续重算。
+    """
+
+    def __init__(self):
+        self.nodes: Dict[str, Node] = {}
+        self._inputs: Dict[str, Tuple[Any, str]] = {}
+
+    # -------------------------------------------------------------------------
+    # 定义
+    # -------------------------------------------------------------------------
+    def add_node(self, name: str, func: Callable[..., Any], deps: Sequence[str] = (),
+                 fields: Optional[Dict[str, Iterable[str]]] = None):
+        for dep in deps:
+            if dep not in self.nodes and dep not in self._inputs:
+                raise ValueError(f"节点 {name} 的上游 {dep} 未定义")
+        self.nodes[name] = Node(name, func, deps, fields)
+
+    def set_input(self, name: str, value: Any) -> bool:
+        """设置输入，返回内容是否有变化（无变化时下游备忘全部保留）"""
+        if name in self.nodes:
+            raise ValueError(f"{name} 是计算节点，不能作为输入")
+        fp = fingerprint(value)
+        old = self._inputs.get(name)
+        if old is not None and old[1] == fp:
+            return False
+        self._inputs[name] = (value, fp)
+        return True
+
+    # -------------------------------------------------------------------------
+    # 求值
+    # -------------------------------------------------------------------------
+    def get(self, name: str) -> Any:
+        return self._evaluate(name)[0]
+
+    def _evaluate(self, name: str) -> Tuple[Any, str]:
+        if name in self._inputs:
+            return self._inputs[name]
+        node = self.nodes.get(name)
+        if node is None:
+            raise KeyError(f"未定义的节点或输入: {name}")
+
+        args, parts = {}, []
+        for dep in node.deps:
+            value, fp = self._evaluate(dep)
+            keys = node.fields.get(dep)
+            if keys is not None:
+                value = {k: value.get(k) for k in keys}
+                fp = fingerprint(value)
+            args[dep] = value
+            parts.append(f"{dep}={fp}")
+        input_fp = fingerprint(parts)
+
+        if node.input_fp != input_fp:
+            started = time.perf_counter()
+            node.value = node.func(**args)
+            node.elapsed = time.perf_counter() - started
+            node.output_fp = fingerprint(node.value)
+            node.input_fp = input_fp
+            node.runs += 1
+            log.info("node computed", extra={"node": name, "runs": node.runs,
+                                             "elapsed_ms": round(node.elapsed * 1000, 1)})
+        return node.value, node.output_fp
+
+    def invalidate(self, name: str):
+        """强制下次取值时重算（例如外部模型或 LLM 结果需要刷新）"""
+        self.nodes[name].input_fp = None
+
+
+# =============================================================================
+# 患者流水线：评估 → 特征 → 预测 → 各治疗方案 → 临床整合
+# =============================================================================
+# 各方案智能体实际用到的特征字段；其余字段（如双侧 X 线细项）变化不触发该方案重算
+EXERCISE_FIELDS = ("AGE", "BMI", "WEIGHT", "KOOSPain_R", "KOOSPain_L", "KOOSSport", "KOOSQOL")
+SURGICAL_PHARMA_FIELDS = ("AGE", "BMI", "XRKL_L", "XRKL_R", "KOOSPain_R", "KOOSPain_L",
+                          "RKImg_V00", "LKImg_V00")
+NUTRITION_PSYCHOLOGY_FIELDS = ("AGE", "BMI", "WEIGHT", "KOOSQOL")
+
+
+# 结构化影像报告中的条目 -> 特征字段（与 predict_params.json 同名，末尾加 _R / _L）
+_KNEE_SIDES = {"right knee": "R", "left knee": "L"}
+_COMPARTMENTS = {"lateral": "L", "medial": "M", "internal": "M"}
+_BONES = {"femoral": "F", "tibial": "T"}
+_ASSESSMENT_LINE_RE = re.compile(
+    r"^(?P<compartment>lateral|medial|internal)\s+(?:(?P<bone>femoral|tibial)\s+)?"
+    r"(?P<finding>joint space|osteophytes|subchondral cysts):\s*(?:grade\s*(?P<grade>\d)|(?P<present>present|absent))",
+    re.I)
+_SEVERITY_RE = re.compile(r"^overall severity:\s*(?P<severity>\w+)", re.I)
+_FINDING_PREFIX = {"joint space": "XRJS", "osteophytes": "XROS", "subchondral cysts": "XRSC"}
+# 骨赘在 predict_params 中是 OARSI 分级（0–3），报告只给有 / 无：
+# 无 -> 0；有 -> 保留已记录的分级，已记录为 0 或缺失时取有骨赘的最低级 1
+OSTEOPHYTE_ABSENT_GRADE = 0
+OSTEOPHYTE_PRESENT_MIN_GRADE = 1
+
+
+def assessment_features(assessment: Dict, recorded: Optional[Dict] = None) -> Dict:
+    """
+    从影像评估报告中取出分级：关节间隙 XRJS*、骨赘 XROS*（有 / 无按上面的规则换算为 OARSI 分级）、
+    软骨下囊肿 XRSC*，以及整体严重程度 RKImg_V00 / LKImg_V00。无法识别的条目忽略。
+    recorded 为已记录的特征，用于骨赘有 / 无的换算。
+    """
+    recorded = recorded or {}
+    features = {}
+    for knee, sections in (assessment or {}).items():
+        side = _KNEE_SIDES.get(str(knee).strip().lower())
+        if side is None or not isinstance(sections, dict):
+            continue
+        for lines in sections.values():
+            for line in lines:
+                line = str(line).strip()
+                severity = _SEVERITY_RE.match(line)
+                if severity:
+                    features[f"{side}KImg_V00"] = severity.group("severity").capitalize()
+                    continue
+                match = _ASSESSMENT_LINE_RE.match(line)
+                if not match:
+                    continue
+                finding = match.group("finding").lower()
+                bone = _BONES.get((match.group("bone") or "").lower(), "")
+                if bool(bone) == (finding == "joint space"):
+                    continue
+                key = f"{_FINDING_PREFIX[finding]}{bone}{_COMPARTMENTS[match.group('compartment').lower()]}_{side}"
+                if match.group("grade") is not None:
+                    features[key] = int(match.group("grade"))
+                elif match.group("present").lower() == "absent":
+                    features[key] = OSTEOPHYTE_ABSENT_GRADE
+                else:
+                    grade = recorded.get(key)
+                    features[key] = max(grade if isinstance(grade, int) else 0, OSTEOPHYTE_PRESENT_MIN_GRADE)
+    return features
+
+
+def merge_features(default_params: Dict, assessment: Dict, assessment_measured: bool,
+                   chat_record: Dict, overrides: Dict) -> Dict:
+    """
+    默认参数 < 影像评估 < 评估对话抽取 < 页面上手动调整。
+    影像评估只在来自真实分析器（assessment_measured）时并入，且只取预测字段中已有的键；
+    预生成的示例报告不改写患者已记录的影像特征。
+    """
+    imaging = {}
+    if assessment_measured:
+        imaging = {key: value for key, value in assessment_features(assessment, default_params).items()
+                   if key in default_params}
+    return {**default_params, **imaging, **chat_record, **overrides}
+
+
+def build_patient_pipeline(assess: Callable[[Dict], Dict],
+                           predict: Callable[[Dict], Dict],
+                           plan_agents: Dict[str, Callable[..., Dict]]) -> PipelineGraph:
+    """
+    assess(assessment_source) -> 评估报告；predict(features) -> 预测结果；
+    plan_agents 为 exercise / surgical_pharma / nutrition_psychology / clinical_integration 四个智能体，
+    前三个以 (features, prediction) 调用，clinical_integration 以前三个方案调用。
+    输入：assessment_source、assessment_measured、default_params、chat_record、overrides、model_version。
+    """
+    graph = PipelineGraph()
+    graph.set_input("assessment_source", {})
+    graph.set_input("assessment_measured", False)
+    graph.set_input("default_params", {})
+    graph.set_input("chat_record", {})
+    graph.set_input("overrides", {})
+    graph.set_input("model_version", None)
+
+    graph.add_node("assessment", lambda assessment_source: assess(assessment_source),
+                   deps=["assessment_source"])
+    # 新的影像评估经 features 传到预测与各方案
+    graph.add_node("features", merge_features,
+                   deps=["default_params", "assessment", "assessment_measured", "chat_record", "overrides"])
+    # 模型热切换后 model_version 变化，预测及其下游随之重算
+    graph.add_node("prediction", lambda features, model_version: predict(features),
+                   deps=["features", "model_version"])
+
+    for name, fields in (("exercise", EXERCISE_FIELDS),
+                         ("surgical_pharma", SURGICAL_PHARMA_FIELDS),
+                         ("nutrition_psychology", NUTRITION_PSYCHOLOGY_FIELDS)):
+        graph.add_node(f"{name}_plan", plan_agents[name],
+                       deps=["features", "prediction"], fields={"features": fields})
+    graph.add_node("clinical_integration_plan", plan_agents["clinical_integration"],
+                   deps=["exercise_plan", "surgical_pharma_plan", "nutrition_psychology_plan"])
+    return graph
@@ -0,0 +1,244 @@
+# utils/pdf_report.py
+import logging
+import os
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, FrozenSet, List, Optional
+
+from fpdf import FPDF
+from fpdf.ttfonts import TTFontFile
+
+# 嵌入字体：环境变量优先，其次按候选路径查找。
+# 仓库不附带字体文件：中文报告需把 NotoSansSC-Regular.ttf 放到 fonts/（见 fonts/README.md）
+# 或用 PDF_FONT_PATH 指定；只找到 DejaVuSans 时中文字符会被剔除，应用记一条 warning，
+# 预构建（python -m utils.build_artifacts build）则直接失败。
+# fpdf 1.7.2 只能嵌入 TrueType 轮廓的 .ttf（不支持 .ttc 与 CFF 轮廓的 .otf），输出时自动子集化
+# 每份 PDF 只嵌入一种字体（不加粗体），标题用字号区分
+PDF_FONT_ENV = "PDF_FONT_PATH"
+FONT_DIR = Path(__file__).resolve().parent.parent / "fonts"
+FONT_CANDIDATES: List[str] = [
+    str(FONT_DIR / "NotoSansSC-Regular.ttf"),
+    "/usr/share/fonts/truetype/droid/DroidSansFallbackFull.ttf",
+    "C:/Windows/Fonts/simhei.ttf",
+    "/System/Library/Fonts/Supplemental/Arial Unicode.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+    # 无 CJK 字形，但至少覆盖拉丁扩展、希腊、西里尔与常用符号
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+]
+
+log = logging.getLogger("kom.pdf")
+
+PAGE_MARGIN = 15
+BODY_SIZE = 11
+TITLE_SIZE = 14
+LINE_HEIGHT = 6.5
+
+
+def clean_text_for_pdf(text: str) -> str:
+    replacements = {
+        "–": "-",
+        "—": "-",
+        "“": "\"",
+        "”": "\"",
+        "’": "'",
+        "•": "-",
+        "→": "->",
+        "…": "...",
+        "©": "(c)",
+    }
+    for old, new in replacements.items():
+        text = text.replace(old, new)
+    return text.encode("latin-1", "ignore").decode("latin-1")
+
+
+def strip_non_latin1(text: str) -> str:
+    """去除无法被 Latin-1 编码的字符（如 emoji、中文）"""
+    return text.encode("latin-1", errors="ignore").decode("latin-1")
+
+
+# =============================================================================
+# 字体发现与度量缓存（每个进程只解析一次 TTF）
+# =============================================================================
+@lru_cache(maxsize=None)
+def find_unicode_font() -> Optional[str]:
+    """找不到任何候选字体时返回 None，退回 Latin-1 核心字体"""
+    env_path = os.getenv(PDF_FONT_ENV)
+    if env_path and Path(env_path).is_file():
+        return env_path
+    for path in FONT_CANDIDATES:
+        if Path(path).is_file():
+            return path
+    return None
+
+
+@lru_cache(maxsize=None)
+def load_font_metrics(path: str) -> Dict:
+    """解析 TTF 度量（与 FPDF.add_font(uni=True) 相同的字段），并记录可渲染字符集"""
+    ttf = TTFontFile()
+    ttf.getMetrics(path)
+    cw = ttf.charWidths
+    return {
+        "name": re.sub("[ ()]", "", ttf.fullName),
+        "desc": {
+            "Ascent": int(round(ttf.ascent, 0)),
+            "Descent": int(round(ttf.descent, 0)),
+            "CapHeight": int(round(ttf.capHeight, 0)),
+            "Flags": ttf.flags,
+            "FontBBox": "[%s %s %s %s]" % tuple(int(round(v, 0)) for v in ttf.bbox),
+            "ItalicAngle": int(ttf.italicAngle),
+            "StemV": int(round(ttf.stemV, 0)),
+            "MissingWidth": int(round(ttf.defaultWidth, 0)),
+        },
+        "up": round(ttf.underlinePosition),
+        "ut": round(ttf.underlineThickness),
+        "cw": cw,
+        "originalsize": os.stat(path).st_size,
+        # cw[0] 存的是字符数，不是宽度
+        "covered": frozenset(chr(i) for i in range(1, len(cw)) if cw[i]),
+    }
+
+
+def has_cjk(path: Optional[str]) -> bool:
+    return path is not None and "中" in load_font_metrics(path)["covered"]
+
+
+@lru_cache(maxsize=None)
+def warn_if_no_cjk(path: str):
+    """每个字体只检查一次；缺中文字形时报告里的中文会被剔除"""
+    if not has_cjk(path):
+        log.warning("pdf font has no CJK glyphs, Chinese text will be dropped",
+                    extra={"font": path, "hint": f"install {FONT_CANDIDATES[0]} or set {PDF_FONT_ENV}"})
+
+
+class UnicodePDF(FPDF):
+    """复用进程级字体度量缓存的 FPDF；缺字形的字符（如 emoji）在排版前剔除"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.covered: Optional[FrozenSet[str]] = None
+
+    def add_cached_font(self, family: str, path: str):
+        metrics = load_font_metrics(path)
+        warn_if_no_cjk(path)
+        fontkey = family
+        self.fonts[fontkey] = {
+            "i": len(self.fonts) + 1, "type": "TTF",
+            "name": metrics["name"], "desc": metrics["desc"],
+            "up": metrics["up"], "ut": metrics["ut"], "cw": metrics["cw"],
+            "ttffile": path, "fontkey": fontkey,
+            "subset": list(range(0, 32)), "unifilename": None,
+        }
+        self.font_files[fontkey] = {"length1": metrics["originalsize"], "type": "TTF", "ttffile": path}
+        self.font_files[path] = {"type": "TTF"}
+        self.covered = metrics["covered"]
+
+    def _putTTfontwidths(self, font, maxUni):
+        # 父类逐个码位做 `cid in list` 判断，子集换成 set 后由 O(n²) 降为 O(n)。
+        # 覆盖的是 fpdf 1.7.2 的私有方法，只作用于本类；requirements.txt 因此固定 fpdf==1.7.2
+        super()._putTTfontwidths(dict(font, subset=set(font["subset"])), maxUni)
+
+    def printable(self, text: str) -> str:
+        text = str(text)
+        if self.covered is None:
+            return clean_text_for_pdf(text)
+        covered = self.covered
+        return "".join(c for c in text if c in covered or c == "\n")
+
+
+def new_pdf() -> UnicodePDF:
+    pdf = UnicodePDF()
+    pdf.set_margins(PAGE_MARGIN, PAGE_MARGIN, PAGE_MARGIN)
+    pdf.set_auto_page_break(True, PAGE_MARGIN)
+    font = find_unicode_font()
+    if font:
+        pdf.add_cached_font("body", font)
+    pdf.add_page()
+    return pdf
+
+
+def _set_font(pdf: UnicodePDF, size: int, bold: bool = False):
+    if pdf.covered is None:
+        pdf.set_font("Arial", "B" if bold else "", size)
+    else:
+        pdf.set_font("body", "", size)
+
+
+def _output(pdf: FPDF) -> bytes:
+    return pdf.output(dest="S").encode("latin1")
+
+
+# =============================================================================
+# 排版
+# =============================================================================
+def generate_pdf(text: str) -> bytes:
+    pdf = new_pdf()
+    _set_font(pdf, 12)
+    # 整段交给一次 multi_cell，换行由 "\n" 处理
+    pdf.multi_cell(0, 10, txt=pdf.printable(text))
+    return _output(pdf)
+
+
+def render_sections_pdf(sections: List[Dict]) -> bytes:
+    """
+    按 report_template 的绑定结果排版：标题、表格与列表各自成块输出，
+    列表类内容合并为一次 multi_cell，而不是逐行调用。
+    """
+    pdf = new_pdf()
+    body_width = pdf.w - 2 * PAGE_MARGIN
+    for section in sections:
+        title = pdf.printable(section["title"]).strip()
+        if title:
+            _set_font(pdf, TITLE_SIZE, bold=True)
+            pdf.multi_cell(0, LINE_HEIGHT + 1.5, txt=title)
+        _set_font(pdf, BODY_SIZE)
+        for block in section["blocks"]:
+            kind = block["kind"]
+            if kind == "table":
+                _table(pdf, block, body_width)
+                continue
+            if kind == "field":
+                prefix = f"{block['label']}: " if block["label"] else ""
+                lines = [f"- {prefix}{block['value']}"]
+            elif kind == "list":
+                lines = ([block["label"]] if block["label"] else []) + [f"- {item}" for item in block["items"]]
+            elif kind == "groups":
+                lines = [block["label"]] if block["label"] else []
+                for title, items in block["groups"]:
+                    lines.append(title)
+                    lines.extend(f"  - {item}" for item in items)
+            elif kind == "text":
+                lines = [block["text"]]
+            elif kind == "dict_items":
+                lines = []
+                for item, detail in block["items"]:
+                    lines.append(f"- {item}")
+                    if detail:
+                        lines.append(f"    {detail}")
+            else:
+                lines = block["lines"]
+            if lines:
+                pdf.multi_cell(0, LINE_HEIGHT, txt=pdf.printable("\n".join(map(str, lines))))
+        pdf.ln(3)
+    return _output(pdf)
+
+
+def _table(pdf: UnicodePDF, block: Dict, body_width: float):
+    columns = block["columns"]
+    label_width = body_width * 0.4
+    col_width = (body_width - label_width) / max(1, len(columns))
+    height = LINE_HEIGHT + 0.5
+
+    _set_font(pdf, BODY_SIZE, bold=True)
+    pdf.cell(label_width, height, pdf.printable(block.get("corner", "")), border=1)
+    for col in columns:
+        pdf.cell(col_width, height, pdf.printable(col), border=1, align="C")
+    pdf.ln(height)
+
+    _set_font(pdf, BODY_SIZE)
+    for label, values in block["rows"]:
+        pdf.cell(label_width, height, pdf.printable(label), border=1)
+        for value in values:
+            pdf.cell(col_width, height, pdf.printable(value), border=1, align="C")
+        pdf.ln(height)
+    pdf.ln(1)
@@ -16,3 +16,18 @@ def call_qwen_agent(prompt: str, app_id: str, api_key: str) -> str:
             return f"【Qwen 错误】状态码：{response.status_code}, 消息：{response.message}"
     except Exception as e:
         return f"【调用出错】：{e}"
+
+
+def is_error_reply(reply: str) -> bool:
+    return reply.startswith("【Qwen 错误】") or reply.startswith("【调用出错】")
+
+
+def call_qwen_agent_cached(prompt: str, app_id: str, api_key: str, cache) -> str:
+    """先查语义缓存（近似重复问题直接返回），未命中再调用 Qwen，错误回复不入缓存"""
+    cached = cache.lookup(prompt, app_id)
+    if cached is not None:
+        return cached
+    reply = call_qwen_agent(prompt, app_id, api_key)
+    if not is_error_reply(reply):
+        cache.add(prompt, reply, app_id)
+    return reply
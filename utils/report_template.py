@@ -0,0 +1,420 @@
+# utils/report_template.py
+import html
+import string
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils.pdf_report import render_sections_pdf
+
+# =============================================================================
+# 声明式报告模板
+#   section: {"title", "style": "plain" | "h4" | "bold", "optional"?, "each"?, "blocks": [...]}
+#            title 可含 {绑定}；optional 的段落在所有块都被省略时整段不输出；
+#            each 为列表绑定时，对每个元素各输出一次本段落（段内绑定以该元素为数据）
+#   block kinds:
+#     field      {"label"?, "bind", "optional"?}         -> "- Label: value"（optional 时缺失则省略）
+#     table      {"columns", "rows": [{"label", "binds"}]} -> "- Label:  Col=v, Col=v"
+#     records    {"bind", "columns", "cells"}            -> 字典列表，每个元素一行，cells 为各列绑定
+#     list       {"bind", "item", "label"?}              -> 列表中的每个元素按 item 格式化
+#     groups     {"bind", "title", "items", "label"?}    -> 每个元素一组：title 格式化为小标题，items 为其字符串列表
+#     dict_items {"bind", "item", "detail"?}             -> 字典的每个键值对（{key} / {value.xxx}）
+#     lines      {"bind"}                                -> 字符串列表，逐行输出
+#     text       {"text", "style"?: "note"}              -> 一段文字（可含 {绑定}）
+#   模板级 "sections_from": "*" 表示把数据的每个顶层键展开为一个 lines 段落
+# =============================================================================
+REPORT_TEMPLATES: Dict[str, Dict] = {
+    "prediction_report": {
+        "default": "N/A",
+        "sections": [
+            {
+                "title": "📊 Symptom Trajectory Forecast (KOOS, 0–100)",
+                "blocks": [{
+                    "kind": "table",
+                    "columns": ["Current", "Year 2", "Year 4"],
+                    "rows": [
+                        {"label": label, "binds": [f"{base}.v00", f"{base}.v01", f"{base}.v04"]}
+                        for label, base in [
+                            ("Right Knee Pain", "symptom_trajectory.right_knee.pain"),
+                            ("Right Knee Symptoms", "symptom_trajectory.right_knee.symptoms"),
+                            ("Left Knee Pain", "symptom_trajectory.left_knee.pain"),
+                            ("Left Knee Symptoms", "symptom_trajectory.left_knee.symptoms"),
+                            ("Sport/Recreation Function", "symptom_trajectory.right_knee.sport_recreation_function"),
+                            ("Quality of Life", "symptom_trajectory.right_knee.quality_of_life"),
+                        ]
+                    ],
+                }],
+            },
+            {
+                "title": "🦴 Imaging Trajectory (KL grade, 0–4)",
+                "blocks": [{
+                    "kind": "table",
+                    "columns": ["Current", "Year 2", "Year 4"],
+                    "rows": [
+                        {"label": f"{side.capitalize()} Knee",
+                         "binds": [f"imaging_trajectory.{side}_knee.pain.{v}" for v in ("v00", "v01", "v04")]}
+                        for side in ("right", "left")
+                    ],
+                }],
+            },
+            {
+                "title": "💡 Key Contributing Factors (SHAP)",
+                "blocks": [{
+                    "kind": "list",
+                    "bind": "key_factors.right_knee_symptoms_year2",
+                    "item": "{feature}: {impact} ({effect})",
+                }],
+            },
+        ],
+    },
+    "structured_report": {
+        "default": "",
+        "sections_from": "*",
+    },
+    "case_report": {
+        "default": "",
+        "sections": [
+            {"title": "{title}", "blocks": []},
+            {"title": "Demographics", "optional": True, "blocks": [
+                {"kind": "field", "label": "Age", "bind": "age", "optional": True},
+                {"kind": "field", "label": "Sex", "bind": "sex", "optional": True},
+                {"kind": "field", "label": "Bmi", "bind": "bmi", "optional": True},
+            ]},
+            {"title": "Case Reports", "blocks": [
+                {"kind": "list", "bind": "reports", "item": "{}"},
+            ]},
+            {"title": "Multi-Agent Dialogue", "blocks": [
+                {"kind": "list", "bind": "dialogue", "item": "[{role} / {type}] {content}"},
+            ]},
+        ],
+    },
+    "clinical_decision": {
+        "default": "",
+        "sections": [
+            {"title": "Integrated Multimodal Intervention Plan", "style": "h4", "blocks": []},
+            {"title": "🩺 Medication Strategy", "style": "bold", "blocks": [
+                {"kind": "field", "bind": "InterventionPlan.Medication.Summary"},
+            ]},
+            {"title": "🥗 Nutrition Plan", "style": "bold", "blocks": [
+                {"kind": "field", "label": "Framework", "bind": "InterventionPlan.NutritionPlan.Framework"},
+                {"kind": "field", "bind": "InterventionPlan.NutritionPlan.Description"},
+            ]},
+            {"title": "🏃 Exercise Plan", "style": "bold", "blocks": [
+                {"kind": "field", "label": "Framework", "bind": "InterventionPlan.ExercisePlan.Framework"},
+                {"kind": "dict_items", "bind": "InterventionPlan.ExercisePlan.Phases",
+                 "item": "{key}: {value.Goal}", "detail": "{value.Prescription}"},
+            ]},
+            {"title": "🧠 Psychological Support", "style": "bold", "blocks": [
+                {"kind": "field", "bind": "InterventionPlan.PsychologicalSupport.Summary"},
+            ]},
+            {"title": "🛠️ Surgical or Injection Considerations", "style": "bold", "blocks": [
+                {"kind": "field", "bind": "InterventionPlan.SurgicalOrInjectionConsiderations.Summary"},
+            ]},
+            {"title": "🔍 Safety Monitoring Plan", "style": "bold", "blocks": [
+                {"kind": "field", "bind": "InterventionPlan.SafetyMonitoring.Summary"},
+            ]},
+            {"title": "Personalized Treatment Context", "style": "h4", "blocks": [
+                {"kind": "field", "label": "Accessibility & Feasibility", "bind": "AccessibilityFeasibility"},
+                {"kind": "field", "label": "Personalization Rationale", "bind": "PersonalizationRationale"},
+                {"kind": "field", "label": "Evidence Compliance", "bind": "EvidenceCompliance"},
+            ]},
+        ],
+    },
+    # 治疗方案智能体（utils/agent_html.py 先把方案 JSON 整理成下面绑定的字段）
+    "exercise_phase": {
+        "default": "",
+        "sections": [
+            {"title": "Phase {index}: {phase}", "style": "h4", "blocks": [
+                {"kind": "field", "label": "GOAL", "bind": "goal"},
+                {"kind": "groups", "bind": "prescriptions", "title": "{category} Training:", "items": "parts"},
+            ]},
+        ],
+    },
+    "guideline_summary": {
+        "default": "",
+        "sections": [
+            {"title": "Clinical Guideline Analysis", "style": "h4", "blocks": []},
+            {"title": "Matched Guidelines Summary", "style": "h4", "blocks": []},
+            {"title": "Guideline {id}: {title}", "style": "bold", "each": "guidelines", "blocks": [
+                {"kind": "field", "label": "Clinical Presentation", "bind": "clinical_presentation"},
+                {"kind": "field", "label": "Physical Findings", "bind": "physical_findings"},
+                {"kind": "field", "label": "Radiographic Features", "bind": "radiographic_features"},
+                {"kind": "list", "label": "Recommendations:", "bind": "appropriateness",
+                 "item": "{procedure}: {rating} ({score}/9)"},
+            ]},
+        ],
+    },
+    "medication_plan": {
+        "default": "",
+        "sections": [
+            {"title": "Pharmacological Management Plan", "style": "h4", "blocks": [
+                {"kind": "records", "bind": "medications",
+                 "columns": ["Medication", "Dosage", "Administration Schedule", "Notes"],
+                 "cells": ["name", "dosage", "frequency", "notes"]},
+                {"kind": "text", "text": "Note: Medication regimen should be tailored based on patient comorbidities, "
+                                         "concomitant medications, and individual response to therapy."},
+            ]},
+        ],
+    },
+    "support_program": {
+        "default": "",
+        "sections": [
+            {"title": "{title}", "style": "h4", "blocks": [
+                {"kind": "field", "label": "Goal", "bind": "goal"},
+                {"kind": "field", "label": "Delivery Method", "bind": "delivery"},
+                {"kind": "list", "label": "Program Structure:", "bind": "structure", "item": "{}"},
+                {"kind": "groups", "label": "{approaches_label}", "bind": "approaches",
+                 "title": "{number}. {title}", "items": "points"},
+                {"kind": "text", "text": "{note}", "style": "note"},
+            ]},
+        ],
+    },
+}
+
+
+# =============================================================================
+# 编译：绑定路径与格式串只解析一次
+# =============================================================================
+def compile_binding(path: str, default: Any) -> Callable[[Dict], Any]:
+    """
+    数据中既有扁平的点号键（predict_params_ori.json），也有嵌套字典（*_plan.json），
+    优先按整键查找，否则逐层下钻。
+    """
+    parts = tuple(path.split("."))
+
+    def access(data: Dict) -> Any:
+        if not path:
+            return data
+        if isinstance(data, dict) and path in data:
+            return data[path]
+        node = data
+        for part in parts:
+            if not isinstance(node, dict) or part not in node:
+                return default
+            node = node[part]
+        return node
+
+    return access
+
+
+def compile_format(fmt: str, default: Any) -> Callable[[Dict], str]:
+    pieces: List[Tuple[str, Optional[Callable]]] = [
+        (literal, compile_binding(field, default) if field is not None else None)
+        for literal, field, _, _ in string.Formatter().parse(fmt)
+    ]
+
+    def render(ctx: Dict) -> str:
+        return "".join(lit + (str(acc(ctx)) if acc else "") for lit, acc in pieces)
+
+    return render
+
+
+class CompiledTemplate:
+    def __init__(self, spec: Dict):
+        self.default = spec.get("default", "")
+        self.sections_from = spec.get("sections_from")
+        self.sections = [self._compile_section(s) for s in spec.get("sections", [])]
+
+    def _compile_section(self, section: Dict) -> Dict:
+        return {
+            "title": compile_format(section["title"], self.default),
+            "style": section.get("style", "plain"),
+            "optional": section.get("optional", False),
+            "each": compile_binding(section["each"], []) if section.get("each") else None,
+            "blocks": [self._compile_block(b) for b in section.get("blocks", [])],
+        }
+
+    def _compile_block(self, block: Dict) -> Dict:
+        kind = block["kind"]
+        compiled = {"kind": kind}
+        if kind == "field":
+            compiled["label"] = block.get("label")
+            compiled["optional"] = block.get("optional", False)
+            compiled["get"] = compile_binding(block["bind"], None if compiled["optional"] else self.default)
+        elif kind == "table":
+            compiled["columns"] = block["columns"]
+            compiled["rows"] = [
+                (row["label"], [compile_binding(b, self.default) for b in row["binds"]])
+                for row in block["rows"]
+            ]
+        elif kind == "records":
+            compiled["get"] = compile_binding(block["bind"], [])
+            compiled["columns"] = block["columns"]
+            compiled["cells"] = [compile_binding(c, self.default) for c in block["cells"]]
+        elif kind == "list":
+            compiled["get"] = compile_binding(block["bind"], [])
+            compiled["item"] = compile_format(block["item"], self.default)
+            compiled["label"] = block.get("label")
+        elif kind == "groups":
+            compiled["get"] = compile_binding(block["bind"], [])
+            compiled["title"] = compile_format(block["title"], self.default)
+            compiled["items"] = compile_binding(block["items"], [])
+            compiled["label"] = compile_format(block.get("label", ""), self.default)
+        elif kind == "text":
+            compiled["text"] = compile_format(block["text"], self.default)
+            compiled["style"] = block.get("style", "plain")
+        elif kind == "dict_items":
+            compiled["get"] = compile_binding(block["bind"], {})
+            compiled["item"] = compile_format(block["item"], self.default)
+            compiled["detail"] = compile_format(block["detail"], self.default) if block.get("detail") else None
+        elif kind == "lines":
+            compiled["get"] = compile_binding(block["bind"], [])
+        else:
+            raise ValueError(f"未知的模板块类型: {kind}")
+        return compiled
+
+    # -------------------------------------------------------------------------
+    # 绑定：得到与输出格式无关的中间结构
+    # -------------------------------------------------------------------------
+    def bind(self, data: Dict) -> List[Dict]:
+        if self.sections_from == "*":
+            return [
+                {"title": title, "style": "plain", "blocks": [{"kind": "lines", "lines": list(lines)}]}
+                for title, lines in data.items()
+            ]
+        bound = []
+        for s in self.sections:
+            for ctx in (s["each"](data) or []) if s["each"] else [data]:
+                blocks = [b for b in (self._bind_block(b, ctx) for b in s["blocks"]) if b is not None]
+                if s["optional"] and not blocks:
+                    continue
+                bound.append({"title": s["title"](ctx), "style": s["style"], "blocks": blocks})
+        return bound
+
+    def _bind_block(self, block: Dict, data: Dict) -> Dict:
+        kind = block["kind"]
+        if kind == "field":
+            value = block["get"](data)
+            if value is None and block["optional"]:
+                return None
+            return {"kind": kind, "label": block["label"], "value": value}
+        if kind == "table":
+            return {
+                "kind": kind,
+                "corner": "",
+                "columns": block["columns"],
+                "rows": [(label, [get(data) for get in getters]) for label, getters in block["rows"]],
+            }
+        if kind == "records":
+            # 与 table 相同的中间结构：首列作为行标签
+            rows = [[cell(record) for cell in block["cells"]] for record in block["get"](data) or []]
+            return {"kind": "table", "corner": block["columns"][0], "columns": block["columns"][1:],
+                    "rows": [(row[0], row[1:]) for row in rows]}
+        if kind == "list":
+            return {"kind": kind, "label": block["label"],
+                    "items": [block["item"](item) for item in block["get"](data) or []]}
+        if kind == "groups":
+            return {"kind": kind, "label": block["label"](data), "groups": [(block["title"](group), list(block["items"](group) or []))
+                                             for group in block["get"](data) or []]}
+        if kind == "text":
+            text = block["text"](data)
+            return {"kind": kind, "text": text, "style": block["style"]} if text else None
+        if kind == "dict_items":
+            items = []
+            for key, value in (block["get"](data) or {}).items():
+                ctx = {"key": key, "value": value}
+                items.append((block["item"](ctx), block["detail"](ctx) if block["detail"] else None))
+            return {"kind": kind, "items": items}
+        return {"kind": kind, "lines": list(block["get"](data) or [])}
+
+    # -------------------------------------------------------------------------
+    # 输出：文本 / HTML / PDF 共用同一份绑定结果
+    # -------------------------------------------------------------------------
+    def render_text(self, data: Dict) -> str:
+        return bound_to_text(self.bind(data))
+
+    def render_html(self, data: Dict) -> str:
+        return bound_to_html(self.bind(data))
+
+    def render_pdf(self, data: Dict) -> bytes:
+        return render_sections_pdf(self.bind(data))
+
+
+def bound_to_text(sections: List[Dict]) -> str:
+    lines = []
+    for section in sections:
+        if section["title"]:
+            lines.append(section["title"])
+        for block in section["blocks"]:
+            kind = block["kind"]
+            if kind == "field":
+                prefix = f"{block['label']}: " if block["label"] else ""
+                lines.append(f"- {prefix}{block['value']}")
+            elif kind == "table":
+                for label, values in block["rows"]:
+                    cells = ", ".join(f"{col}={v}" for col, v in zip(block["columns"], values))
+                    lines.append(f"- {label}:  {cells}")
+            elif kind == "list":
+                if block["label"]:
+                    lines.append(block["label"])
+                lines.extend(f"- {item}" for item in block["items"])
+            elif kind == "groups":
+                if block["label"]:
+                    lines.append(block["label"])
+                for title, items in block["groups"]:
+                    lines.append(title)
+                    lines.extend(f"  - {item}" for item in items)
+            elif kind == "dict_items":
+                for item, detail in block["items"]:
+                    lines.append(f"  - {item}")
+                    if detail:
+                        lines.append(f"    - {detail}")
+            elif kind == "text":
+                lines.append(block["text"])
+            else:
+                lines.extend(block["lines"])
+        lines.append("")
+    return "\n".join(lines)
+
+
+def bound_to_html(sections: List[Dict]) -> str:
+    esc = lambda v: html.escape(str(v))
+    parts = []
+    for section in sections:
+        if not section["title"]:
+            pass
+        elif section["style"] == "h4":
+            parts.append(f"<h4>{esc(section['title'])}</h4>")
+        else:
+            parts.append(f"<p><strong>{esc(section['title'])}</strong></p>")
+        for block in section["blocks"]:
+            kind = block["kind"]
+            if kind == "field":
+                label = f"<strong>{esc(block['label'])}:</strong> " if block["label"] else ""
+                parts.append(f"<ul><li>{label}{esc(block['value'])}</li></ul>")
+            elif kind == "table":
+                head = "".join(f"<th>{esc(c)}</th>" for c in [block["corner"], *block["columns"]])
+                body = "".join(
+                    "<tr>" + "".join(f"<td>{esc(v)}</td>" for v in [label, *values]) + "</tr>"
+                    for label, values in block["rows"]
+                )
+                parts.append(f"<table><thead><tr>{head}</tr></thead><tbody>{body}</tbody></table>")
+            elif kind == "list":
+                if block["label"]:
+                    parts.append(f"<p><strong>{esc(block['label'])}</strong></p>")
+                parts.append("<ul>" + "".join(f"<li>{esc(i)}</li>" for i in block["items"]) + "</ul>")
+            elif kind == "groups":
+                if block["label"]:
+                    parts.append(f"<p><strong>{esc(block['label'])}</strong></p>")
+                for title, items in block["groups"]:
+                    parts.append(f"<p><strong>{esc(title)}</strong></p>")
+                    parts.append("<ul>" + "".join(f"<li>{esc(i)}</li>" for i in items) + "</ul>")
+            elif kind == "text":
+                text = f"<em>{esc(block['text'])}</em>" if block["style"] == "note" else esc(block["text"])
+                parts.append(f"<p>{text}</p>")
+            elif kind == "dict_items":
+                items = "".join(
+                    f"<li><strong>{esc(item)}</strong>"
+                    + (f"<ul><li>{esc(detail)}</li></ul>" if detail else "")
+                    + "</li>"
+                    for item, detail in block["items"]
+                )
+                parts.append(f"<ul>{items}</ul>")
+            else:
+                parts.append("<br>".join(esc(line) for line in block["lines"]))
+    return "\n".join(parts)
+
+
+@lru_cache(maxsize=None)
+def get_template(name: str) -> CompiledTemplate:
+    """按名称编译并缓存模板（每个进程只编译一次）"""
+    return CompiledTemplate(REPORT_TEMPLATES[name])
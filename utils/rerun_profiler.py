@@ -0,0 +1,221 @@
+# utils/rerun_profiler.py
+import argparse
+import hashlib
+import hmac
+import os
+import secrets
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# 开启方式：PROFILE_RERUN=1 对每次 rerun 采样；
+# 或配置 PROFILE_SECRET 后，URL 带 ?profile=<过期时间戳>.<随机数>.<签名>（见 `python -m utils.rerun_profiler sign`）。
+# 签名参数一次性：首次使用后记下随机数，同一进程内再次出现即拒绝；多副本部署时每个进程各能用一次，
+# 过期时间仍是上限。
+PROFILE_ENV = "PROFILE_RERUN"
+PROFILE_SECRET_ENV = "PROFILE_SECRET"
+PROFILE_PARAM = "profile"
+PROFILE_DIR = "profiles"
+SAMPLE_INTERVAL = 0.005
+TRACEMALLOC_FRAMES = 10
+
+
+# =============================================================================
+# 签名查询参数
+# =============================================================================
+def _signature(secret: str, expires: int, nonce: str) -> str:
+    return hmac.new(secret.encode(), f"profile:{expires}:{nonce}".encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def sign_token(secret: str, ttl: int = 3600) -> str:
+    expires = int(time.time()) + ttl
+    nonce = secrets.token_hex(8)
+    return f"{expires}.{nonce}.{_signature(secret, expires, nonce)}"
+
+
+def verify_token(token: Optional[str], secret: Optional[str]) -> bool:
+    """签名与有效期校验（不消耗）"""
+    if not token or not secret or token.count(".") != 2:
+        return False
+    expires, nonce, sig = token.split(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(sig, _signature(secret, int(expires), nonce))
+
+
+# 已使用的随机数 -> 过期时间；过期的条目随后清理，集合大小受有效期内签发的数量限制
+_consumed: Dict[str, int] = {}
+_consumed_lock = threading.Lock()
+
+
+def consume_token(token: Optional[str], secret: Optional[str]) -> bool:
+    """校验通过且本进程内未用过才返回 True，并把它标记为已用"""
+    if not verify_token(token, secret):
+        return False
+    expires, nonce, _ = token.split(".")
+    now = time.time()
+    with _consumed_lock:
+        for stale in [n for n, exp in _consumed.items() if exp < now]:
+            del _consumed[stale]
+        if nonce in _consumed:
+            return False
+        _consumed[nonce] = int(expires)
+    return True
+
+
+def profiling_requested(query_token: Optional[str]) -> bool:
+    if os.getenv(PROFILE_ENV, "").lower() in ("1", "true", "yes"):
+        return True
+    return consume_token(query_token, os.getenv(PROFILE_SECRET_ENV))
+
+
+# =============================================================================
+# 采样器：后台线程定期读取目标线程的调用栈
+# =============================================================================
+class SamplingProfiler:
+    def __init__(self, thread_id: int, root_frame, interval: float = SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.root_frame = root_frame
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rerun-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            # 只保留 root_frame（开启采样的调用方）以内的栈帧
+            while frame is not None and frame is not self.root_frame:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+
+class ProfileResult:
+    def __init__(self, label: str, elapsed: float, stacks: Counter, samples: int,
+                 memory_top: List[Dict], folded_path: str, snapshot_path: str):
+        self.label = label
+        self.elapsed = elapsed
+        self.stacks = stacks
+        self.samples = samples
+        self.memory_top = memory_top
+        self.folded_path = folded_path
+        self.snapshot_path = snapshot_path
+
+    def hotspots(self, n: int = 10) -> List[Dict]:
+        """按自身耗时（栈顶样本数）与累计耗时（出现在栈中的样本数）统计"""
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for f in set(frames):
+                total[f] += count
+        samples = max(1, self.samples)
+        return [
+            {"function": f, "self %": round(100 * c / samples, 1), "total %": round(100 * total[f] / samples, 1)}
+            for f, c in own.most_common(n)
+        ]
+
+
+# tracemalloc 是进程级的；多个会话同时分析时按引用计数启停
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+
+
+def _acquire_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        _tracemalloc_users += 1
+
+
+def _release_tracemalloc() -> tracemalloc.Snapshot:
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        snapshot = tracemalloc.take_snapshot()
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+        return snapshot
+
+
+class RerunProfile:
+    """
+    上下文管理器：采样调用栈并记录 tracemalloc 快照，退出时写入 profiles/：
+      <时间>_<标签>.folded       每行 "f1;f2;f3 次数"，可直接交给 flamegraph.pl / speedscope
+      <时间>_<标签>.tracemalloc  tracemalloc.Snapshot.load() 可读取
+    被包裹代码抛出的异常（包括 Streamlit 的 rerun / stop）照常向上传递，结果仍会保存。
+    """
+
+    def __init__(self, label: str, out_dir: str = PROFILE_DIR, interval: float = SAMPLE_INTERVAL):
+        self.label = "".join(c if c.isalnum() else "_" for c in label)
+        self.out_dir = Path(out_dir)
+        self.interval = interval
+        self.result: Optional[ProfileResult] = None
+
+    def __enter__(self) -> "RerunProfile":
+        _acquire_tracemalloc()
+        self._sampler = SamplingProfiler(threading.get_ident(), sys._getframe(1), self.interval)
+        self._started = time.perf_counter()
+        self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._started
+        self._sampler.stop()
+        snapshot = _release_tracemalloc()
+
+        memory_top = [
+            {"location": f"{Path(stat.traceback[0].filename).name}:{stat.traceback[0].lineno}",
+             "KiB": round(stat.size / 1024, 1), "blocks": stat.count}
+            for stat in snapshot.statistics("lineno")[:10]
+        ]
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        stem = self.out_dir / f"{time.strftime('%Y%m%d-%H%M%S')}_{self.label}"
+        folded_path = f"{stem}.folded"
+        with open(folded_path, "w", encoding="utf-8") as f:
+            for stack, count in self._sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        snapshot_path = f"{stem}.tracemalloc"
+        snapshot.dump(snapshot_path)
+
+        self.result = ProfileResult(self.label, elapsed, self._sampler.stacks, self._sampler.samples,
+                                    memory_top, folded_path, snapshot_path)
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成带签名的 ?profile= 查询参数")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sign = sub.add_parser("sign")
+    sign.add_argument("--ttl", type=int, default=3600, help="有效期（秒）")
+    args = parser.parse_args()
+
+    secret = os.getenv(PROFILE_SECRET_ENV)
+    if not secret:
+        parser.error(f"未设置环境变量 {PROFILE_SECRET_ENV}")
+    if args.cmd == "sign":
+        print(f"?{PROFILE_PARAM}={sign_token(secret, args.ttl)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+# utils/semantic_cache.py
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+
+
+# =============================================================================
+# 本地 CPU 向量化（字符 n-gram + 词哈希，无需模型下载）
+# =============================================================================
+_WORD_RE = re.compile(r"[a-z0-9]+|[\u4e00-\u9fff]")
+_STOPWORDS = {
+    "a", "an", "the", "is", "are", "am", "be", "do", "does", "did", "i", "my", "me",
+    "you", "your", "it", "to", "of", "for", "in", "on", "and", "or", "can", "should",
+    "will", "would", "could", "what", "how", "please", "with", "about", "that", "this",
+}
+
+
+# 语义相近但临床含义不同的关键词：数字（年龄、剂量、天数）、侧别、否定。
+# 相似度再高，这些词不完全一致也不算命中（"left knee" / "right knee"、"take" / "not take"）。
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+_GUARD_WORD_RE = re.compile(r"[a-z]+(?:'t)?|[\u4e00-\u9fff]")
+_LATERALITY = {"left", "right", "bilateral", "both", "左", "右", "双"}
+_NEGATIONS = {
+    "not", "no", "never", "without", "cannot", "none", "nor", "avoid", "stop",
+    "don't", "doesn't", "didn't", "isn't", "aren't", "can't", "won't", "shouldn't",
+    "不", "没", "无", "别", "未", "勿", "非",
+}
+
+
+def guard_tokens(text: str) -> FrozenSet[str]:
+    """必须与缓存问题完全一致的关键词集合"""
+    text = text.lower().replace("’", "'")
+    tokens = {f"n:{float(n):g}" for n in _NUMBER_RE.findall(text)}
+    tokens.update(w for w in _GUARD_WORD_RE.findall(text) if w in _LATERALITY or w in _NEGATIONS)
+    return frozenset(tokens)
+
+
+def _stem(word: str) -> str:
+    """极简词干化，把 improve / improves / improving / improved 归到同一词根"""
+    for suffix in ("ing", "ed", "es", "s", "e"):
+        if len(word) > len(suffix) + 2 and word.endswith(suffix):
+            word = word[:-len(suffix)]
+            break
+    if len(word) > 3 and word[-1] == word[-2] and word[-1] not in "aeiou":
+        word = word[:-1]
+    return word
+
+
+class HashingVectorizer:
+    """词 + 词内字符 n-gram 哈希到固定维度，再做 L2 归一化"""
+
+    def __init__(self, dim: int = 1024, ngram_range: Tuple[int, int] = (3, 4)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def _features(self, text: str) -> List[Tuple[str, float]]:
+        words = [_stem(w) for w in _WORD_RE.findall(text.lower()) if w not in _STOPWORDS]
+        feats = [(f"w:{w}", 1.0) for w in words]
+        # 中文按相邻字二元组补充特征
+        feats.extend((f"b:{a}{b}", 1.0) for a, b in zip(words, words[1:]) if len(a) == len(b) == 1)
+        lo, hi = self.ngram_range
+        for w in words:
+            padded = f"<{w}>"
+            for n in range(lo, hi + 1):
+                feats.extend((f"c:{padded[i:i + n]}", 0.3) for i in range(len(padded) - n + 1))
+        return feats
+
+    def transform(self, text: str) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        feats = self._features(text)
+        if not feats:
+            return vec
+        hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f, _ in feats), dtype=np.uint32, count=len(feats))
+        weights = np.fromiter((w for _, w in feats), dtype=np.float32, count=len(feats))
+        idx = (hashes % self.dim).astype(np.int64)
+        # 用哈希的最高位决定符号，减少碰撞带来的偏差
+        signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+        np.add.at(vec, idx, signs * weights)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+
+# =============================================================================
+# 语义缓存：随机超平面 LSH 近似近邻 + LRU 有界淘汰
+# =============================================================================
+class SemanticCache:
+    def __init__(self,
+                 max_entries: int = 2048,
+                 threshold: float = 0.92,
+                 dim: int = 1024,
+                 num_tables: int = 16,
+                 num_bits: int = 8,
+                 seed: int = 42):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.vectorizer = HashingVectorizer(dim=dim)
+
+        rng = np.random.default_rng(seed)
+        self._planes = rng.standard_normal((num_tables, num_bits, dim)).astype(np.float32)
+        self._bit_weights = (1 << np.arange(num_bits)).astype(np.int64)
+        self._tables: List[Dict[int, set]] = [dict() for _ in range(num_tables)]
+
+        # 预分配向量矩阵，槽位复用，内存上限固定
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        # slot -> (app_id, 答案, LSH 签名, 关键词集合)
+        self._entries: "OrderedDict[int, Tuple[str, str, Tuple[int, ...], FrozenSet[str]]]" = OrderedDict()
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lookup_seconds = 0.0
+        self.last_lookup_ms = 0.0
+
+    def _signatures(self, vec: np.ndarray) -> Tuple[int, ...]:
+        bits = (np.einsum("tbd,d->tb", self._planes, vec) > 0).astype(np.int64)
+        return tuple(int(s) for s in bits @ self._bit_weights)
+
+    def _bucket_key(self, app_id: str, signature: int) -> Tuple[str, int]:
+        return (app_id, signature)
+
+    def lookup(self, prompt: str, app_id: str = "") -> Optional[str]:
+        """
+        命中返回缓存答案，否则返回 None。
+        命中要求余弦相似度 ≥ threshold，且数字 / 侧别 / 否定词与缓存问题完全一致。
+        """
+        start = time.perf_counter()
+        vec = self.vectorizer.transform(prompt)
+        guard = guard_tokens(prompt)
+        sigs = self._signatures(vec)
+        answer = None
+        with self._lock:
+            candidates = set()
+            for table, sig in zip(self._tables, sigs):
+                candidates |= table.get(self._bucket_key(app_id, sig), set())
+            candidates = [slot for slot in candidates if self._entries[slot][3] == guard]
+            if candidates:
+                slots = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+                sims = self._vectors[slots] @ vec
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    slot = int(slots[best])
+                    self._entries.move_to_end(slot)
+                    answer = self._entries[slot][1]
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            elapsed = time.perf_counter() - start
+            self._lookup_seconds += elapsed
+            self.last_lookup_ms = elapsed * 1000
+        return answer
+
+    def add(self, prompt: str, answer: str, app_id: str = ""):
+        vec = self.vectorizer.transform(prompt)
+        sigs = self._signatures(vec)
+        with self._lock:
+            if not self._free_slots:
+                self._evict_oldest()
+            slot = self._free_slots.pop()
+            self._vectors[slot] = vec
+            self._entries[slot] = (app_id, answer, sigs, guard_tokens(prompt))
+            for table, sig in zip(self._tables, sigs):
+                table.setdefault(self._bucket_key(app_id, sig), set()).add(slot)
+
+    def _evict_oldest(self):
+        slot, (app_id, _, sigs, _) = self._entries.popitem(last=False)
+        for table, sig in zip(self._tables, sigs):
+            key = self._bucket_key(app_id, sig)
+            bucket = table.get(key)
+            if bucket is not None:
+                bucket.discard(slot)
+                if not bucket:
+                    del table[key]
+        self._free_slots.append(slot)
+        self.evictions += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "avg_lookup_ms": self._lookup_seconds * 1000 / lookups if lookups else 0.0,
+                "last_lookup_ms": self.last_lookup_ms,
+            }
@@ -0,0 +1,232 @@
+# utils/session_store.py
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import streamlit as st
+
+# 会话持久化：URL 带 ?sid=...，任意副本（进程）都能据此恢复该会话的进度。
+# SESSION_STORE 选择后端，如 "sqlite:///sessions.db"（相对路径）或 "sqlite:////data/sessions.db"（绝对路径）；
+# 多副本需共享同一文件（同机或共享卷）。
+SESSION_STORE_ENV = "SESSION_STORE"
+SESSION_DB_FILE = "sessions.db"
+SESSION_PARAM = "sid"
+SESSION_TTL_DAYS = 7
+COMPACT_THRESHOLD = 200
+_SID_RE = re.compile(r"[0-9a-f]{32}")
+
+log = logging.getLogger("kom.session")
+
+# 需要跨副本保留的 session_state 键；其余（计时、缓存对象等）都可由它们重新得到
+PERSISTED_KEYS = (
+    "chat_history",
+    "chat_step",
+    "prediction_done",
+    "start_clicked",
+    "selected_image_path",
+    "selected_image_label",
+)
+
+# 增量操作：set 覆盖整个值；append 在列表末尾追加一个元素
+OP_SET = "set"
+OP_APPEND = "append"
+
+Event = Tuple[str, str, Any]
+
+
+def replay(events: Iterable[Event]) -> Dict[str, Any]:
+    """按写入顺序回放增量，得到各键的当前值"""
+    state: Dict[str, Any] = {}
+    for key, op, value in events:
+        if op == OP_APPEND and isinstance(state.get(key), list):
+            state[key].append(value)
+        elif op == OP_APPEND:
+            state[key] = [value]
+        else:
+            state[key] = value
+    return state
+
+
+def diff(old: Dict[str, Any], new: Dict[str, Any]) -> List[Event]:
+    """与上次写入的值比较，只生成变化部分；列表只在末尾增长时写 append"""
+    events: List[Event] = []
+    for key, value in new.items():
+        if key not in old:
+            events.append((key, OP_SET, value))
+            continue
+        prev = old[key]
+        if isinstance(prev, list) and isinstance(value, list) \
+                and len(value) > len(prev) and value[:len(prev)] == prev:
+            events.extend((key, OP_APPEND, item) for item in value[len(prev):])
+        elif value != prev:
+            events.append((key, OP_SET, value))
+    return events
+
+
+# =============================================================================
+# 存储后端
+# =============================================================================
+class SessionStore(ABC):
+    """会话存储后端接口：只追加增量，恢复时回放"""
+
+    @abstractmethod
+    def append_events(self, sid: str, events: List[Event]):
+        ...
+
+    @abstractmethod
+    def load(self, sid: str, keys: Iterable[str]) -> Dict[str, Any]:
+        ...
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS session_events (
+    seq   INTEGER PRIMARY KEY AUTOINCREMENT,
+    sid   TEXT NOT NULL,
+    key   TEXT NOT NULL,
+    op    TEXT NOT NULL,
+    value TEXT NOT NULL,
+    ts    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_session_events_sid ON session_events(sid, seq);
+CREATE INDEX IF NOT EXISTS idx_session_events_ts ON session_events(ts);
+"""
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite（WAL 模式）后端，多个进程可同时读写同一文件。
+    每次 rerun 只插入变化的键（聊天记录只追加新消息）；某会话增量过多时，恢复时压缩为每键一条快照。
+    """
+
+    def __init__(self, db_path: str = SESSION_DB_FILE, ttl_days: float = SESSION_TTL_DAYS):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self.conn as conn:
+            conn.executescript(SCHEMA)
+            conn.execute("DELETE FROM session_events WHERE ts < ?", (time.time() - ttl_days * 86400,))
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def append_events(self, sid: str, events: List[Event]):
+        if not events:
+            return
+        now = time.time()
+        with self.conn as conn:
+            conn.executemany(
+                "INSERT INTO session_events (sid, key, op, value, ts) VALUES (?, ?, ?, ?, ?)",
+                [(sid, key, op, json.dumps(value, ensure_ascii=False), now) for key, op, value in events],
+            )
+
+    def load(self, sid: str, keys: Iterable[str]) -> Dict[str, Any]:
+        keys = list(keys)
+        rows = self.conn.execute(
+            f"SELECT seq, key, op, value FROM session_events "
+            f"WHERE sid = ? AND key IN ({','.join('?' * len(keys))}) ORDER BY seq",
+            (sid, *keys),
+        ).fetchall()
+        state = replay((key, op, json.loads(value)) for _, key, op, value in rows)
+        if len(rows) > COMPACT_THRESHOLD:
+            self._compact(sid, state, max_seq=rows[-1][0])
+        return state
+
+    def _compact(self, sid: str, state: Dict[str, Any], max_seq: int):
+        """同一事务内删除已回放的增量并写入快照；读取之后其他副本追加的增量（seq 更大）保留"""
+        now = time.time()
+        with self.conn as conn:
+            conn.executemany(
+                "DELETE FROM session_events WHERE sid = ? AND key = ? AND seq <= ?",
+                [(sid, key, max_seq) for key in state],
+            )
+            conn.executemany(
+                "INSERT INTO session_events (sid, key, op, value, ts) VALUES (?, ?, ?, ?, ?)",
+                [(sid, key, OP_SET, json.dumps(value, ensure_ascii=False), now)
+                 for key, value in state.items()],
+            )
+
+
+BACKENDS = {"sqlite": SQLiteSessionStore}
+
+
+def open_session_store(url: Optional[str] = None) -> SessionStore:
+    url = url or os.getenv(SESSION_STORE_ENV) or f"sqlite:///{SESSION_DB_FILE}"
+    scheme, _, path = url.partition("://")
+    if scheme not in BACKENDS:
+        raise ValueError(f"未知的会话存储后端: {scheme}")
+    # 与 SQLAlchemy 相同：sqlite:///相对路径，sqlite:////绝对路径
+    return BACKENDS[scheme](path[1:] if path.startswith("/") else path)
+
+
+# =============================================================================
+# 与 st.session_state 同步
+# =============================================================================
+class SessionSync:
+    """
+    每个 Streamlit 会话一个：恢复时只读取本会话的键，之后每次 rerun 结束写入变化的增量。
+    persisted 保存上次写入值的副本（session_state 中的列表会被原地修改，不能只存引用）。
+    """
+
+    def __init__(self, store: SessionStore, sid: str, keys: Iterable[str] = PERSISTED_KEYS):
+        self.store = store
+        self.sid = sid
+        self.keys = tuple(keys)
+        self.persisted: Dict[str, Any] = {}
+
+    def restore(self):
+        state = self.store.load(self.sid, self.keys)
+        for key, value in state.items():
+            if key not in st.session_state:
+                st.session_state[key] = value
+        self.persisted = _copy(state)
+
+    def flush(self):
+        current = {key: st.session_state[key] for key in self.keys if key in st.session_state}
+        events = diff(self.persisted, current)
+        if not events:
+            return
+        try:
+            self.store.append_events(self.sid, events)
+        except sqlite3.Error:
+            # 写失败不影响页面；persisted 不更新，下次 rerun 重新比较并补写
+            log.warning("session flush failed", exc_info=True, extra={"sid": self.sid})
+            return
+        self.persisted.update(_copy({key: current[key] for key, _, _ in events}))
+
+
+def _copy(state: Dict[str, Any]) -> Dict[str, Any]:
+    return json.loads(json.dumps(state, ensure_ascii=False))
+
+
+def attach_session(store: Optional[SessionStore]) -> Optional[SessionSync]:
+    """
+    取得当前会话的同步器。首次 rerun 时：URL 已带 sid 说明是恢复（换了副本、刷新或导航），
+    此时才读取存储；否则分配新的 sid 写回 URL。
+    """
+    if store is None:
+        return None
+    sync = st.session_state.get("_session_sync")
+    if sync is None:
+        sid = st.query_params.get(SESSION_PARAM)
+        if sid and not _SID_RE.fullmatch(sid):
+            sid = None
+        sync = SessionSync(store, sid or uuid.uuid4().hex)
+        if sid:
+            sync.restore()
+        else:
+            st.query_params[SESSION_PARAM] = sync.sid
+        st.session_state["_session_sync"] = sync
+    return sync
@@ -0,0 +1,74 @@
+# utils/static_assets.py
+import base64
+import hashlib
+import html
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+import streamlit as st
+
+# Streamlit 在 server.enableStaticServing = true 时以 app/static/ 提供该目录（见 .streamlit/config.toml）
+STATIC_DIR = Path(__file__).resolve().parent.parent / "static"
+STATIC_URL_PREFIX = "app/static"
+
+STYLESHEET = "css/kom.css"
+ICON_SPRITE = "icons.svg"
+LOGO = "img/logo.jpg"
+
+
+@lru_cache(maxsize=None)
+def asset_version(rel_path: str) -> str:
+    """内容哈希作为版本号：文件不变则 URL 不变，浏览器可一直复用缓存"""
+    return hashlib.sha256((STATIC_DIR / rel_path).read_bytes()).hexdigest()[:12]
+
+
+def asset_url(rel_path: str) -> str:
+    return f"{STATIC_URL_PREFIX}/{rel_path}?v={asset_version(rel_path)}"
+
+
+def static_serving_enabled() -> bool:
+    return bool(st.get_option("server.enableStaticServing")) and STATIC_DIR.is_dir()
+
+
+@lru_cache(maxsize=None)
+def _inline_stylesheet() -> str:
+    return f"<style>{(STATIC_DIR / STYLESHEET).read_text(encoding='utf-8')}</style>"
+
+
+def stylesheet_tag() -> str:
+    """
+    一个带版本号的 <link>；未开启静态服务（例如从其他目录启动、未读到 config.toml）时
+    退回内联样式，保证页面样式完整。
+    """
+    if static_serving_enabled():
+        return f'<link rel="stylesheet" href="{asset_url(STYLESHEET)}">'
+    return _inline_stylesheet()
+
+
+@lru_cache(maxsize=None)
+def _inline_sprite() -> str:
+    return (STATIC_DIR / ICON_SPRITE).read_text(encoding="utf-8")
+
+
+def sprite_tag() -> str:
+    """静态服务可用时 sprite 由浏览器单独缓存，这里无需输出；否则内联一次"""
+    return "" if static_serving_enabled() else _inline_sprite()
+
+
+def icon(name: str) -> str:
+    """引用 SVG sprite 中的 <symbol>（同源，无需外网）"""
+    href = f"{asset_url(ICON_SPRITE)}#{name}" if static_serving_enabled() else f"#{name}"
+    return f'<svg aria-hidden="true"><use href="{html.escape(href)}"></use></svg>'
+
+
+@lru_cache(maxsize=None)
+def logo_data_uri() -> str:
+    return "data:image/jpeg;base64," + base64.b64encode((STATIC_DIR / LOGO).read_bytes()).decode()
+
+
+def logo_src(prebuilt: Optional[str] = None) -> str:
+    """prebuilt 为预构建产物中已编码好的 data URI（见 utils/build_artifacts.py）"""
+    if static_serving_enabled():
+        return asset_url(LOGO)
+    return prebuilt or logo_data_uri()
@@ -0,0 +1,182 @@
+# utils/structured_log.py
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+# 环境变量：
+#   LOG_LEVEL   默认 INFO
+#   LOG_FILE    JSON Lines 输出文件，缺省写 stderr
+#   LOG_SAMPLE  热点日志采样率，如 "kom.chat.render=0.05,kom.qwen=1"
+LOG_LEVEL_ENV = "LOG_LEVEL"
+LOG_FILE_ENV = "LOG_FILE"
+LOG_SAMPLE_ENV = "LOG_SAMPLE"
+
+ROOT_LOGGER = "kom"
+DEFAULT_SAMPLE_RATES: Dict[str, float] = {"kom.chat.render": 0.05}
+QUEUE_SIZE = 10000
+BATCH_SIZE = 256
+FLUSH_INTERVAL = 0.5
+
+# LogRecord 自带属性；其余 extra 字段原样写入 JSON
+_RESERVED = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+
+_context = threading.local()
+
+
+def begin_rerun(session_id: Optional[str]) -> str:
+    """每次 rerun 开始时调用（脚本线程），之后该线程的日志都带上会话与 rerun 编号"""
+    _context.session = session_id
+    _context.rerun = uuid.uuid4().hex[:8]
+    return _context.rerun
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.session = getattr(_context, "session", None)
+        record.rerun = getattr(_context, "rerun", None)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """按 logger 名前缀采样；WARNING 及以上从不丢弃"""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        # 最长前缀优先
+        self.rates = sorted(rates.items(), key=lambda kv: len(kv[0]), reverse=True)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        for prefix, rate in self.rates:
+            if record.name == prefix or record.name.startswith(prefix + "."):
+                if rate >= 1:
+                    return True
+                record.sample_rate = rate
+                return random.random() < rate
+        return True
+
+
+def format_record(record: logging.LogRecord) -> str:
+    entry = {
+        "ts": round(record.created, 3),
+        "level": record.levelname,
+        "logger": record.name,
+        "msg": record.getMessage(),
+        "session": getattr(record, "session", None),
+        "rerun": getattr(record, "rerun", None),
+    }
+    for key, value in record.__dict__.items():
+        if key not in _RESERVED and key not in entry:
+            entry[key] = value
+    if record.exc_info:
+        entry["exc"] = logging.Formatter().formatException(record.exc_info)
+    return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class BatchingQueueHandler(logging.Handler):
+    """
+    emit 只把记录放进有界队列（队列满则丢弃并计数），不做任何 IO；
+    后台线程按批（最多 BATCH_SIZE 条或每 FLUSH_INTERVAL 秒）格式化并一次性写出。
+    """
+
+    def __init__(self, stream, queue_size: int = QUEUE_SIZE,
+                 batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        super().__init__()
+        self.stream = stream
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._writer = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._writer.start()
+
+    def emit(self, record: logging.LogRecord):
+        # 在调用线程里先把参数合并进消息，避免后台线程引用可变对象
+        record.msg = record.getMessage()
+        record.args = None
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch: List[logging.LogRecord] = [first]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch: List[logging.LogRecord]):
+        lines = []
+        for record in batch:
+            try:
+                lines.append(format_record(record))
+            except Exception:
+                self.dropped += 1
+        if self.dropped:
+            lines.append(json.dumps({"ts": round(time.time(), 3), "level": "WARNING",
+                                     "logger": ROOT_LOGGER, "msg": "log records dropped",
+                                     "dropped": self.dropped}))
+            self.dropped = 0
+        try:
+            self.stream.write("\n".join(lines) + "\n")
+            self.stream.flush()
+        except Exception:
+            pass
+
+    def close(self):
+        self._stop.set()
+        self._writer.join(timeout=2)
+        super().close()
+
+
+_setup_lock = threading.Lock()
+_handler: Optional[BatchingQueueHandler] = None
+
+
+def _parse_sample_rates(spec: str) -> Dict[str, float]:
+    rates = dict(DEFAULT_SAMPLE_RATES)
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, rate = item.partition("=")
+        try:
+            rates[name.strip()] = float(rate)
+        except ValueError:
+            continue
+    return rates
+
+
+def setup_logging() -> logging.Logger:
+    """幂等：每个进程只创建一个后台写线程"""
+    global _handler
+    root = logging.getLogger(ROOT_LOGGER)
+    with _setup_lock:
+        if _handler is not None:
+            return root
+        log_file = os.getenv(LOG_FILE_ENV)
+        stream = open(log_file, "a", encoding="utf-8", buffering=1 << 16) if log_file else sys.stderr
+        _handler = BatchingQueueHandler(stream)
+        # 过滤器挂在 handler 上（logger 上的过滤器不作用于子 logger 的记录），在调用线程中执行
+        _handler.addFilter(SamplingFilter(_parse_sample_rates(os.getenv(LOG_SAMPLE_ENV, ""))))
+        _handler.addFilter(ContextFilter())
+        root.addHandler(_handler)
+        root.setLevel(os.getenv(LOG_LEVEL_ENV, "INFO").upper())
+        root.propagate = False
+        atexit.register(_handler.close)
+    return root
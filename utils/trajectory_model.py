@@ -0,0 +1,114 @@
+# utils/trajectory_model.py
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 模型输入特征（与 predict_params.json 字段同名）
+FEATURES: Tuple[str, ...] = (
+    "AGE", "BMI", "WEIGHT",
+    "KOOSPain_R", "KOOSSym_R", "KOOSPain_L", "KOOSSym_L", "KOOSSport", "KOOSQOL",
+    "XRKL_R", "XRKL_L",
+    "RFmaxF", "LFmaxF",
+)
+
+# 预测的 KOOS 指标：(predict_params_ori.json 中的路径, 对应基线特征, 显示名称, 膝侧)
+# 运动功能与生活质量不分侧（膝侧为 None），以指数膝（右膝）为主
+OUTPUT_METRICS: Tuple[Tuple[str, str, str, Optional[str]], ...] = (
+    ("right_knee.pain", "KOOSPain_R", "Right Knee Pain", "R"),
+    ("right_knee.symptoms", "KOOSSym_R", "Right Knee Symptoms", "R"),
+    ("left_knee.pain", "KOOSPain_L", "Left Knee Pain", "L"),
+    ("left_knee.symptoms", "KOOSSym_L", "Left Knee Symptoms", "L"),
+    ("right_knee.sport_recreation_function", "KOOSSport", "Sport/Recreation Function", None),
+    ("right_knee.quality_of_life", "KOOSQOL", "Quality of Life", None),
+)
+HORIZONS: Tuple[Tuple[str, str], ...] = (("v01", "Year 2"), ("v04", "Year 4"))
+
+OUTPUTS: Tuple[str, ...] = tuple(
+    f"symptom_trajectory.{metric}.{visit}" for metric, _, _, _ in OUTPUT_METRICS for visit, _ in HORIZONS
+)
+
+# what-if 可调范围
+FEATURE_RANGES: Dict[str, Tuple[float, float]] = {
+    "AGE": (40, 90), "BMI": (18, 45), "WEIGHT": (40, 150),
+    "KOOSPain_R": (0, 100), "KOOSSym_R": (0, 100), "KOOSPain_L": (0, 100), "KOOSSym_L": (0, 100),
+    "KOOSSport": (0, 100), "KOOSQOL": (0, 100),
+    "XRKL_R": (0, 4), "XRKL_L": (0, 4),
+    "RFmaxF": (0.1, 1.5), "LFmaxF": (0.1, 1.5),
+}
+
+
+class TrajectoryModel:
+    """
+    线性 KOOS 轨迹模型：y = clip(y_ref + (x - x_ref) @ coef, 0, 100)。
+    由训练作业拟合后以 save_model 发布到模型注册表；fitted 取自元数据，
+    未注明 fitted 的版本（如早先发布的人工设定系数）不用于预测。
+    所有打分都走矩阵运算，一次调用可给整张网格或整个队列打分。
+    """
+
+    ARTIFACT_NAME = "trajectory"
+
+    def __init__(self, coef: np.ndarray, x_ref: np.ndarray, y_ref: np.ndarray,
+                 features: Sequence[str] = FEATURES, outputs: Sequence[str] = OUTPUTS,
+                 version: str = "reference", fitted: bool = False):
+        self.version = version
+        self.fitted = fitted
+        self.features = tuple(features)
+        self.outputs = tuple(outputs)
+        self.coef = coef
+        self.x_ref = x_ref
+        self.y_ref = y_ref
+        self._index = {name: i for i, name in enumerate(self.features)}
+
+    def to_artifact(self) -> Tuple[Dict[str, np.ndarray], Dict]:
+        """导出为模型注册表中的数组与元数据"""
+        arrays = {"coef": self.coef, "x_ref": self.x_ref, "y_ref": self.y_ref}
+        return arrays, {"features": list(self.features), "outputs": list(self.outputs), "fitted": self.fitted}
+
+    @classmethod
+    def from_artifact(cls, artifact) -> "TrajectoryModel":
+        """由注册表中的内存映射数组构建（不复制数组）；元数据未注明 fitted 的版本视为示意模型"""
+        return cls(artifact["coef"], artifact["x_ref"], artifact["y_ref"],
+                   features=artifact.meta["features"], outputs=artifact.meta["outputs"],
+                   version=artifact.version, fitted=artifact.meta.get("fitted") is True)
+
+    def encode(self, records: Sequence[Dict]) -> np.ndarray:
+        """(n, n_features)；缺失或非数值字段取参考值（即不贡献偏移）"""
+        X = np.tile(self.x_ref, (len(records), 1))
+        for i, record in enumerate(records):
+            for j, name in enumerate(self.features):
+                value = _number(record.get(name), None)
+                if value is not None:
+                    X[i, j] = value
+        return X
+
+    def predict_batch(self, X: np.ndarray) -> np.ndarray:
+        """X: (n, n_features) -> (n, n_outputs)"""
+        return np.clip(self.y_ref + (X - self.x_ref) @ self.coef, 0, 100)
+
+    def predict(self, features: Dict) -> Dict[str, float]:
+        y = self.predict_batch(self.encode([features]))[0]
+        return dict(zip(self.outputs, y.tolist()))
+
+    def sweep(self, base: Dict, axes: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        在 base 上同时改变 1~2 个特征，返回形状 (len(axis1)[, len(axis2)], n_outputs) 的预测；
+        整张网格一次 predict_batch。
+        """
+        mesh = np.meshgrid(*axes.values(), indexing="ij")
+        X = np.repeat(self.encode([base]), mesh[0].size, axis=0)
+        for name, values in zip(axes, mesh):
+            X[:, self._index[name]] = values.ravel()
+        return self.predict_batch(X).reshape(*mesh[0].shape, len(self.outputs))
+
+    def output_index(self, metric: str, visit: str) -> int:
+        return self.outputs.index(f"symptom_trajectory.{metric}.{visit}")
+
+
+def _number(value, default: Optional[float]) -> Optional[float]:
+    """数值或可解析为数值的字符串（CSV）；其余取 default"""
+    if isinstance(value, bool) or value is None:
+        return default
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,276 @@
+# utils/visit_store.py
+import argparse
+import datetime as dt
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from utils.koos import load_cohort
+from utils.model_registry import MODEL_DIR, MODEL_DIR_ENV, ModelRegistry
+from utils.trajectory_model import HORIZONS, OUTPUT_METRICS, TrajectoryModel
+
+VISIT_DB_FILE = "visits.db"
+
+# 随访编号与基线后的年数（与 HORIZONS 的 "Year 2" / "Year 4" 一致）
+VISIT_YEARS = {"V00": 0, "V01": 2, "V04": 4}
+OBSERVED = "observed"
+PREDICTED = "predicted"
+# 早先由人工设定系数的示意模型记录的预测（source = 'reference'）；记录只追加不删除，对照与曲线中跳过
+UNFITTED_SOURCES = ("reference",)
+# 观测与预测对照的指标：KOOS 分量表，字段名同 predict_params.json
+TRACKED_METRICS: Tuple[Tuple[str, str], ...] = tuple((baseline, label) for _, baseline, label, _ in OUTPUT_METRICS)
+
+# 主键以 (patient_id, visit_date) 开头且 WITHOUT ROWID：同一患者的全部记录在 B 树中按时间连续存放，
+# 读取病史只是一次主键范围扫描；idx_visits_date 支撑跨患者的时间范围查询。
+# 记录只追加不修改：新随访是新行，已有随访不会被改写。
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS visits (
+    patient_id TEXT NOT NULL,
+    visit_date TEXT NOT NULL,
+    visit      TEXT NOT NULL,
+    kind       TEXT NOT NULL,
+    source     TEXT NOT NULL DEFAULT '',
+    recorded   REAL NOT NULL,
+    features   TEXT NOT NULL,
+    PRIMARY KEY (patient_id, visit_date, kind, source, visit)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_visits_date ON visits(visit_date, kind);
+"""
+
+DateLike = Union[str, dt.date]
+
+
+def _iso(value: DateLike) -> str:
+    if isinstance(value, dt.datetime):
+        value = value.date()
+    if isinstance(value, dt.date):
+        return value.isoformat()
+    return dt.date.fromisoformat(str(value).strip()[:10]).isoformat()
+
+
+def _add_years(value: DateLike, years: int) -> str:
+    day = dt.date.fromisoformat(_iso(value))
+    try:
+        return day.replace(year=day.year + years).isoformat()
+    except ValueError:  # 2 月 29 日
+        return day.replace(year=day.year + years, day=28).isoformat()
+
+
+class VisitStore:
+    """纵向随访库：SQLite（WAL 模式），按 (患者, 随访日期) 组织观测与模型预测"""
+
+    def __init__(self, db_path: str = VISIT_DB_FILE):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self.conn as conn:
+            conn.executescript(SCHEMA)
+
+    # -------------------------------------------------------------------------
+    # 连接管理：每个线程（Streamlit 会话）一条连接
+    # -------------------------------------------------------------------------
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # -------------------------------------------------------------------------
+    # 追加
+    # -------------------------------------------------------------------------
+    def add_visit(self, patient_id: str, visit: str, visit_date: DateLike, features: Dict):
+        """追加一次观测随访；同一患者同一天同一随访已存在时报错，不覆盖历史"""
+        try:
+            with self.conn as conn:
+                _insert(conn, str(patient_id), visit, _iso(visit_date), OBSERVED, "", features)
+        except sqlite3.IntegrityError:
+            raise ValueError(f"随访已存在: {patient_id} {visit} {_iso(visit_date)}") from None
+
+    def import_visits(self, records: Iterable[Dict]) -> int:
+        """批量导入（一个事务）；已存在的随访跳过，可重复导入。返回新增行数"""
+        added = 0
+        with self.conn as conn:
+            for record in records:
+                # CSV 中的数值列按数值存，其余（如影像分级文字）原样保留
+                features = {k: _value(v) for k, v in record.items()
+                            if k not in ("patient_id", "visit", "visit_date") and v not in (None, "")}
+                added += _insert(conn, str(record["patient_id"]), record["visit"], _iso(record["visit_date"]),
+                                 OBSERVED, "", features, ignore=True)
+        return added
+
+    def record_prediction(self, patient_id: str, baseline_date: DateLike, prediction: Dict[str, float],
+                          model_version: str) -> int:
+        """
+        把一次预测（TrajectoryModel 输出，键为 symptom_trajectory.<指标>.<随访>）按随访拆成
+        predicted 行，日期为基线日期加随访年数；同一模型版本对同一基线只记一次。返回新增行数。
+        """
+        added = 0
+        with self.conn as conn:
+            for visit, _ in HORIZONS:
+                code = visit.upper()
+                features = {baseline: prediction[f"symptom_trajectory.{path}.{visit}"]
+                            for path, baseline, _, _ in OUTPUT_METRICS
+                            if f"symptom_trajectory.{path}.{visit}" in prediction}
+                added += _insert(conn, str(patient_id), code, _add_years(baseline_date, VISIT_YEARS[code]),
+                                 PREDICTED, model_version, features, ignore=True)
+        return added
+
+    # -------------------------------------------------------------------------
+    # 查询
+    # -------------------------------------------------------------------------
+    def history(self, patient_id: str, kind: Optional[str] = None) -> List[Dict]:
+        """某患者的全部记录，按随访日期排序；一次主键范围读取"""
+        sql = "SELECT * FROM visits WHERE patient_id = ?"
+        args: List = [str(patient_id)]
+        if kind:
+            sql += " AND kind = ?"
+            args.append(kind)
+        return [_row(r) for r in self.conn.execute(sql + " ORDER BY visit_date, kind, source", args)]
+
+    def visits_between(self, start: DateLike, end: DateLike, kind: str = OBSERVED,
+                       limit: int = 1000) -> List[Dict]:
+        """日期闭区间内的记录（跨患者），走 idx_visits_date"""
+        rows = self.conn.execute(
+            "SELECT * FROM visits WHERE visit_date BETWEEN ? AND ? AND kind = ? "
+            "ORDER BY visit_date, patient_id LIMIT ?",
+            (_iso(start), _iso(end), kind, limit),
+        )
+        return [_row(r) for r in rows]
+
+    def latest_baseline(self, patient_id: str) -> Optional[Dict]:
+        row = self.conn.execute(
+            "SELECT * FROM visits WHERE patient_id = ? AND kind = ? AND visit = 'V00' "
+            "ORDER BY visit_date DESC LIMIT 1",
+            (str(patient_id), OBSERVED),
+        ).fetchone()
+        return None if row is None else _row(row)
+
+    def patients(self, limit: int = 500) -> List[str]:
+        return [r["patient_id"] for r in self.conn.execute(
+            "SELECT DISTINCT patient_id FROM visits ORDER BY patient_id LIMIT ?", (limit,))]
+
+    def is_empty(self) -> bool:
+        return self.conn.execute("SELECT 1 FROM visits LIMIT 1").fetchone() is None
+
+
+def _insert(conn: sqlite3.Connection, patient_id: str, visit: str, visit_date: str, kind: str,
+            source: str, features: Dict, ignore: bool = False) -> int:
+    verb = "INSERT OR IGNORE" if ignore else "INSERT"
+    return conn.execute(
+        f"{verb} INTO visits (patient_id, visit_date, visit, kind, source, recorded, features) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (patient_id, visit_date, visit.upper(), kind, source, time.time(),
+         json.dumps(features, ensure_ascii=False, default=float)),
+    ).rowcount
+
+
+def _value(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def _row(row: sqlite3.Row) -> Dict:
+    return {
+        "patient_id": row["patient_id"],
+        "visit": row["visit"],
+        "visit_date": row["visit_date"],
+        "kind": row["kind"],
+        "source": row["source"],
+        "recorded": row["recorded"],
+        "features": json.loads(row["features"]),
+    }
+
+
+# =============================================================================
+# 观测 / 预测对照
+# =============================================================================
+def trajectory_rows(history: Sequence[Dict], metrics: Sequence[Tuple[str, str]] = TRACKED_METRICS) -> List[Dict]:
+    """长表（每行一个 指标 × 记录），可直接交给 altair 按 kind 区分线型叠加"""
+    rows = []
+    for record in history:
+        if record["kind"] == PREDICTED and record["source"] in UNFITTED_SOURCES:
+            continue
+        for key, label in metrics:
+            value = record["features"].get(key)
+            if isinstance(value, (int, float)):
+                rows.append({"visit": record["visit"], "visit_date": record["visit_date"],
+                             "kind": record["kind"], "source": record["source"],
+                             "metric": label, "value": float(value)})
+    return rows
+
+
+def compare(history: Sequence[Dict], model_version: Optional[str] = None,
+            metrics: Sequence[Tuple[str, str]] = TRACKED_METRICS) -> List[Dict]:
+    """
+    同一随访编号上观测值与预测值配对，error = 观测 - 预测。
+    model_version 缺省时取写入时间（recorded）最晚的预测所属版本；
+    history 按日期与版本名排序，末行不一定是最近记录的。
+    """
+    predictions = [r for r in history if r["kind"] == PREDICTED and r["source"] not in UNFITTED_SOURCES]
+    if model_version is None and predictions:
+        model_version = max(predictions, key=lambda r: r["recorded"])["source"]
+    predicted = {r["visit"]: r["features"] for r in predictions if r["source"] == model_version}
+    rows = []
+    for record in history:
+        if record["kind"] != OBSERVED or record["visit"] not in predicted:
+            continue
+        for key, label in metrics:
+            observed, expected = record["features"].get(key), predicted[record["visit"]].get(key)
+            if isinstance(observed, (int, float)) and isinstance(expected, (int, float)):
+                rows.append({"visit": record["visit"], "visit_date": record["visit_date"], "metric": label,
+                             "observed": float(observed), "predicted": round(float(expected), 1),
+                             "error": round(float(observed) - float(expected), 1)})
+    return rows
+
+
+def predict_baselines(store: VisitStore, model: TrajectoryModel, patient_ids: Sequence[str]) -> int:
+    """为有基线（V00）观测的患者批量记录当前模型的预测；一次 predict_batch。返回新增行数"""
+    baselines = [b for b in (store.latest_baseline(pid) for pid in patient_ids) if b is not None]
+    if not baselines:
+        return 0
+    predictions = model.predict_batch(model.encode([b["features"] for b in baselines]))
+    return sum(
+        store.record_prediction(b["patient_id"], b["visit_date"],
+                                dict(zip(model.outputs, predictions[i].tolist())), model.version)
+        for i, b in enumerate(baselines)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="纵向随访库：导入观测 / 记录预测 / 查看对照")
+    parser.add_argument("--db", default=VISIT_DB_FILE)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    importer = sub.add_parser("import", help="导入随访（CSV / JSON / JSONL：patient_id, visit, visit_date, 特征列）")
+    importer.add_argument("path")
+    predict = sub.add_parser("predict", help="为所有有基线的患者记录注册表中已拟合轨迹模型的预测")
+    predict.add_argument("--model-dir", default=os.getenv(MODEL_DIR_ENV, MODEL_DIR))
+    show = sub.add_parser("show", help="打印某患者的观测与预测对照")
+    show.add_argument("patient_id")
+    args = parser.parse_args()
+
+    store = VisitStore(args.db)
+    if args.cmd == "import":
+        records = load_cohort(args.path)
+        print(f"新增 {store.import_visits(records)} 条随访（共 {len(records)} 条记录）")
+    elif args.cmd == "predict":
+        # 与应用一致：只记录注册表中已拟合版本的预测，没有时不回退
+        model = ModelRegistry(args.model_dir).get(TrajectoryModel.ARTIFACT_NAME, TrajectoryModel.from_artifact)
+        if model is None or not model.fitted:
+            parser.error(f"{args.model_dir} 中没有已拟合的 {TrajectoryModel.ARTIFACT_NAME} 模型")
+        print(f"新增 {predict_baselines(store, model, store.patients(limit=-1))} 条预测（模型 {model.version}）")
+    elif args.cmd == "show":
+        for row in compare(store.history(args.patient_id)):
+            print(json.dumps(row, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+# utils/xray_analysis.py
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from utils.dicom_ingest import DICOM_SUFFIXES, verify_dicom
+from utils.xray_overlay import contrast_saliency
+
+# 上传的 X 线片按内容哈希存放：uploads/<前两位>/<sha256><扩展名>，同一张片子只存一份
+UPLOAD_DIR = "uploads"
+XRAY_DB_FILE = "xray.db"
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+# DICOM 原始检查（多帧、16 位未压缩）可达几十到几百 MB；落盘后按内存映射读取，
+# 但上传过程中 Streamlit 会把整个文件留在服务端内存里，上限因此不宜再高（见 .streamlit/config.toml）
+MAX_DICOM_UPLOAD_BYTES = 200 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+ALLOWED_SUFFIXES = (".png", ".jpg", ".jpeg")
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+# =============================================================================
+# 分块哈希与内容寻址存储
+# =============================================================================
+def hash_file(path: str, chunk_size: int = CHUNK_SIZE) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def store_upload(stream: BinaryIO, suffix: str, upload_dir: str = UPLOAD_DIR,
+                 max_bytes: Optional[int] = None, chunk_size: int = CHUNK_SIZE) -> Tuple[str, str]:
+    """
+    分块读取上传流：边写临时文件边计算 SHA-256，超过 max_bytes 立即中止；
+    完成后按哈希改名（已存在则丢弃临时文件）。返回 (sha256, 存储路径)。
+    """
+    suffix = suffix.lower()
+    if suffix not in ALLOWED_SUFFIXES + DICOM_SUFFIXES:
+        raise ValueError(f"不支持的文件类型: {suffix}")
+    if max_bytes is None:
+        max_bytes = MAX_DICOM_UPLOAD_BYTES if suffix in DICOM_SUFFIXES else MAX_UPLOAD_BYTES
+    root = Path(upload_dir)
+    root.mkdir(parents=True, exist_ok=True)
+
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=root, prefix=".upload.")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in iter(lambda: stream.read(chunk_size), b""):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"文件超过 {max_bytes // (1024 * 1024)} MB 上限")
+                digest.update(chunk)
+                out.write(chunk)
+        # 只接受能被解码的图像；DICOM 只校验头信息，不解码像素
+        if suffix in DICOM_SUFFIXES:
+            verify_dicom(tmp)
+        else:
+            with Image.open(tmp) as img:
+                img.verify()
+
+        sha = digest.hexdigest()
+        target = root / sha[:2] / f"{sha}{suffix}"
+        if target.exists():
+            os.unlink(tmp)
+        else:
+            target.parent.mkdir(exist_ok=True)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, target)
+        return sha, str(target)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+# =============================================================================
+# 分析器：结果带版本号，版本变化即视为旧缓存失效
+# =============================================================================
+class CannedAnalyzer:
+    """
+    尚未接入影像模型时的分析器：返回预先生成的结构化报告（assess_result.json 的 default），
+    版本号取该文件内容哈希，文件更新后旧缓存自动失效。
+    每张片子得到的都是同一份示例报告，界面上须标注为示例输出（sample=True）。
+    """
+
+    sample = True
+    # saliency() 只是局部对比度，不是模型注意力；界面据此命名叠加视图
+    placeholder_saliency = True
+
+    def __init__(self, report_path: str = "assess_result.json"):
+        self.report_path = report_path
+        self.version = f"canned-{hash_file(report_path)[:12]}"
+
+    def analyse(self, image_path: str) -> Dict:
+        with open(self.report_path, "r", encoding="utf-8") as f:
+            return json.load(f).get("default", {})
+
+    def saliency(self, gray: np.ndarray) -> np.ndarray:
+        """叠加视图用的显著图；此处为局部对比度占位，接入模型后改为模型的注意力图"""
+        return contrast_saliency(gray)
+
+
+# =============================================================================
+# 分析结果缓存（SQLite/WAL）：(图像哈希, 模型版本) -> 报告
+# =============================================================================
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS xray_analysis (
+    sha256        TEXT NOT NULL,
+    model_version TEXT NOT NULL,
+    created       REAL NOT NULL,
+    elapsed_ms    REAL NOT NULL,
+    report        TEXT NOT NULL,
+    PRIMARY KEY (sha256, model_version)
+);
+"""
+
+
+class AnalysisCache:
+    def __init__(self, db_path: str = XRAY_DB_FILE):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self.conn as conn:
+            conn.executescript(SCHEMA)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, sha256: str, model_version: str) -> Optional[Dict]:
+        row = self.conn.execute(
+            "SELECT created, elapsed_ms, report FROM xray_analysis WHERE sha256 = ? AND model_version = ?",
+            (sha256, model_version),
+        ).fetchone()
+        if row is None:
+            return None
+        return _entry(sha256, model_version, row["created"], row["elapsed_ms"], json.loads(row["report"]))
+
+    def put(self, sha256: str, model_version: str, report: Dict, elapsed_ms: float) -> Dict:
+        created = time.time()
+        with self.conn as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO xray_analysis (sha256, model_version, created, elapsed_ms, report) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (sha256, model_version, created, elapsed_ms, json.dumps(report, ensure_ascii=False)),
+            )
+        return _entry(sha256, model_version, created, elapsed_ms, report)
+
+    def purge_stale(self, current_version: str) -> int:
+        """删除其他模型版本产生的结果，返回删除行数"""
+        with self.conn as conn:
+            return conn.execute(
+                "DELETE FROM xray_analysis WHERE model_version != ?", (current_version,)
+            ).rowcount
+
+    def analyse(self, analyzer, sha256: str, image_path: str) -> Dict:
+        """命中直接返回；未命中时运行分析器并写入缓存。返回值带 cached 标记"""
+        entry = self.get(sha256, analyzer.version)
+        if entry is not None:
+            return {**entry, "cached": True}
+        started = time.perf_counter()
+        report = analyzer.analyse(image_path)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        return {**self.put(sha256, analyzer.version, report, elapsed_ms), "cached": False}
+
+
+def _entry(sha256: str, model_version: str, created: float, elapsed_ms: float, report: Dict) -> Dict:
+    return {"sha256": sha256, "model_version": model_version, "created": created,
+            "elapsed_ms": elapsed_ms, "report": report}
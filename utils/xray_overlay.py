@@ -0,0 +1,223 @@
+# utils/xray_overlay.py
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+from utils.dicom_ingest import DicomImage, is_dicom
+
+if TYPE_CHECKING:  # xray_preprocess 经 xray_analysis 反向导入本模块，运行时不导入
+    from utils.xray_preprocess import PreprocessedStore
+
+# 叠加图瓦片金字塔，按 (图像内容哈希, 分析器版本) 存放：
+#   overlays/<sha256>/<model_version>/manifest.json
+#   overlays/<sha256>/<model_version>/<level>/<x>_<y>.png
+# level 0 为整图缩到一个瓦片以内，每升一级边长翻倍，最高一级为原始分辨率。
+# 整套瓦片一次生成，缩放 / 平移只读取现成瓦片。
+OVERLAY_DIR = "overlays"
+TILE_SIZE = 256
+MAX_SOURCE_SIZE = 4096
+OVERLAY_ALPHA = 0.55
+MANIFEST_FILE = "manifest.json"
+# 混合按行带进行，4096² 的底图中间数组也只占几十 MB
+BLEND_ROWS = 512
+
+# jet 色图控制点（位置, R, G, B），与 result_heatmap.png 的配色一致
+JET_STOPS = (
+    (0.0, 0, 0, 128), (0.125, 0, 0, 255), (0.375, 0, 255, 255),
+    (0.625, 255, 255, 0), (0.875, 255, 0, 0), (1.0, 128, 0, 0),
+)
+
+
+def colormap_lut(stops=JET_STOPS) -> np.ndarray:
+    """由控制点线性插值出 256 级查找表 (256, 3) uint8"""
+    stops = np.asarray(stops, dtype=np.float32)
+    x = np.linspace(0.0, 1.0, 256, dtype=np.float32)
+    lut = np.stack([np.interp(x, stops[:, 0], stops[:, c]) for c in (1, 2, 3)], axis=1)
+    return np.round(lut).astype(np.uint8)
+
+
+JET_LUT = colormap_lut()
+
+
+def load_radiograph(path: str, max_size: int = MAX_SOURCE_SIZE) -> Image.Image:
+    """灰度底图；DICOM 取第一帧的加窗预览"""
+    if is_dicom(path):
+        return DicomImage(path).preview(0, max_size)
+    with Image.open(path) as img:
+        gray = ImageOps.exif_transpose(img).convert("L")
+    gray.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+    return gray
+
+
+def upsample_saliency(saliency: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    """模型输出的低分辨率显著图双线性放大到底图尺寸 (宽, 高)，并归一化到 [0, 1]"""
+    saliency = np.asarray(saliency, dtype=np.float32)
+    low, high = float(saliency.min()), float(saliency.max())
+    saliency = (saliency - low) / (high - low) if high > low else np.zeros_like(saliency)
+    return np.asarray(Image.fromarray(saliency).resize(size, Image.Resampling.BILINEAR))
+
+
+def blend(gray: np.ndarray, saliency: np.ndarray, lut: np.ndarray = JET_LUT,
+          alpha: float = OVERLAY_ALPHA) -> np.ndarray:
+    """
+    整幅向量化混合：显著图量化为查表下标取颜色，逐像素透明度随显著度增大，
+    低显著区域保留原片。gray (H, W) uint8，saliency (H, W) [0, 1]，返回 (H, W, 3) uint8。
+    """
+    index = np.clip(saliency * 255.0 + 0.5, 0, 255).astype(np.uint8)
+    color = lut[index].astype(np.float32)
+    weight = (alpha * np.clip(saliency, 0.0, 1.0))[..., None]
+    base = gray.astype(np.float32)[..., None]
+    return (base * (1.0 - weight) + color * weight + 0.5).astype(np.uint8)
+
+
+def pyramid_levels(width: int, height: int, tile_size: int = TILE_SIZE) -> int:
+    """level 0 整图不超过一个瓦片，之后每级翻倍直到原始分辨率"""
+    return max(1, int(np.ceil(np.log2(max(width, height, 1) / tile_size))) + 1)
+
+
+# =============================================================================
+# 生成与读取
+# =============================================================================
+def build_pyramid(radiograph: Image.Image, saliency: np.ndarray, out_dir: str,
+                  tile_size: int = TILE_SIZE, alpha: float = OVERLAY_ALPHA, meta: Optional[Dict] = None) -> Dict:
+    """
+    在原始分辨率上混合一次，逐级 2× 缩小（PIL reduce，盒式平均）并切瓦片。
+    先写到临时目录再整体改名，读者看不到只生成了一半的金字塔；并发生成时先完成者生效。
+    """
+    gray = np.asarray(radiograph.convert("L"))
+    height, width = gray.shape
+    weights = upsample_saliency(saliency, (width, height))
+    rgb = np.empty((height, width, 3), dtype=np.uint8)
+    for top in range(0, height, BLEND_ROWS):
+        rgb[top:top + BLEND_ROWS] = blend(gray[top:top + BLEND_ROWS], weights[top:top + BLEND_ROWS], alpha=alpha)
+    blended = Image.fromarray(rgb)
+
+    target = Path(out_dir)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(dir=target.parent, prefix=f".{target.name}."))
+    try:
+        levels = pyramid_levels(width, height, tile_size)
+        grid: List[Tuple[int, int]] = [(0, 0)] * levels
+        image = blended
+        for level in range(levels - 1, -1, -1):
+            cols, rows = -(-image.width // tile_size), -(-image.height // tile_size)
+            grid[level] = (cols, rows)
+            (staging / str(level)).mkdir()
+            for y in range(rows):
+                for x in range(cols):
+                    box = (x * tile_size, y * tile_size,
+                           min((x + 1) * tile_size, image.width), min((y + 1) * tile_size, image.height))
+                    image.crop(box).save(staging / str(level) / f"{x}_{y}.png", compress_level=1)
+            if level:
+                image = image.reduce(2)
+
+        manifest = {"width": width, "height": height, "tile_size": tile_size, "levels": levels,
+                    "grid": grid, "alpha": alpha, "meta": meta or {}}
+        (staging / MANIFEST_FILE).write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf-8")
+        os.chmod(staging, 0o755)
+        try:
+            os.rename(staging, target)
+        except OSError:
+            if not (target / MANIFEST_FILE).exists():
+                raise
+            shutil.rmtree(staging, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return manifest
+
+
+class OverlayPyramid:
+    """已生成的瓦片金字塔（只读）"""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.manifest = json.loads((self.root / MANIFEST_FILE).read_text(encoding="utf-8"))
+        self.levels: int = self.manifest["levels"]
+        self.tile_size: int = self.manifest["tile_size"]
+
+    def grid(self, level: int) -> Tuple[int, int]:
+        """该级的瓦片列数、行数"""
+        cols, rows = self.manifest["grid"][level]
+        return cols, rows
+
+    def tile(self, level: int, x: int, y: int) -> bytes:
+        return (self.root / str(level) / f"{x}_{y}.png").read_bytes()
+
+
+def pyramid_dir(sha256: str, model_version: str, root: str = OVERLAY_DIR) -> Path:
+    return Path(root) / sha256 / model_version
+
+
+def stored_saliency(pixels: np.ndarray, size: Tuple[int, int],
+                    saliency: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+    """
+    由预处理存储中的一行（居中裁成正方形、z-score 标准化）求显著图，
+    再按裁切位置放回整幅片子 size=(宽, 高) 比例的网格；被裁掉的两侧没有输入，显著度为 0。
+    """
+    pixels = np.asarray(pixels, dtype=np.float32)
+    low, high = float(pixels.min()), float(pixels.max())
+    scaled = (pixels - low) / (high - low) if high > low else np.zeros_like(pixels)
+    square = np.asarray(saliency((scaled * 255.0 + 0.5).astype(np.uint8)), dtype=np.float32)
+    grid_h, grid_w = square.shape
+    width, height = size
+    side = max(1, min(width, height))
+    full = np.zeros((max(grid_h, round(height * grid_h / side)), max(grid_w, round(width * grid_w / side))),
+                    dtype=np.float32)
+    top, left = (full.shape[0] - grid_h) // 2, (full.shape[1] - grid_w) // 2
+    full[top:top + grid_h, left:left + grid_w] = square
+    return full
+
+
+def get_pyramid(sha256: str, model_version: str, image_path: str,
+                saliency: Callable[[np.ndarray], np.ndarray], root: str = OVERLAY_DIR,
+                store: Optional["PreprocessedStore"] = None) -> OverlayPyramid:
+    """
+    已有则直接打开；没有时读取底图、求显著图并生成整套瓦片。
+    store 中已有这张片子（按内容哈希）时，显著图直接取预处理好的那一行，不再对底图重新求。
+    """
+    target = pyramid_dir(sha256, model_version, root)
+    if not (target / MANIFEST_FILE).exists():
+        radiograph = load_radiograph(image_path)
+        pixels = store.get(sha256) if store is not None else None
+        if pixels is None:
+            weights = saliency(np.asarray(radiograph))
+        else:
+            weights = stored_saliency(pixels, radiograph.size, saliency)
+        build_pyramid(radiograph, weights, str(target),
+                      meta={"sha256": sha256, "model_version": model_version,
+                            "preprocessed": pixels is not None})
+    return OverlayPyramid(str(target))
+
+
+def purge_stale(current_version: str, root: str = OVERLAY_DIR) -> int:
+    """删除其他分析器版本生成的金字塔，返回删除的目录数"""
+    removed = 0
+    for version_dir in Path(root).glob("*/*"):
+        if version_dir.is_dir() and version_dir.name != current_version and not version_dir.name.startswith("."):
+            shutil.rmtree(version_dir, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+def contrast_saliency(gray: np.ndarray, grid: int = 64) -> np.ndarray:
+    """
+    尚未接入影像模型时的占位显著图：缩到 grid×grid 后的梯度幅值再高斯平滑，
+    只反映局部对比度（骨缘、关节间隙），不代表模型判断。
+    """
+    small = Image.fromarray(gray).resize((grid, grid), Image.Resampling.BOX)
+    gy, gx = np.gradient(np.asarray(small, dtype=np.float32))
+    magnitude = np.hypot(gx, gy)
+    # 片子外框 / 裁切边缘的强梯度不是解剖结构，去掉边缘一圈
+    margin = max(1, grid // 16)
+    magnitude[:margin], magnitude[-margin:], magnitude[:, :margin], magnitude[:, -margin:] = 0, 0, 0, 0
+    magnitude = (255.0 * magnitude / max(float(magnitude.max()), 1e-6)).astype(np.uint8)
+    smooth = Image.fromarray(magnitude).filter(ImageFilter.GaussianBlur(grid / 16))
+    return np.asarray(smooth, dtype=np.float32) / 255.0
+
@@ -0,0 +1,190 @@
+# utils/xray_preprocess.py
+import argparse
+import hashlib
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from utils.dicom_ingest import DICOM_SUFFIXES, DicomImage, is_dicom
+from utils.xray_analysis import ALLOWED_SUFFIXES, hash_file
+
+# 预处理结果目录：
+#   <store>/images.npy   (n, size, size) 的 .npy，可 np.load(mmap_mode="r") 直接读取，不复制
+#   <store>/index.json   每行对应的源文件、内容哈希、原始尺寸与是否成功
+PREPROCESS_DIR = "preprocessed"
+IMAGE_SIZE = 512
+# float16 每张 512x512 片子 512 KiB；模型按批读取时再转 float32
+STORE_DTYPE = "float16"
+IMAGES_FILE = "images.npy"
+INDEX_FILE = "index.json"
+IMAGE_SUFFIXES = ALLOWED_SUFFIXES + DICOM_SUFFIXES
+
+
+def preprocess_image(source: Union[str, BinaryIO], size: int = IMAGE_SIZE) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """解码 → 灰度 → standardize；返回 (float32 数组, 原始宽高)"""
+    with Image.open(source) as img:
+        original = img.size
+        gray = ImageOps.exif_transpose(img).convert("L")
+    return standardize(gray, size), original
+
+
+def standardize(gray: Image.Image, size: int = IMAGE_SIZE) -> np.ndarray:
+    """居中裁成正方形 → 缩放 → 按图像 z-score 标准化"""
+    square = ImageOps.fit(gray, (size, size), method=Image.Resampling.BILINEAR)
+    pixels = np.asarray(square, dtype=np.float32) / 255.0
+    std = pixels.std()
+    return (pixels - pixels.mean()) / (std if std > 1e-6 else 1.0)
+
+
+# =============================================================================
+# worker 进程：各自以 r+ 映射同一个 .npy，直接写入自己负责的行，结果数组不经进程间传输；
+# 共享映射的写入立即进入页缓存，主进程与后续读者都能看到
+# =============================================================================
+_worker_images: Optional[np.ndarray] = None
+_worker_size = IMAGE_SIZE
+
+
+def _init_worker(images_path: str, size: int):
+    global _worker_images, _worker_size
+    _worker_images = np.load(images_path, mmap_mode="r+")
+    _worker_size = size
+
+
+def _process(task: Tuple[int, str]) -> Dict:
+    row, path = task
+    try:
+        if is_dicom(path):
+            # DICOM 取第一帧的加窗预览（内存映射，只读取样到的行）；原始宽高取头信息
+            dicom = DicomImage(path)
+            _worker_images[row] = standardize(dicom.preview(0, _worker_size), _worker_size)
+            return {"row": row, "source": path, "sha256": hash_file(path),
+                    "width": dicom.columns, "height": dicom.rows, "ok": True}
+        # 文件只读一次：同一份字节既算内容哈希（与上传缓存的键一致）又用于解码
+        with open(path, "rb") as f:
+            data = f.read()
+        pixels, (width, height) = preprocess_image(io.BytesIO(data), _worker_size)
+        _worker_images[row] = pixels
+        return {"row": row, "source": path, "sha256": hashlib.sha256(data).hexdigest(),
+                "width": width, "height": height, "ok": True}
+    except Exception as e:
+        return {"row": row, "source": path, "ok": False, "error": f"{type(e).__name__}: {e}"}
+
+
+# =============================================================================
+# 批量预处理
+# =============================================================================
+def find_images(inputs: Sequence[str]) -> List[str]:
+    paths = []
+    for item in inputs:
+        p = Path(item)
+        if p.is_dir():
+            paths.extend(sorted(str(f) for f in p.rglob("*") if f.suffix.lower() in IMAGE_SUFFIXES))
+        elif p.suffix.lower() in IMAGE_SUFFIXES:
+            paths.append(str(p))
+    return paths
+
+
+def preprocess_batch(paths: Sequence[str], out_dir: str, size: int = IMAGE_SIZE,
+                     workers: Optional[int] = None, progress=None) -> Dict:
+    """
+    并行预处理 paths，写入 out_dir 下的内存映射存储。
+    progress(done, total) 可选，用于打印进度。返回统计（含 images_per_sec）。
+    """
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    images_path = out / IMAGES_FILE
+    # 先由主进程建好整块文件（稀疏文件，不占实际空间），worker 只按行写入
+    images = np.lib.format.open_memmap(images_path, mode="w+", dtype=STORE_DTYPE,
+                                       shape=(len(paths), size, size))
+    del images
+
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(paths) // (workers * 8))
+    started = time.perf_counter()
+    entries: List[Dict] = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(str(images_path), size)) as pool:
+        for entry in pool.map(_process, enumerate(paths), chunksize=chunksize):
+            entries.append(entry)
+            if progress is not None:
+                progress(len(entries), len(paths))
+    elapsed = time.perf_counter() - started
+
+    ok = sum(1 for e in entries if e["ok"])
+    stats = {
+        "images": len(paths),
+        "ok": ok,
+        "failed": len(paths) - ok,
+        "seconds": round(elapsed, 3),
+        "images_per_sec": round(ok / elapsed, 1) if elapsed > 0 else 0.0,
+        "workers": workers,
+    }
+    index = {"size": size, "dtype": STORE_DTYPE, "normalization": "per-image z-score",
+             "created": time.time(), "stats": stats, "entries": entries}
+    (out / INDEX_FILE).write_text(json.dumps(index, ensure_ascii=False, indent=2), encoding="utf-8")
+    return stats
+
+
+# =============================================================================
+# 读取
+# =============================================================================
+class PreprocessedStore:
+    """只读打开预处理结果：images 为内存映射，按行切片不会复制整个数组"""
+
+    def __init__(self, store_dir: str = PREPROCESS_DIR):
+        root = Path(store_dir)
+        self.index = json.loads((root / INDEX_FILE).read_text(encoding="utf-8"))
+        self.images: np.ndarray = np.load(root / IMAGES_FILE, mmap_mode="r")
+        self._rows = {e["sha256"]: e["row"] for e in self.index["entries"] if e["ok"]}
+
+    def __len__(self) -> int:
+        return len(self.images)
+
+    def row_for(self, sha256: str) -> Optional[int]:
+        return self._rows.get(sha256)
+
+    def get(self, sha256: str) -> Optional[np.ndarray]:
+        row = self.row_for(sha256)
+        return None if row is None else self.images[row]
+
+    def batches(self, batch_size: int = 32):
+        """按批给模型：(行号数组, float32 批)；只有当前批被读入内存"""
+        ok_rows = np.array(sorted(self._rows.values()), dtype=np.int64)
+        for start in range(0, len(ok_rows), batch_size):
+            rows = ok_rows[start:start + batch_size]
+            yield rows, self.images[rows].astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="X 线片批量预处理（多进程）")
+    parser.add_argument("inputs", nargs="+", help="图像文件或目录（递归查找 png/jpg/jpeg/dcm）")
+    parser.add_argument("--out", default=PREPROCESS_DIR)
+    parser.add_argument("--size", type=int, default=IMAGE_SIZE)
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args()
+
+    paths = find_images(args.inputs)
+    if not paths:
+        parser.error("没有找到图像文件")
+
+    def progress(done: int, total: int):
+        if done == total or done % 100 == 0:
+            print(f"\r{done}/{total}", end="", flush=True)
+
+    stats = preprocess_batch(paths, args.out, args.size, args.workers, progress)
+    print()
+    print(f"{stats['ok']}/{stats['images']} 张，{stats['seconds']} 秒，"
+          f"{stats['images_per_sec']} 张/秒（{stats['workers']} 个进程）")
+    if stats["failed"]:
+        print(f"失败 {stats['failed']} 张，详见 {Path(args.out) / INDEX_FILE}")
+
+
+if __name__ == "__main__":
+    main()